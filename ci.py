@@ -95,6 +95,9 @@ def github_pr_post_result(ci_data, test):
     comment += f"Duration: {test.elapsed():.2f} seconds\n"
     comment += f"**Result: {test.verdict.name}**\n"
 
+    for name, value in test.stats.items():
+        comment += f"{name}: {value}\n"
+
     if test.output:
         comment += f"Output:\n```\n{test.output}\n```"
 
@@ -149,6 +152,7 @@ def report_ci(ci_data, test_list):
     summary = "Test Summary:\n"
 
     line = "{name:<30}{result:<10}{elapsed:.2f} seconds\n"
+    stat_line = "    {name}: {value}\n"
     fail_msg = "Test: {name} - {result}\nDesc: {desc}\nOutput:\n{output}\n"
 
     for test in test_list:
@@ -156,6 +160,8 @@ def report_ci(ci_data, test_list):
             # No need to add result of passed tests to simplify the email
             summary += line.format(name=test.name, result='PASS',
                                    elapsed=test.elapsed())
+            for name, value in test.stats.items():
+                summary += stat_line.format(name=name, value=value)
             continue
 
         # Rest of the verdicts use same output format
@@ -164,6 +170,8 @@ def report_ci(ci_data, test_list):
                                    desc=test.desc, output=test.output)
         summary += line.format(name=test.name, result=test.verdict.name,
                                elapsed=test.elapsed())
+        for name, value in test.stats.items():
+            summary += stat_line.format(name=name, value=value)
 
     if results != "":
         results = "Details\n" + results
@@ -171,7 +179,7 @@ def report_ci(ci_data, test_list):
     # Sending email
     send_email(ci_data, summary + '\n' + results)
 
-def create_test_list_user(ci_data):
+def create_test_list_user(ci_data, selector=None):
     # Setup CI tests
     # AR: Maybe read the test from config?
     #
@@ -189,35 +197,56 @@ def create_test_list_user(ci_data):
     test_list.append(ci.GitLint(ci_data))
 
     # BuildELL
-    test_list.append(ci.BuildEll(ci_data))
+    build_ell = ci.BuildEll(ci_data)
+    test_list.append(build_ell)
 
     # Build BlueZ
-    test_list.append(ci.BuildBluez(ci_data))
+    build_bluez = ci.BuildBluez(ci_data)
+    test_list.append(build_bluez)
 
-    # Make Check
-    test_list.append(ci.MakeCheck(ci_data))
+    # Make Check - Use the build tree of BuildBluez
+    make_check = ci.MakeCheck(ci_data)
+    make_check.add_requires(build_bluez)
+    test_list.append(make_check)
 
     # Make distcheck
-    test_list.append(ci.MakeDistcheck(ci_data))
+    make_distcheck = ci.MakeDistcheck(ci_data)
+    make_distcheck.add_requires(build_bluez)
+    test_list.append(make_distcheck)
 
     # Make check w/ Valgrind
-    test_list.append(ci.CheckValgrind(ci_data))
-
-    # Check Smatch
-    test_list.append(ci.CheckSmatch(ci_data, "user", tool_dir="/smatch"))
-
-    # Make with Exteranl ELL
-    test_list.append(ci.MakeExtEll(ci_data))
+    check_valgrind = ci.CheckValgrind(ci_data)
+    check_valgrind.add_requires(build_bluez)
+    test_list.append(check_valgrind)
+
+    # Check Smatch - Targeted mode checks the objects in the BuildBluez tree
+    ci_config = ci_data.config['space_details']['user'].get('ci', {})
+    smatch_config = ci_config.get('CheckSmatch', {})
+    check_smatch = ci.CheckSmatch(ci_data, "user", tool_dir="/smatch",
+                                  targeted=smatch_config.get('targeted', False))
+    check_smatch.add_requires(build_bluez)
+    test_list.append(check_smatch)
+
+    # Make with Exteranl ELL - Requires ELL installed by BuildEll
+    make_ext_ell = ci.MakeExtEll(ci_data,
+                        ell_pkg_config_path=build_ell.pkg_config_path())
+    make_ext_ell.add_requires(build_ell, build_bluez)
+    test_list.append(make_ext_ell)
 
     # Incremental Build
-    test_list.append(ci.IncrementalBuild(ci_data, "user"))
+    incremental_build = ci.IncrementalBuild(ci_data, "user",
+                                            selector=selector)
+    incremental_build.add_requires(build_bluez)
+    test_list.append(incremental_build)
 
     # Run ScanBuild
-    test_list.append(ci.ScanBuild(ci_data))
+    scan_build = ci.ScanBuild(ci_data)
+    scan_build.add_requires(build_bluez)
+    test_list.append(scan_build)
 
     return test_list
 
-def create_test_list_kernel(ci_data):
+def create_test_list_kernel(ci_data, selector=None):
     # Setup CI tests for kernel test
     # AR: Maybe read the test from config?
     #
@@ -243,80 +272,183 @@ def create_test_list_kernel(ci_data):
     # BuildKernel
     # Get the config from the bluez source tree
     kernel_config = os.path.join(ci_data.config['bluez_dir'], "doc", "ci.config")
-    test_list.append(ci.BuildKernel(ci_data, kernel_config=kernel_config))
+    build_kernel = ci.BuildKernel(ci_data, kernel_config=kernel_config)
+    test_list.append(build_kernel)
 
     # Check All Warning
-    test_list.append(ci.CheckAllWarning(ci_data, kernel_config=kernel_config))
+    check_config = ci_config['CheckAllWarning']
+    check_all_warning = ci.CheckAllWarning(ci_data,
+                                kernel_config=kernel_config,
+                                targeted=check_config.get('targeted', False),
+                                use_baseline=check_config.get('baseline', False))
+    check_all_warning.add_requires(build_kernel)
+    test_list.append(check_all_warning)
 
     # CheckSparse
-    test_list.append(ci.CheckSparse(ci_data, kernel_config=kernel_config))
+    check_config = ci_config['CheckSparse']
+    check_sparse = ci.CheckSparse(ci_data, kernel_config=kernel_config,
+                                targeted=check_config.get('targeted', False),
+                                use_baseline=check_config.get('baseline', False))
+    check_sparse.add_requires(build_kernel)
+    test_list.append(check_sparse)
 
     # CheckSmatch
     #test_list.append(ci.CheckSmatch(ci_data, "kernel", tool_dir="/smatch",
-    #                                kernel_config=kernel_config))
+    #                                kernel_config=kernel_config,
+    #                 targeted=ci_config['CheckSmatch'].get('targeted', False)))
 
     # BuildKernel32
-    test_list.append(ci.BuildKernel32(ci_data, kernel_config=kernel_config))
+    build_kernel32 = ci.BuildKernel32(ci_data, kernel_config=kernel_config)
+    build_kernel32.add_requires(build_kernel)
+    test_list.append(build_kernel32)
 
     # TestRunnerSetup
     tester_config = os.path.join(ci_data.config['bluez_dir'],
                                  "doc", "tester.config")
-    test_list.append(ci.TestRunnerSetup(ci_data, tester_config=tester_config,
-                     bluez_src_dir=ci_data.config['bluez_dir']))
+    testrunner_setup = ci.TestRunnerSetup(ci_data, tester_config=tester_config,
+                                   bluez_src_dir=ci_data.config['bluez_dir'])
+    testrunner_setup.add_requires(build_kernel)
+    test_list.append(testrunner_setup)
 
     # TestRunner-*
+    # The testers share the VMs in the pool
+    tester_pool = ci.TesterPool(ci_config['TestRunner'])
+    # The failed test cases are run again to find the flaky test cases
+    rerun_config = ci_config['TestRunner'].get('rerun')
+    # The test cases of the large testers are split into the shards
+    shards_config = ci_config['TestRunner'].get('shards', {})
     testrunner_list = ci_config['TestRunner']['tester-list']
+    # The testers in the batch run in one VM. The sharded testers run in
+    # their own VMs.
+    batches = {}
+    for names in ci_config['TestRunner'].get('batches', []):
+        names = [name for name in names if name in testrunner_list and
+                 shards_config.get(name, 1) == 1]
+        if not names:
+            continue
+        batch = ci.TesterBatch(names)
+        for name in names:
+            batches[name] = batch
     for runner in testrunner_list:
         log_debug(f"Add {runner} instance to test_list")
-        test_list.append(ci.TestRunner(ci_data, runner,
-                         bluez_src_dir=ci_data.config['bluez_dir']))
+        test_runner = ci.TestRunner(ci_data, runner,
+                                    bluez_src_dir=ci_data.config['bluez_dir'],
+                                    kernel_img=testrunner_setup.kernel_img,
+                                    tester_pool=tester_pool,
+                                    rerun_config=rerun_config,
+                                    shards=shards_config.get(runner, 1),
+                                    batch=batches.get(runner))
+        test_runner.add_requires(testrunner_setup)
+        test_list.append(test_runner)
 
     # # Incremental Build
-    test_list.append(ci.IncrementalBuild(ci_data, "kernel",
-                                         kernel_config=kernel_config))
+    incremental_build = ci.IncrementalBuild(ci_data, "kernel",
+                                            kernel_config=kernel_config,
+                                            selector=selector)
+    incremental_build.add_requires(build_kernel)
+    test_list.append(incremental_build)
 
     return test_list
 
+def get_blocker(ci_data, test):
+    """Return the required test which blocks the test by the fail-fast policy
+    or None"""
+    fail_fast = ci_data.config.get('fail-fast', {})
+    if not fail_fast.get('enable', False):
+        return None
+
+    verdicts = [ci.Verdict[v] for v in fail_fast.get('verdicts',
+                                                     ['FAIL', 'ERROR'])]
+    return test.blocked_by(verdicts)
+
+def run_test(ci_data, test):
+    log_info("##############################")
+    log_info(f"## CI: {test.name}")
+    log_info("##############################")
+
+    blocker = None if test.blocked else get_blocker(ci_data, test)
+    if test.blocked:
+        log_info(f"Skip {test.name}: {test.output}")
+    elif blocker:
+        reason = "was skipped" if blocker.blocked else "failed"
+        log_info(f"Skip {test.name}: {blocker.name} {reason}")
+        test.set_blocked(f"Skipped: Required test {blocker.name} {reason}")
+    else:
+        try:
+            test.run()
+        except ci.EndTest as e:
+            log_error(f"Test Ended(Failure): {test.name}:{test.verdict.name}")
+        except Exception as e:
+            log_error(f"Test Ended(Exception): {test.name}: {e.__class__}")
+        finally:
+            test.post_run()
+
+    if ci_data.config['dry_run']:
+        log_info("Skip submitting result to Github: dry_run=True")
+        return
+
+    log_debug("Submit the result to github")
+    # AR: Submit the result to GH
+    if not github_pr_post_result(ci_data, test):
+        log_error("Failed to submit the result to Github")
+
+def select_tests(ci_data, selector, test_list):
+    """Skip the tests not required by the files changed in the series and
+    return the list of skipped tests"""
+    if not selector.enable:
+        return []
+
+    files = ci_data.src_repo.git_diff_files(ci_data.base_commit())
+    if files is None:
+        log_error("Failed to get the changed files. Run all tests")
+        return []
+
+    log_debug(f"Files in series: {files}")
+    skipped = selector.select(test_list, files)
+    for test in skipped:
+        log_info(f"Test is not selected: {test.name}")
+        test.set_blocked("Skipped: No related change in the series")
+
+    return skipped
+
 def run_ci(ci_data):
 
     num_fails = 0
 
+    # Selects the tests with the changes in the series
+    selector = ci.TestSelector(ci_data.config.get('test-selection'),
+                               ci_data.config['space'])
+
     test_list = []
     if ci_data.config['space'] == 'user':
-        test_list = create_test_list_user(ci_data)
+        test_list = create_test_list_user(ci_data, selector)
     else:
-        test_list = create_test_list_kernel(ci_data)
+        test_list = create_test_list_kernel(ci_data, selector)
 
     log_info(f"Test list is created: {len(test_list)}")
+    not_selected = select_tests(ci_data, selector, test_list)
     log_debug("+--------------------------+")
     log_debug("|          Run CI          |")
     log_debug("+--------------------------+")
-    for test in test_list:
-        log_info("##############################")
-        log_info(f"## CI: {test.name}")
-        log_info("##############################")
+    scheduler_config = ci_data.config.get('scheduler', {})
+    if scheduler_config.get('enable', False):
+        # Run the tests concurrently with the dependencies and resources
+        scheduler = ci.Scheduler(test_list, scheduler_config)
+        scheduler.run(lambda test: run_test(ci_data, test))
+    else:
+        for test in test_list:
+            run_test(ci_data, test)
 
-        try:
-            test.run()
-        except ci.EndTest as e:
-            log_error(f"Test Ended(Failure): {test.name}:{test.verdict.name}")
-        except Exception as e:
-            log_error(f"Test Ended(Exception): {test.name}: {e.__class__}")
-        finally:
-            test.post_run()
+    # Remove the worktrees not used by the tests
+    ci_data.src_repo.worktree_gc()
 
+    for test in test_list:
+        # The tests not selected for the series are not failures
+        if test in not_selected:
+            continue
         if test.verdict != ci.Verdict.PASS:
             num_fails += 1
 
-        if ci_data.config['dry_run']:
-            log_info("Skip submitting result to Github: dry_run=True")
-            continue
-
-        log_debug("Submit the result to github")
-        # AR: Submit the result to GH
-        if not github_pr_post_result(ci_data, test):
-            log_error("Failed to submit the result to Github")
-
     log_info(f"Total number of failed test: {num_fails}")
     log_debug("+--------------------------+")
     log_debug("|        ReportCI          |")
@@ -353,6 +485,12 @@ def main():
 
     # Setup Source for the test that needs to access the base like incremental
     # build.
+    # Use the objects in the local mirror of the upstream, so the fetch only
+    # transfers the objects not in the mirror.
+    upstream = ci_data.config['space_details'][args.space]['upstream']
+    if ci_data.mirrors.add_alternates(ci_data.src_dir, upstream):
+        log_error("Failed to use the mirror. Fetch without the mirror")
+
     # It needs to fetch the extra patches: # of commit in PR + 1
     pr = ci_data.gh.get_pr(args.pr_num, force=True)
     cmd = ['fetch', f'--depth={pr.commits+1}']
@@ -1,4 +1,9 @@
-from .base import Base, EndTest, Verdict, submit_pw_check
+from .base import Base, EndTest, TreeAccess, Verdict, submit_pw_check
+from .scheduler import Scheduler
+from .testerpool import TesterPool
+from .testselector import TestSelector
+from .testeroutput import TestCase, TesterOutputParser, BatchOutputParser
+from .testerbatch import TesterBatch
 from .genericbuild import GenericBuild
 from .generickernelbuild import GenericKernelBuild
 from .buildbluez import BuildBluez
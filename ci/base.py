@@ -17,6 +17,12 @@ class Verdict(Enum):
     WARNING = 5
 
 
+class TreeAccess(Enum):
+    NONE = 0
+    SHARED = 1
+    EXCLUSIVE = 2
+
+
 class EndTest(Exception):
     """
     End of Test
@@ -31,6 +37,22 @@ class Base(ABC):
         self.end_time = 0
         self.verdict = Verdict.PENDING
         self.output = ""
+        # Extra information reported with the result. i.e. cache statistics
+        self.stats = {}
+
+        # Scheduling information used by ci.Scheduler
+        # requires: tests need to be finished before running this test
+        # resources: resources used while running. i.e. cpu, memory(MB).
+        #            Other names are used as a lock. i.e. build_tree:<path>
+        # tree_access: how the test uses the source tree. The test changing
+        #              the source tree(i.e. git checkout) needs EXCLUSIVE.
+        self.requires = []
+        self.resources = {'cpu': 1}
+        self.tree_access = TreeAccess.EXCLUSIVE
+
+        # Set if the test is skipped without running, i.e. the required test
+        # failed or the test is not selected for the changes
+        self.blocked = False
 
     def success(self):
         self.end_timer()
@@ -65,6 +87,26 @@ class Base(ABC):
         self.end_timer()
         raise EndTest
 
+    def add_stat(self, name, value):
+        self.stats[name] = value
+
+    def add_requires(self, *tests):
+        self.requires.extend(tests)
+
+    def blocked_by(self, verdicts):
+        """Return the required test which ended with one of the verdicts or
+        is blocked by other test, otherwise None"""
+        for test in self.requires:
+            if test.verdict in verdicts or test.blocked:
+                return test
+        return None
+
+    def set_blocked(self, msg):
+        """Skip the test without running it"""
+        self.blocked = True
+        self.verdict = Verdict.SKIP
+        self.output = msg
+
     def start_timer(self):
         self.start_time = time.time()
 
@@ -9,7 +9,8 @@ class BuildBluez(GenericBuild):
     """
 
     def __init__(self, ci_data, src_dir=None, config_params=None,
-                 make_params=None, dry_run=None):
+                 make_params=None, dry_run=None, use_ccache=True,
+                 use_build_tree=True):
 
         self.name = "BluezMake"
         self.desc = "Build BlueZ"
@@ -28,8 +29,17 @@ class BuildBluez(GenericBuild):
             self.log_dbg(f"Override the dry_run flag: {dry_run}")
             self.dry_run = dry_run
 
+        # Compiler cache can be disabled if the build replaces the compiler
+        ccache = ci_data.ccache if use_ccache else None
+
+        # Build in the out-of-tree build directory for the config_params.
+        # Other tests with the same config_params reuse the built tree.
+        build_trees = ci_data.build_trees if use_build_tree else None
+
         super().__init__(config_params=config_params, work_dir=self.src_dir,
-                         make_params=self.make_params)
+                         make_params=self.make_params, ccache=ccache,
+                         build_trees=build_trees,
+                         compile_timer=ci_data.compile_timer)
 
         self.log_dbg("Initialization completed")
 
@@ -67,3 +77,5 @@ class BuildBluez(GenericBuild):
 
     def post_run(self):
         self.log_dbg("Post Run...")
+
+        super().post_run()
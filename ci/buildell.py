@@ -1,14 +1,19 @@
+import os
 import sys
 
 sys.path.insert(0, '../libs')
-from libs import cmd_run
+from libs import cmd_run, CacheStore, RepoTool
 
-from ci import Verdict, EndTest, submit_pw_check
+from ci import TreeAccess, Verdict, EndTest, submit_pw_check
 from ci import GenericBuild
 
 class BuildEll(GenericBuild):
     """Build ELL class
     This class build and install the ELL
+    ELL is installed to the staging prefix in the cache root instead of the
+    system, and the prefix is saved as the tarball for the ELL commit. If the
+    tarball is saved already, it is restored without the build. The user of
+    the ELL finds it with PKG_CONFIG_PATH(pkg_config_path()).
     """
 
     def __init__(self, ci_data, src_dir=None):
@@ -18,14 +23,53 @@ class BuildEll(GenericBuild):
         self.desc = "Build and Install ELL"
         self.ci_data = ci_data
 
-        super().__init__(work_dir=ci_data.config['ell_dir'], install=True)
+        ell_dir = ci_data.config['ell_dir']
+        if src_dir:
+            ell_dir = src_dir
+
+        # Staging prefix for the ELL commit
+        ell_commit = RepoTool("ell", ell_dir).git_rev_parse("HEAD")
+        self.cache_key = CacheStore.make_key(ell_commit)
+        self.prefix = os.path.join(ci_data.cache_root, "ell",
+                                   self.cache_key[:16])
+
+        super().__init__(config_params=[f"--prefix={self.prefix}"],
+                         work_dir=ell_dir, install=True,
+                         ccache=ci_data.ccache,
+                         compile_timer=ci_data.compile_timer)
+
+        # ELL is built in its own source directory
+        self.tree_access = TreeAccess.NONE
 
         self.log_dbg("Initialization completed")
 
+    def pkg_config_path(self):
+        return os.path.join(self.prefix, "lib", "pkgconfig")
+
+    def restore(self):
+        """Restore the installed ELL from the saved tarball"""
+        if os.path.exists(self.pkg_config_path()):
+            self.log_info(f"ELL is already installed: {self.prefix}")
+            return True
+
+        return self.ci_data.cache_store.get_dir(self.name, self.cache_key,
+                                                self.prefix)
+
     def run(self):
 
         self.log_dbg("Run")
 
+        if self.restore():
+            self.log_info("Use the saved ELL")
+            self.add_stat("ELL cache", "hit")
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.PASS,
+                            "Build ELL PASS",
+                            None, self.ci_data.config['dry_run'])
+            self.success()
+            return
+
+        self.add_stat("ELL cache", "miss")
         try:
             super().run()
         except EndTest as e:
@@ -43,6 +87,10 @@ class BuildEll(GenericBuild):
             # Just raise the EndTest enough
             raise EndTest
 
+        # Save the installed ELL for the next run
+        self.ci_data.cache_store.put_dir(self.name, self.cache_key,
+                                         self.prefix)
+
         # Build success
         submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                         self.name, Verdict.PASS,
@@ -54,3 +102,5 @@ class BuildEll(GenericBuild):
 
     def post_run(self):
         self.log_dbg("Post Run...")
+
+        super().post_run()
@@ -19,7 +19,8 @@ class BuildKernel(GenericKernelBuild):
     """
 
     def __init__(self, ci_data, kernel_config=None, simple_build=True,
-                 make_params=None, src_dir=None, dry_run=None):
+                 make_params=None, src_dir=None, dry_run=None,
+                 use_ccache=True, use_build_tree=True):
 
         # Common
         self.name = "BuildKernel"
@@ -45,8 +46,18 @@ class BuildKernel(GenericKernelBuild):
         # Save the error output
         self.stderr = None
 
+        # Compiler cache can be disabled if the build replaces the compiler
+        ccache = ci_data.ccache if use_ccache else None
+
+        # Build in the output directory for the config and make_params
+        build_trees = ci_data.build_trees if use_build_tree else None
+
         super().__init__(kernel_config=kernel_config, simple_build=simple_build,
-                         make_params=make_params, work_dir=self.src_dir)
+                         make_params=make_params, work_dir=self.src_dir,
+                         ccache=ccache, build_trees=build_trees,
+                         base_commit=ci_data.base_commit(),
+                         config_store=ci_data.cache_store,
+                         compile_timer=ci_data.compile_timer)
 
         self.log_dbg("Initialization completed")
 
@@ -84,5 +95,4 @@ class BuildKernel(GenericKernelBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        self.log_dbg("Clean the source")
         super().post_run()
@@ -49,7 +49,12 @@ class BuildKernel32(GenericKernelBuild):
         self.log_dbg(f"New config for 32bit is created: {new_config}")
 
         super().__init__(kernel_config=new_config, simple_build=simple_build,
-                         make_params=make_params, work_dir=self.src_dir)
+                         make_params=make_params, work_dir=self.src_dir,
+                         ccache=ci_data.ccache,
+                         build_trees=ci_data.build_trees,
+                         base_commit=ci_data.base_commit(),
+                         config_store=ci_data.cache_store,
+                         compile_timer=ci_data.compile_timer)
 
         self.log_dbg("Initialization completed")
 
@@ -87,7 +92,6 @@ class BuildKernel32(GenericKernelBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        self.log_dbg("Clean the source")
         super().post_run()
 
 
@@ -111,8 +115,15 @@ class BuildKernel32(GenericKernelBuild):
         basedir = os.path.dirname(os.path.abspath(orig_config))
         new_config = os.path.join(basedir,
                         os.path.basename(os.path.abspath(orig_config)) + ".32")
+        contents = "".join(contents)
+
+        # Keep the file if it has the same contents
+        if os.path.exists(new_config):
+            with open(new_config, "r") as f:
+                if f.read() == contents:
+                    return new_config
+
         with open(new_config, "w+") as f:
-            contents = "".join(contents)
             f.write(contents)
 
         return new_config
@@ -1,6 +1,8 @@
 import os
 import sys
-import re
+
+sys.path.insert(0, '../libs')
+from libs import DiagnosticParser, DiagnosticStore
 
 from ci import Verdict, EndTest, submit_pw_check
 from ci import GenericKernelBuild
@@ -8,9 +10,14 @@ from ci import GenericKernelBuild
 class CheckAllWarning(GenericKernelBuild):
     """Run kernel build with all warning enabled
     This class runs the kernel build with all warning enabled.
+    If targeted is True, only the objects affected by the files in the series
+    are rebuilt and checked.
+    If use_baseline is True, the diagnostics are compared with the baseline of
+    the base commit and only the new diagnostics are reported.
     """
 
-    def __init__(self, ci_data, kernel_config=None, src_dir=None, dry_run=None):
+    def __init__(self, ci_data, kernel_config=None, src_dir=None, dry_run=None,
+                 targeted=False, use_baseline=False):
 
         self.name = "CheckAllWarning"
         self.desc = "Run linux kernel with all warning enabled"
@@ -30,8 +37,25 @@ class CheckAllWarning(GenericKernelBuild):
             self.log_dbg(f"Override the dry_run flag: {dry_run}")
             self.dry_run = dry_run
 
+        # Check only the objects affected by the series
+        self.targeted = targeted
+
+        # Base commit to compare the diagnostics with
+        self.baseline_commit = None
+        if use_baseline:
+            self.baseline_commit = ci_data.base_commit()
+        self.tool_ver = None
+
         super().__init__(kernel_config=kernel_config, simple_build=True,
-                         make_params=['W=1'], work_dir=self.src_dir)
+                         make_params=['W=1'], work_dir=self.src_dir,
+                         ccache=ci_data.ccache,
+                         build_trees=ci_data.build_trees,
+                         base_commit=ci_data.base_commit(),
+                         config_store=ci_data.cache_store,
+                         compile_timer=ci_data.compile_timer)
+
+        if self.baseline_commit:
+            self.tool_ver = self.tool_version(["gcc", "--version"])
 
         self.log_dbg("Initialization completed")
 
@@ -39,6 +63,21 @@ class CheckAllWarning(GenericKernelBuild):
 
         self.log_dbg("Run")
 
+        # Diagnostics of the base commit
+        baseline = None
+        if self.baseline_commit:
+            baseline = self.load_baseline(self.ci_data.cache_store,
+                                          self.ci_data.src_repo,
+                                          self.baseline_commit, self.tool_ver)
+
+        if self.targeted:
+            file_list = self.ci_data.series_file_list()
+            self.set_check_targets(file_list)
+
+        # Parse the diagnostics while the checker is running
+        self.diagnostic_parser = DiagnosticParser(self.name,
+                                                  src_path=self.src_path)
+
         try:
             super().run()
         except EndTest as e:
@@ -58,9 +97,29 @@ class CheckAllWarning(GenericKernelBuild):
             # Just raising EndTest exception is enough here
             raise EndTest
 
-        # self.stderr contains the error messages to process
-        output_dict = self.parse_output(self.stderr)
-        if output_dict == None:
+        records = self.diagnostic_parser.store
+        self.add_stat("diagnostics", len(records))
+
+        # Report the diagnostics not in the baseline
+        if baseline is not None:
+            new_records = self.new_diagnostics(records, baseline)
+            if new_records:
+                output_str = DiagnosticStore.format(new_records)
+                submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                                self.name, Verdict.WARNING,
+                                "CheckAllWarning WARNING " + output_str,
+                                None, self.dry_run)
+                self.warning(output_str)
+                return
+
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.PASS,
+                            "CheckAllWarning PASS",
+                            None, self.dry_run)
+            self.success()
+            return
+
+        if not len(records):
             # Build success
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                             self.name, Verdict.PASS,
@@ -71,16 +130,15 @@ class CheckAllWarning(GenericKernelBuild):
             self.success()
             return
 
-        # Check files in the patch
-        file_list = self.series_get_file_list(self.ci_data, self.ci_data.series,
-                                              ignore_new_file=True)
-
-        # File exist in otput_dict?
-        output_str = ""
-        for fn in file_list:
-            if fn in output_dict:
-                self.log_dbg("Found file in the output_dict")
-                output_str += "".join(output_dict[fn])
+        # Check the diagnostics in the lines changed by the series. If the
+        # changed lines are not available, check the files in the patch.
+        index = self.ci_data.changed_line_index()
+        if index:
+            found = records.in_lines(index)
+        else:
+            found = records.in_files(
+                self.ci_data.series_file_list(ignore_new_file=True))
+        output_str = DiagnosticStore.format(found)
 
         if output_str != "":
             # Found error and return warning
@@ -103,133 +161,4 @@ class CheckAllWarning(GenericKernelBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        self.log_dbg("Clean the source")
         super().post_run()
-
-    def parse_output(self, output):
-        """Read output log and creates the dict whcih has key with file path
-        and the value is the output log in list
-        """
-
-        # Convert output log to list
-        output_line = output.splitlines()
-
-        # if empty, return None
-        if not len(output_line):
-            self.log_dbg("Empty output. Nothing to do")
-            return None
-
-        output_dict = {}
-        curr_key = None
-
-        for line in output_line:
-            self.log_dbg(f"LINE: {line}")
-            # If line is empty, skip
-            if line.strip() == "":
-                continue
-
-            # Read file name from the string
-            fn = line.split(':')[0]
-            self.log_dbg(f"PROCESS: {fn}")
-
-            # if it is .c file, ignore inc_file flag and curr_key.
-            if fn.find(".c") != -1:
-                self.log_dbg("Found .C file. Set key string")
-                curr_key = fn
-
-            # Insert the line
-            if curr_key not in output_dict:
-                output_dict[curr_key] = [line]
-            else:
-                output_dict[curr_key].append(line)
-
-        return output_dict
-
-    def patch_get_new_file_list(self, patch):
-        """
-        Parse patch to get the file that is newly added
-        """
-
-        file_list = []
-
-        # If patch has no contents, return empty file
-        if patch == None:
-            self.log_err("WARNING: No file found in patch")
-            return file_list
-
-        # split patch(in string) to list of string by newline
-        lines = patch.split('\n')
-        iter_lines = iter(lines)
-        for line in iter_lines:
-            try:
-                if re.search(r'^\-\-\- ', line):
-                    if line.find('dev/null') >= 0:
-                        # Detect new file. Read next line to get the filename
-                        line2 = next(iter_lines)
-                        file_list.append(line2[line2.find('/')+1:])
-            except StopIteration:
-                # End of iteration or no next line. Nothing to do. Just pass
-                pass
-        self.log_dbg(f"New file in the patch: {file_list}")
-
-        return file_list
-
-    def patch_get_file_list(self, patch):
-        """
-        Parse patch to get the file list
-        """
-
-        file_list = []
-
-        # If patch has no contents, return empty file
-        if patch == None:
-            self.log_err("WARNING: No file found in patch")
-            return file_list
-
-        # split patch(in string) to list of string by newline
-        lines = patch.split('\n')
-        for line in lines:
-            # Use --- (before) instead of +++ (after).
-            # If new file is added, --- is /dev/null and can be ignored
-            # If file is removed, file in --- still exists in the tree
-            # The corner case is if the patch adds new files. Even in this case
-            # even if new files are ignored, Makefile should be changed as well
-            # so it still can be checked.
-            if re.search(r'^\-\-\- ', line):
-                # For new file, it should be dev/null. Ignore the file.
-                if line.find('dev/null') >= 0:
-                    self.log_dbg("New file is added. Ignore in the file list")
-                    continue
-
-                # Trim the '--- /'
-                file_list.append(line[line.find('/')+1:])
-        self.log_dbg(f"files found in the patch: {file_list}")
-
-        return file_list
-
-    def series_get_file_list(self, ci_data, series, ignore_new_file=False):
-        """
-        Get the list of files from the patches in the series
-        """
-
-        file_list = []
-        new_file_list = []
-
-        for patch in series['patches']:
-            full_patch = ci_data.pw.get_patch(patch['id'])
-            file_list += self.patch_get_file_list(full_patch['diff'])
-            if ignore_new_file:
-                new_file_list += self.patch_get_new_file_list(full_patch['diff'])
-
-        if ignore_new_file == False or len(new_file_list) == 0:
-            return file_list
-
-        self.log_dbg("Check if new file is in the file list")
-        new_list = []
-        for filename in file_list:
-            if filename in new_file_list:
-                self.log_dbg(f"file: {filename} is in new_file_list. Don't count")
-                continue
-            new_list.append(filename)
-
-        return new_list
@@ -1,6 +1,8 @@
 import os
 import sys
-import re
+
+sys.path.insert(0, '../libs')
+from libs import cmd_run, DiagnosticParser, DiagnosticStore, STDERR_TAIL
 
 from ci import Base, Verdict, EndTest, submit_pw_check
 from ci import BuildBluez, BuildKernel
@@ -15,10 +17,17 @@ class CheckSmatch(Base):
     For kernel(bluetooth-next)
     $ make CHECK="<path/to/smatch/smatch -p=kernel" C=1 
               <path/to/src...>
+    If targeted is True, only the objects affected by the files in the series
+    are checked. For kernel, the objects are given to make as the targets.
+    For user space, the source is built with the normal compiler first and
+    the affected objects are rebuilt with cgcc. The build uses its own tree
+    for the smatch config, since the objects in the tree are replaced by the
+    cgcc objects. If no affected object is found, all objects are rebuilt
+    with cgcc.
     """
 
     def __init__(self, ci_data, space, tool_dir, kernel_config=None,
-                 src_dir=None, dry_run=None):
+                 src_dir=None, dry_run=None, targeted=False):
 
         self.name = "CheckSmatch"
         self.desc = "Run smatch tool with source"
@@ -41,7 +50,11 @@ class CheckSmatch(Base):
             self.log_dbg(f"Override the dry_run flag: {dry_run}")
             self.dry_run = dry_run
 
+        # Check only the objects affected by the series
+        self.targeted = targeted
+
         self.target = None
+        self.check_params = []
         make_params = []
         if self.space == "kernel":
             make_params.append(f"CHECK={self.tool_dir}/smatch -p=kernel")
@@ -54,14 +67,31 @@ class CheckSmatch(Base):
                              "--disable-ubsan", "--disable-android"]
             make_params.append(f"CHECK={self.tool_dir}/smatch --full-path")
             make_params.append(f"CC={self.tool_dir}/cgcc")
-            # Set the dry_run=True so it won't submit the result to the pw
-            self.target = BuildBluez(self.ci_data, config_params=config_params,
-                                     make_params=make_params, dry_run=True)
+            if self.targeted:
+                # Build in the tree of the config_params and rebuild the
+                # affected objects with make_params. The tree is not shared
+                # with BuildBluez.
+                self.check_params = make_params
+                self.target = BuildBluez(self.ci_data,
+                                         config_params=config_params,
+                                         dry_run=True)
+            else:
+                # Set the dry_run=True so it won't submit the result to the
+                # pw. cgcc runs the checker with the compiler, so it can't be
+                # cached.
+                self.target = BuildBluez(self.ci_data,
+                                         config_params=config_params,
+                                         make_params=make_params,
+                                         dry_run=True, use_ccache=False)
         else:
             self.target = None
 
         super().__init__()
 
+        if self.target:
+            self.resources = self.target.resources
+            self.tree_access = self.target.tree_access
+
         self.log_dbg("Initialization completed")
 
     def run(self):
@@ -74,6 +104,18 @@ class CheckSmatch(Base):
             self.log_err(f"Invalid setup: space: {self.space}")
             self.add_failure_end_test("Invalid setup")
 
+        file_list = None
+        if self.targeted:
+            file_list = self.ci_data.series_file_list()
+            if self.space == "kernel":
+                self.target.set_check_targets(file_list)
+
+        # Parse the diagnostics while the checker is running. In the targeted
+        # user space mode, only the objects rebuilt with cgcc are checked.
+        parser = DiagnosticParser(self.name, src_path=self.src_path)
+        if not (self.targeted and self.space == "user"):
+            self.target.diagnostic_parser = parser
+
         try:
             self.target.run()
         except EndTest as e:
@@ -81,6 +123,12 @@ class CheckSmatch(Base):
         finally:
             self.log_info(f"Test verdict: {self.target.verdict.name}")
 
+        if self.targeted and self.space == "user" and \
+           self.target.verdict != Verdict.FAIL:
+            self.target.stderr = self.check_objects(file_list, parser)
+
+        self.stats.update(self.target.stats)
+
         # Report the result to Patchwork if the build itself failed
         if self.target.verdict == Verdict.FAIL:
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
@@ -89,9 +137,9 @@ class CheckSmatch(Base):
                             None, self.dry_run)
             self.add_failure_end_test(self.target.output)
 
-        # self.stderr contains the error messages to process
-        output_dict = self.parse_output(self.target.stderr)
-        if output_dict == None:
+        records = parser.store
+        self.add_stat("diagnostics", len(records))
+        if not len(records):
             # Build success
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                             self.name, Verdict.PASS,
@@ -101,19 +149,16 @@ class CheckSmatch(Base):
             # reference
             self.success()
             return
-        self.log_dbg(f"Output files: {output_dict}")
-
-        # Check files in the patch
-        file_list = self.series_get_file_list(self.ci_data, self.ci_data.series,
-                                              ignore_new_file=True)
 
-        # File exist in otput_dict?
-        output_str = ""
-        for fn in file_list:
-            if fn in output_dict:
-                self.log_dbg("Found file in the output_dict")
-                output_str += "".join(output_dict[fn])
-        self.log_dbg(f"Output String: {output_str}")
+        # Check the diagnostics in the lines changed by the series. If the
+        # changed lines are not available, check the files in the patch.
+        index = self.ci_data.changed_line_index()
+        if index:
+            found = records.in_lines(index)
+        else:
+            found = records.in_files(
+                self.ci_data.series_file_list(ignore_new_file=True))
+        output_str = DiagnosticStore.format(found)
 
         if output_str != "":
             # Found error and return warning
@@ -133,148 +178,58 @@ class CheckSmatch(Base):
         # reference
         self.success()
 
+    def check_objects(self, file_list, parser=None):
+        """Rebuild the objects affected by the files with the checker and
+        return the output of the checker. All objects are rebuilt if no
+        affected object is found. The output is parsed by the
+        parser(libs.DiagnosticParser) while the checker is running."""
+        objects = self.target.affected_objects(file_list)
+        if not objects:
+            # The change may not be in the dependencies, i.e. the new files.
+            # Check all objects.
+            self.log_info("No affected object found. Check all objects")
+            (ret, stdout, stderr) = cmd_run(["make", "clean"],
+                                            cwd=self.target.build_dir)
+            if ret:
+                self.log_err("Failed to clean the objects")
+                submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                                self.name, Verdict.FAIL,
+                                "CheckSmatch: FAIL: " + stderr,
+                                None, self.dry_run)
+                self.add_failure_end_test(stderr)
+
+        for obj in objects:
+            obj_path = os.path.join(self.target.build_dir, obj)
+            if os.path.exists(obj_path):
+                os.remove(obj_path)
+
+        cmd = ["make", "-j4"] + self.check_params + objects
+        cmd += self.target.timing_params()
+        if parser:
+            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.target.build_dir,
+                                            stderr_cb=parser.feed,
+                                            stderr_tail=STDERR_TAIL)
+        else:
+            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.target.build_dir)
+        self.target.update_timing_stats()
+        if ret:
+            self.log_err("Failed to check the objects")
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.FAIL,
+                            "CheckSmatch: FAIL: " + stderr,
+                            None, self.dry_run)
+            self.add_failure_end_test(stderr)
+
+        return stderr
+
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        self.log_dbg("Clean the source")
         self.target.post_run()
 
-    def parse_output(self, output):
-        """Read output log and creates the dict whcih has key with file path
-        and the value is the output log in list
-        """
-
-        # Convert output log to list
-        output_line = output.splitlines()
-
-        # if empty, return None
-        if not len(output_line):
-            return None
-
-        output_dict = {}
-        inc_file = False
-        curr_key = None
-
-        for line in output_line:
-            self.log_dbg(f"LINE: {line}")
-            # If line is empty, skip
-            if line.strip() == "":
-                continue
-
-            # Read file name from the string
-            fn = line.split(':')[0]
-            self.log_dbg(f"PROCESS: {fn}")
-
-            # if it is .c file, ignore inc_file flag and curr_key.
-            if fn.find(".c") != -1:
-                self.log_dbg("Found .C file. reset flag")
-                inc_file = False
-                curr_key = None
-            if inc_file:
-                self.log_dbg("Include file")
-                output_dict[curr_key].append(line)
-                continue
-
-            # Check output_dict if it is already exist.
-            if fn not in output_dict:
-                output_dict[fn] = [line]
-            else:
-                output_dict[fn].append(line)
-
-            # Special case. If the line contains "in included file",
-            # the following .H files belong here.
-            if line.find('note: in included file:') != -1:
-                self.log_dbg("Found include file string")
-                curr_key = fn
-                inc_file = True
-
-        return output_dict
-
-    def patch_get_new_file_list(self, patch):
-        """
-        Parse patch to get the file that is newly added
-        """
-
-        file_list = []
-
-        # If patch has no contents, return empty file
-        if patch == None:
-            self.log_err("WARNING: No file found in patch")
-            return file_list
-
-        # split patch(in string) to list of string by newline
-        lines = patch.split('\n')
-        iter_lines = iter(lines)
-        for line in iter_lines:
-            try:
-                if re.search(r'^\-\-\- ', line):
-                    if line.find('dev/null') >= 0:
-                        # Detect new file. Read next line to get the filename
-                        line2 = next(iter_lines)
-                        file_list.append(line2[line2.find('/')+1:])
-            except StopIteration:
-                # End of iteration or no next line. Nothing to do. Just pass
-                pass
-        self.log_dbg(f"New file in the patch: {file_list}")
-
-        return file_list
-
-    def patch_get_file_list(self, patch):
-        """
-        Parse patch to get the file list
-        """
-
-        file_list = []
-
-        # If patch has no contents, return empty file
-        if patch == None:
-            self.log_err("WARNING: No file found in patch")
-            return file_list
-
-        # split patch(in string) to list of string by newline
-        lines = patch.split('\n')
-        for line in lines:
-            # Use --- (before) instead of +++ (after).
-            # If new file is added, --- is /dev/null and can be ignored
-            # If file is removed, file in --- still exists in the tree
-            # The corner case is if the patch adds new files. Even in this case
-            # even if new files are ignored, Makefile should be changed as well
-            # so it still can be checked.
-            if re.search(r'^\-\-\- ', line):
-                # For new file, it should be dev/null. Ignore the file.
-                if line.find('dev/null') >= 0:
-                    self.log_dbg("New file is added. Ignore in the file list")
-                    continue
-
-                # Trim the '--- /'
-                file_list.append(line[line.find('/')+1:])
-        self.log_dbg(f"files found in the patch: {file_list}")
-
-        return file_list
-
-    def series_get_file_list(self, ci_data, series, ignore_new_file=False):
-        """
-        Get the list of files from the patches in the series
-        """
-
-        file_list = []
-        new_file_list = []
-
-        for patch in series['patches']:
-            full_patch = ci_data.pw.get_patch(patch['id'])
-            file_list += self.patch_get_file_list(full_patch['diff'])
-            if ignore_new_file:
-                new_file_list += self.patch_get_new_file_list(full_patch['diff'])
-
-        if ignore_new_file == False or len(new_file_list) == 0:
-            return file_list
-
-        self.log_dbg("Check if new file is in the file list")
-        new_list = []
-        for filename in file_list:
-            if filename in new_file_list:
-                self.log_dbg(f"file: {filename} is in new_file_list. Don't count")
-                continue
-            new_list.append(filename)
-
-        return new_list
+    def src_path(self, path):
+        """Convert the path in the output to the path in the source tree"""
+        if not self.target.build_tree:
+            return path
+
+        return self.target.build_tree.src_path(path)
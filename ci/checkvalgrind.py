@@ -11,7 +11,8 @@ from ci import GenericBuild
 class CheckValgrind(GenericBuild):
     """BlueZ Make Check with Valgrind
     This class runs 'make check' with Valgrind. Unlike MakeCheck, it needs to
-    build the source, so it expects the source is clean
+    build the source with its own config options, so it uses its own build
+    tree
     """
 
     def __init__(self, ci_data):
@@ -27,7 +28,9 @@ class CheckValgrind(GenericBuild):
         config_params = ["--disable-lsan", "--disable-asan"]
         make_params = ["check"]
         super().__init__(config_params=config_params, make_params=make_params,
-                         work_dir=ci_data.src_dir)
+                         work_dir=ci_data.src_dir, ccache=ci_data.ccache,
+                         build_trees=ci_data.build_trees,
+                         compile_timer=ci_data.compile_timer)
 
         self.log_dbg("Initialization completed")
 
@@ -63,14 +66,7 @@ class CheckValgrind(GenericBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        if self.verdict == Verdict.PENDING:
-            self.log_info("No verdict. skip post-run")
-            return
+        super().post_run()
 
-        # Clean the source
-        cmd = ["make", "maintainer-clean"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Fail to clean the source")
-
-        # AR: hum... should it continue the test?
+        # Nothing to clean. The build tree is kept for other tests with the
+        # same config options.
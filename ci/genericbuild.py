@@ -1,21 +1,32 @@
+import os
 import sys
 
 sys.path.insert(0, '../libs')
-from libs import cmd_run
+from libs import cmd_run, CCache, CompileTimer, STDERR_TAIL
 
-from ci import Base
+from ci import Base, TreeAccess
 
 class GenericBuild(Base):
     """Generic Build class
     This class is used to configure and make the application such as Bluez and
     ELL. It only executes and updates verdict without reporting the result to
     the Patchwork. The report to Patchwork should be done by the child class.
+    If ccache(libs.CCache) is given and enabled, the compiler is wrapped with
+    ccache and the hit/miss statistics are added to the test stats.
+    If build_trees(libs.BuildTreeManager) is given, the source is built in the
+    out-of-tree(VPATH) build directory for the variant of the build, and the
+    tree is shared with other tests with the same variant. The configure step
+    is skipped if the tree is already configured.
+    If compile_timer(libs.CompileTimer) is given and enabled, make runs the
+    recipes with the timing shell wrapper. The timeline of the build is kept
+    in the timer directory and the slowest targets are reported.
     """
 
     def __init__(self, config_cmd=None, config_params=None,
                  make_cmd=None, make_params=None,
                  use_fakeroot=False, install=False, install_params=None,
-                 work_dir=None):
+                 work_dir=None, ccache=None, build_trees=None,
+                 compile_timer=None):
 
         super().__init__()
 
@@ -40,21 +51,88 @@ class GenericBuild(Base):
 
         self.stderr = None
 
+        # If set(libs.DiagnosticParser), the diagnostics are parsed while
+        # building
+        self.diagnostic_parser = None
+
+        # Build directory. The variant has the configure options and the
+        # make variables(i.e CC=) which change the objects, but not the targets
+        self.build_tree = None
+        self.build_dir = work_dir
+        if build_trees:
+            variant = list(config_params or [])
+            variant += [p for p in (make_params or []) if '=' in p]
+            self.build_tree = build_trees.get_tree(work_dir, variant)
+            self.build_dir = self.build_tree.path
+
+        # make -j4 in the build directory. It only reads the source tree.
+        self.resources = {'cpu': 4, 'memory': 1024,
+                          f"build_tree:{self.build_dir}": 1}
+        self.tree_access = TreeAccess.SHARED
+
+        # Compiler cache. The stats log is created when the test runs, so
+        # it is not left if the test doesn't run.
+        self.ccache = None
+        self.ccache_log = None
+        if ccache and ccache.enable:
+            self.ccache = ccache
+
+        # Per target compile timing
+        self.compile_timer = None
+        self.timing_log = None
+        if compile_timer and compile_timer.enable:
+            self.compile_timer = compile_timer
+            self.timing_log = compile_timer.new_log(self.name)
+
         self.log_dbg("Initialization completed")
 
+    def build_env(self, stats=False):
+        """Return the extra environment variables for configure and make.
+        The ccache stats log is used only if stats is True, so only the make
+        step is counted in the stats."""
+        if not self.ccache:
+            return None
+
+        env = self.ccache.env(base_dir=self.work_dir,
+                              stats_log=self.ccache_log if stats else None)
+        # configure saves CC to the Makefile so make uses it too
+        env['CC'] = self.ccache.cc()
+        return env
+
+    def update_ccache_stats(self):
+        if not self.ccache:
+            return
+
+        stats = CCache.read_stats(self.ccache_log)
+        self.log_info(f"GenericBuild: ccache: {CCache.format_stats(stats)}")
+        self.add_stat("ccache", CCache.format_stats(stats))
+
+    def timing_params(self):
+        """Return the make parameters for the compile timing"""
+        if not self.compile_timer:
+            return []
+
+        return self.compile_timer.make_params(self.timing_log)
+
+    def update_timing_stats(self):
+        if not self.compile_timer:
+            return
+
+        records, report = self.compile_timer.save_report(self.timing_log)
+        self.log_info(f"GenericBuild: Compile timing: {self.timing_log}\n"
+                      f"{report}")
+        self.add_stat("compile timing", CompileTimer.format_stats(records))
+
     def run(self):
 
         self.log_dbg("GenericBuild: Run")
         self.start_timer()
 
+        if self.ccache and not self.ccache_log:
+            self.ccache_log = self.ccache.new_stats_log(self.name)
+
         # Configure
-        cmd = [self.config_cmd]
-        if self.config_params:
-            cmd = cmd + self.config_params
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
-        if ret:
-            self.log_err(f"GenericBuild: Configure failed: {ret}")
-            self.add_failure_end_test(stderr)
+        self.configure()
 
         # Make
         # AR: Maybe read from /proc for job count
@@ -63,7 +141,19 @@ class GenericBuild(Base):
             cmd = ["fakeroot"] + cmd
         if self.make_params:
             cmd = cmd + self.make_params
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
+        cmd = cmd + self.timing_params()
+        if self.diagnostic_parser:
+            (ret, stdout, stderr) = cmd_run(cmd,
+                                            add_env=self.build_env(stats=True),
+                                            cwd=self.build_dir,
+                                            stderr_cb=self.diagnostic_parser.feed,
+                                            stderr_tail=STDERR_TAIL)
+        else:
+            (ret, stdout, stderr) = cmd_run(cmd,
+                                            add_env=self.build_env(stats=True),
+                                            cwd=self.build_dir)
+        self.update_ccache_stats()
+        self.update_timing_stats()
         if ret:
             self.log_err(f"GenericBuild: Make failed: {ret}")
             self.add_failure_end_test(stderr)
@@ -75,7 +165,8 @@ class GenericBuild(Base):
             cmd = [self.make_cmd, "install"]
             if self.install_params:
                 cmd = cmd + [self.install_params]
-            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
+            (ret, stdout, stderr) = cmd_run(cmd, add_env=self.build_env(),
+                                            cwd=self.build_dir)
             if ret:
                 self.log_err(f"GenericBuild: Install failed: {ret}")
                 self.add_failure_end_test(stderr)
@@ -84,5 +175,63 @@ class GenericBuild(Base):
 
         self.success()
 
+    def affected_objects(self, files):
+        """Return the objects in the build dir which depend on the changed
+        files. The dependencies are read from the .deps/*.Po(.Plo) files
+        generated by the previous build.
+        """
+        objects = []
+        for root, dir_names, file_names in os.walk(self.build_dir):
+            if os.path.basename(root) != ".deps":
+                continue
+
+            for fn in file_names:
+                if not fn.endswith((".Po", ".Plo")):
+                    continue
+
+                with open(os.path.join(root, fn), "r", errors="ignore") as f:
+                    deps = f.read().replace("\\\n", " ")
+
+                # First rule is "object: source headers..."
+                rule = deps.split("\n", 1)[0]
+                if ":" not in rule:
+                    # Dummy file for the object not built yet
+                    continue
+                obj, srcs = rule.split(":", 1)
+                for src in srcs.split():
+                    src_path = src
+                    if self.build_tree:
+                        src_path = self.build_tree.src_path(src)
+                    if src_path in files:
+                        objects.append(obj.strip())
+                        break
+
+        self.log_dbg(f"GenericBuild: Affected objects: {objects}")
+        return objects
+
+    def configure(self):
+        if self.build_tree and self.build_tree.configured:
+            self.log_info(f"GenericBuild: Reuse the configured tree: "
+                          f"{self.build_dir}")
+            return
+
+        if self.build_tree:
+            cmd = self.build_tree.configure_cmd()
+        else:
+            cmd = [self.config_cmd]
+        if self.config_params:
+            cmd = cmd + self.config_params
+        (ret, stdout, stderr) = cmd_run(cmd, add_env=self.build_env(),
+                                        cwd=self.build_dir)
+        if ret:
+            self.log_err(f"GenericBuild: Configure failed: {ret}")
+            self.add_failure_end_test(stderr)
+
+        if self.build_tree:
+            self.build_tree.configured = True
+
     def post_run(self):
         self.log_dbg("GenericBuild: Post Run...")
+
+        CCache.remove_stats_log(self.ccache_log)
+        self.ccache_log = None
@@ -1,11 +1,30 @@
 import os
 import sys
 import shutil
+import fnmatch
+import hashlib
+import tempfile
+import threading
 
 sys.path.insert(0, '../libs')
-from libs import cmd_run
+from libs import cmd_run, CacheStore, CCache, CompileTimer, DiagnosticParser
+from libs import STDERR_TAIL
+from libs.ccache import KBUILD_REPRODUCIBLE_ENV
 
-from ci import Base
+from ci import Base, TreeAccess
+
+# Serialize the source clean between the builds running at the same time
+_prepare_lock = threading.Lock()
+
+# Directories built by the simple build
+SIMPLE_BUILD_DIRS = ['net/bluetooth/', 'drivers/bluetooth/']
+
+# The change of these files requires the config to be updated
+RECONFIG_PATTERNS = ['Kconfig*', '*/Kconfig*', 'arch/*/configs/*']
+
+# The change of these files may affect any object. Rebuild all targets
+FULL_BUILD_PATTERNS = ['Makefile*', '*/Makefile*', 'Kbuild*', '*/Kbuild*',
+                       'include/*', 'arch/*/include/*', 'scripts/*']
 
 class GenericKernelBuild(Base):
     """Generic Kernel Build class
@@ -15,10 +34,37 @@ class GenericKernelBuild(Base):
     net/bluetooth and drivers/bluetooth.
     Full Build (simple_build=False) - Full build based on the config that
     enables all Bluetooth features.
+    If ccache(libs.CCache) is given and enabled, the kernel is built with
+    CC="ccache gcc" and the fixed build timestamp/user/host so the objects
+    can be reused between the builds.
+    If build_trees(libs.BuildTreeManager) is given, the kernel is built in the
+    output directory(O=) for the (config, make_params) variant instead of the
+    source directory. The output directory is kept across the tests and the
+    runs with the same base_commit, so the build is incremental and no clean
+    is required.
+    The config step is skipped if the tree is already configured, and the
+    make targets can be overridden with targets(i.e. affected_targets()) to
+    rebuild only the part of the tree. set_check_targets() sets the object
+    targets for the checker(C=, W=) so only the objects affected by the
+    changed files are rebuilt and checked.
+    If config_store(libs.CacheStore) is given, the resolved .config for the
+    (config, Kconfig files, arch, compiler) is saved in the store, and the
+    .config in the build dir is replaced only if the contents are different,
+    so the timestamp is kept and kbuild doesn't rebuild the objects.
+    The checker can compare its diagnostics with the baseline, the
+    diagnostics of the base commit, which is built once and saved in the
+    libs.CacheStore for the (base commit, config, tool version). The baseline
+    is built in the worktree of the base commit with a new output directory,
+    so all objects are checked and the source tree is not changed.
+    If compile_timer(libs.CompileTimer) is given and enabled, the build(not
+    the config and the baseline) runs the recipes with the timing shell
+    wrapper(SHELL=) and the slowest targets are reported.
     """
 
     def __init__(self, kernel_config=None, simple_build=True,
-                 make_params=None, work_dir=None):
+                 make_params=None, work_dir=None, ccache=None,
+                 build_trees=None, base_commit=None, config_store=None,
+                 compile_timer=None):
 
         super().__init__()
 
@@ -37,57 +83,587 @@ class GenericKernelBuild(Base):
         # Save the error output
         self.stderr = None
 
+        # If set, the diagnostics are parsed while building
+        self.diagnostic_parser = None
+
+        # Store of the resolved configs
+        self.config_store = config_store
+
+        # The baseline output directory is created under the build root
+        self.baseline_root = build_trees.root() if build_trees else None
+
+        # Override the make targets. None builds the default targets
+        self.targets = None
+
+        # Configured state of the in-tree build
+        self._configured = False
+
+        # Output directory
+        self.build_tree = None
+        self.build_dir = work_dir
+        if build_trees:
+            variant = [f"config={self.config_hash()}"]
+            variant += self.make_params or []
+            self.build_tree = build_trees.get_tree(work_dir, variant,
+                                                   persist_key=base_commit)
+            self.build_dir = self.build_tree.path
+
+        # make -j4 in the output directory. It only reads the source tree if
+        # the output directory is used.
+        self.resources = {'cpu': 4, 'memory': 2048,
+                          f"build_tree:{self.build_dir}": 1}
+        if self.build_tree:
+            self.tree_access = TreeAccess.SHARED
+
+        # Compiler cache. The stats log is created when the test runs, so
+        # it is not left if the test doesn't run.
+        self.ccache = None
+        self.ccache_log = None
+        if ccache and ccache.enable:
+            self.ccache = ccache
+
+        # Per target compile timing. Kbuild uses bash for the recipes.
+        self.compile_timer = None
+        self.timing_log = None
+        if compile_timer and compile_timer.enable:
+            self.compile_timer = compile_timer
+            self.timing_log = compile_timer.new_log(self.name,
+                                                    shell="/bin/bash")
+
         self.log_dbg("Initialization completed")
 
+    def config_hash(self):
+        """Return the hash of the kernel config contents"""
+        if not os.path.exists(self.kernel_config):
+            return self.kernel_config
+
+        with open(self.kernel_config, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def o_params(self):
+        """Return the make parameters for the output directory"""
+        if not self.build_tree:
+            return []
+
+        return [f"O={self.build_dir}"]
+
+    def prepare_source(self):
+        """Out-of-tree build requires the clean source directory. Remove the
+        config and the generated files of the previous in-tree build if any.
+        """
+        if not self.build_tree:
+            return
+
+        with _prepare_lock:
+            if not os.path.exists(os.path.join(self.work_dir, ".config")):
+                return
+
+            self.log_info("GenericKernelBuild: Source is not clean. "
+                          "Run mrproper")
+            (ret, stdout, stderr) = cmd_run(["make", "mrproper"],
+                                            cwd=self.work_dir)
+        if ret:
+            self.log_err("GenericKernelBuild: Failed to clean the source")
+            self.add_failure_end_test(stderr)
+
+    def is_configured(self):
+        if self.build_tree:
+            return self.build_tree.configured
+
+        return self._configured
+
+    def set_configured(self, configured):
+        if self.build_tree:
+            self.build_tree.configured = configured
+        else:
+            self._configured = configured
+
+    def default_targets(self):
+        if self.simple_build:
+            return list(SIMPLE_BUILD_DIRS)
+
+        return []
+
+    def affected_targets(self, files):
+        """Return the make targets to rebuild for the changed files.
+        The directory of the changed source is rebuilt. None is returned if
+        the change requires all default targets to be rebuilt, and the empty
+        list if nothing needs to be rebuilt. The config is marked as not
+        configured if the change affects the config.
+        """
+        targets = []
+        for f in files:
+            if any(fnmatch.fnmatch(f, p) for p in RECONFIG_PATTERNS):
+                self.log_info(f"GenericKernelBuild: {f}: Reconfig required")
+                self.set_configured(False)
+                return None
+
+            if any(fnmatch.fnmatch(f, p) for p in FULL_BUILD_PATTERNS):
+                self.log_info(f"GenericKernelBuild: {f}: Full build required")
+                return None
+
+            if not f.endswith(('.c', '.h', '.S')):
+                self.log_dbg(f"GenericKernelBuild: {f}: Not a source. Skip")
+                continue
+
+            dir_name = os.path.dirname(f)
+            if not dir_name:
+                return None
+            target = dir_name + '/'
+
+            # The simple build doesn't build the objects outside the
+            # Bluetooth dirs but the header may be included by them.
+            if self.simple_build:
+                in_scope = any(target.startswith(d) for d in SIMPLE_BUILD_DIRS)
+                if not in_scope:
+                    if f.endswith('.h'):
+                        self.log_info(f"GenericKernelBuild: {f}: "
+                                      "Full build required")
+                        return None
+                    continue
+
+            if target not in targets:
+                targets.append(target)
+
+        return targets
+
+    def _object_files(self):
+        """Return the objects in the build dir with its .cmd file path"""
+        if self.simple_build:
+            dirs = [os.path.join(self.build_dir, d) for d in SIMPLE_BUILD_DIRS]
+        else:
+            dirs = [self.build_dir]
+
+        objects = []
+        for top in dirs:
+            for root, dir_names, file_names in os.walk(top):
+                for fn in file_names:
+                    if not (fn.startswith('.') and fn.endswith('.o.cmd')):
+                        continue
+                    obj = os.path.relpath(os.path.join(root, fn[1:-4]),
+                                          self.build_dir)
+                    objects.append((obj, os.path.join(root, fn)))
+
+        return objects
+
+    def object_targets(self, files):
+        """Return the object targets affected by the changed files.
+        The object of the changed source is used, and the objects including
+        the changed header are found from the dependencies in the .cmd files
+        of the previous build. None is returned if the objects can't be
+        decided, i.e. the tree is not built yet, the build files changed, the
+        object of the changed source is not built yet(i.e. the new source), or
+        no object is affected.
+        """
+        for f in files:
+            if any(fnmatch.fnmatch(f, p)
+                   for p in RECONFIG_PATTERNS + ['Makefile*', '*/Makefile*',
+                                                 'Kbuild*', '*/Kbuild*']):
+                self.log_info(f"GenericKernelBuild: {f}: Full check required")
+                return None
+
+        objects = self._object_files()
+        if not objects:
+            self.log_info("GenericKernelBuild: No objects in the tree")
+            return None
+
+        built = [obj for obj, cmd_file in objects]
+        headers = [f for f in files if f.endswith('.h')]
+        targets = []
+        for f in files:
+            if not f.endswith(('.c', '.S')):
+                continue
+            # The simple build doesn't build the sources outside its dirs
+            if self.simple_build and \
+               not any(f.startswith(d) for d in SIMPLE_BUILD_DIRS):
+                continue
+            if f[:-2] + '.o' not in built:
+                self.log_info(f"GenericKernelBuild: {f}: No object built. "
+                              "Full check required")
+                return None
+            targets.append(f[:-2] + '.o')
+
+        if headers:
+            for obj, cmd_file in objects:
+                if obj in targets:
+                    continue
+                with open(cmd_file, 'r', errors='ignore') as cf:
+                    deps = cf.read()
+                for h in headers:
+                    if f"/{h} " in deps or f" {h} " in deps:
+                        targets.append(obj)
+                        break
+
+        if not targets:
+            self.log_info("GenericKernelBuild: No affected object. "
+                          "Full check required")
+            return None
+
+        self.log_dbg(f"GenericKernelBuild: Affected objects: {targets}")
+        return targets
+
+    def set_check_targets(self, files):
+        """Set the targets to the objects affected by the changed files.
+        The objects are removed first, so they are rebuilt and checked even
+        if they are up to date. The default targets are checked if the
+        objects can't be decided. The empty target list is never set, since
+        it means nothing to build.
+        """
+        targets = self.object_targets(files)
+        if not targets:
+            self.targets = None
+            return
+
+        for obj in targets:
+            obj_path = os.path.join(self.build_dir, obj)
+            if os.path.exists(obj_path):
+                os.remove(obj_path)
+        self.targets = targets
+
+    def build_env(self, stats=False):
+        """Return the extra environment variables for make. The ccache stats
+        log is used only if stats is True, so the config step is not counted
+        in the stats."""
+        if not self.ccache:
+            return None
+
+        env = self.ccache.env(base_dir=self.work_dir,
+                              stats_log=self.ccache_log if stats else None)
+        env.update(KBUILD_REPRODUCIBLE_ENV)
+        return env
+
+    def cc_params(self):
+        """Return the make parameters for the compiler.
+        It needs to be same for all make commands including the config
+        target. Otherwise, kbuild sees the compiler change and rebuilds all.
+        """
+        if not self.ccache:
+            return []
+
+        return [f"CC={self.ccache.cc()}"]
+
+    def update_ccache_stats(self):
+        if not self.ccache:
+            return
+
+        stats = CCache.read_stats(self.ccache_log)
+        self.log_info(f"GenericKernelBuild: ccache: "
+                      f"{CCache.format_stats(stats)}")
+        self.add_stat("ccache", CCache.format_stats(stats))
+
+    def timing_params(self):
+        """Return the make parameters for the compile timing. SHELL is not
+        in the saved command lines(.cmd), so the objects are not rebuilt."""
+        if not self.compile_timer:
+            return []
+
+        return self.compile_timer.make_params(self.timing_log)
+
+    def update_timing_stats(self):
+        if not self.compile_timer:
+            return
+
+        records, report = self.compile_timer.save_report(self.timing_log)
+        self.log_info(f"GenericKernelBuild: Compile timing: "
+                      f"{self.timing_log}\n{report}")
+        self.add_stat("compile timing", CompileTimer.format_stats(records))
+
     def run(self):
         self.log_dbg("GenericKernelBuild: Run")
         self.start_timer()
 
-        # Copy the build config to source dir
-        self.log_info(f"GenericKernelBuild: Copying {self.kernel_config}")
-        shutil.copy(self.kernel_config, os.path.join(self.work_dir, ".config"))
+        if self.ccache and not self.ccache_log:
+            self.ccache_log = self.ccache.new_stats_log(self.name)
 
-        # Update .config
-        self.log_info("GenericKernelBuild: Run make olddefconfig")
-        cmd = ["make", "olddefconfig"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
-        if ret:
-            self.log_err("GenericKernelBuild: Failed to config the kernel")
-            self.add_failure_end_test(stderr)
+        if self.targets == []:
+            self.log_info("GenericKernelBuild: No target to build")
+            self.stderr = ""
+            self.success()
+            return
+
+        self.prepare_source()
+
+        if self.is_configured():
+            self.log_info("GenericKernelBuild: Reuse the configured tree: "
+                          f"{self.build_dir}")
+        else:
+            self.config()
 
         # make
         self.log_info("Run make")
 
-        base_cmd = ["make", "-j4"]
-        if self.make_params:
-            base_cmd += self.make_params
+        base_cmd = self.make_cmd()
         self.log_dbg(f"GenericKernelBuild: Base Command: {base_cmd}")
 
-        if self.simple_build:
+        if self.targets is not None:
+            self.log_info(f"GenericKernelBuild: Targets: {self.targets}")
+            cmd = base_cmd + self.targets
+        elif self.simple_build:
             self.log_info("GenericKernelBuild: Simple build - Bluetooth only")
-            cmd = base_cmd
-            cmd.append('net/bluetooth/')
-            cmd.append('drivers/bluetooth/')
-            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
-            if ret:
-                self.log_err("GenericKernelBuild: build fail")
-                self.add_failure_end_test(stderr)
-            self.stderr = stderr
+            cmd = base_cmd + self.default_targets()
         else:
             # full build
             self.log_info("Full build")
             cmd = base_cmd
-            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
-            if ret:
-                self.log_err("GenericKernelBuild: build fail")
-                self.add_failure_end_test(stderr)
-            self.stderr = stderr
+        cmd = cmd + self.timing_params()
+        (ret, stdout, stderr) = self.run_make(cmd, self.diagnostic_parser)
+        self.update_ccache_stats()
+        self.update_timing_stats()
+        if ret:
+            self.log_err("GenericKernelBuild: build fail")
+            self.add_failure_end_test(stderr)
+        self.stderr = stderr
 
         self.success()
 
+    def run_make(self, cmd, parser=None):
+        """Run the make command. If the parser(libs.DiagnosticParser) is
+        given, the stderr is parsed while the make is running and only the
+        tail of the stderr is kept."""
+        env = self.build_env(stats=True)
+        if not parser:
+            return cmd_run(cmd, add_env=env, cwd=self.work_dir)
+
+        return cmd_run(cmd, add_env=env, cwd=self.work_dir,
+                       stderr_cb=parser.feed, stderr_tail=STDERR_TAIL)
+
+    def make_cmd(self):
+        """Return the make command without the targets"""
+        cmd = ["make", "-j4"] + self.o_params() + self.cc_params()
+        if self.make_params:
+            cmd += self.make_params
+
+        return cmd
+
+    def kconfig_hash(self):
+        """Return the hash of the Kconfig files in the source"""
+        cmd = ["git", "ls-files", "-s", "--", "Kconfig*", "*/Kconfig*"]
+        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
+        if ret:
+            self.log_err("GenericKernelBuild: Failed to read Kconfig files")
+            return None
+
+        return hashlib.sha1(stdout.encode()).hexdigest()
+
+    def arch(self):
+        for param in self.make_params or []:
+            if param.startswith("ARCH="):
+                return param[len("ARCH="):]
+
+        return os.uname().machine
+
+    def config(self):
+        config_file = os.path.join(self.build_dir, ".config")
+
+        key = None
+        if self.config_store:
+            kconfig_hash = self.kconfig_hash()
+            if kconfig_hash:
+                key = CacheStore.make_key(self.config_hash(), kconfig_hash,
+                                          self.arch(), self.cc_params())
+
+        data = None
+        if key:
+            data = self.config_store.get("kernel-config", key)
+
+        if data is not None:
+            self.log_info("GenericKernelBuild: Use the saved config")
+            self.update_config(config_file, data['config'])
+        else:
+            resolved = self.resolve_config(config_file)
+            if key:
+                self.config_store.put("kernel-config", key,
+                                      {'config': resolved})
+
+        self.set_configured(True)
+
+    def update_config(self, config_file, contents):
+        """Replace the .config only if the contents are different"""
+        if os.path.exists(config_file):
+            with open(config_file, "r") as f:
+                if f.read() == contents:
+                    self.log_info("GenericKernelBuild: .config is not changed")
+                    return
+
+        self.log_info("GenericKernelBuild: Update .config")
+        with open(config_file, "w") as f:
+            f.write(contents)
+
+    def resolve_config(self, config_file):
+        """Copy the config and run olddefconfig. Returns the resolved config.
+        The timestamp of the .config is restored if the contents are same
+        as before.
+        """
+        old_contents = None
+        old_stat = None
+        if os.path.exists(config_file):
+            old_stat = os.stat(config_file)
+            with open(config_file, "r") as f:
+                old_contents = f.read()
+
+        # Copy the build config to build dir
+        self.log_info(f"GenericKernelBuild: Copying {self.kernel_config}")
+        shutil.copy(self.kernel_config, config_file)
+
+        # Update .config
+        self.log_info("GenericKernelBuild: Run make olddefconfig")
+        cmd = ["make", "olddefconfig"] + self.o_params() + self.cc_params()
+        (ret, stdout, stderr) = cmd_run(cmd, add_env=self.build_env(),
+                                        cwd=self.work_dir)
+        if ret:
+            self.log_err("GenericKernelBuild: Failed to config the kernel")
+            self.add_failure_end_test(stderr)
+
+        with open(config_file, "r") as f:
+            contents = f.read()
+
+        if contents == old_contents:
+            self.log_info("GenericKernelBuild: .config is not changed")
+            os.utime(config_file, ns=(old_stat.st_atime_ns,
+                                      old_stat.st_mtime_ns))
+
+        return contents
+
+    def tool_version(self, cmd):
+        """Return the first line of the version output of the tool"""
+        (ret, stdout, stderr) = cmd_run(cmd)
+        if ret:
+            self.log_err(f"GenericKernelBuild: Failed to run {cmd}")
+            return None
+
+        return stdout.strip().split("\n")[0]
+
+    def baseline_key(self, base_commit, tool_version):
+        # "full": the baseline is built with all objects in the new output
+        # directory
+        return CacheStore.make_key(base_commit, self.config_hash(),
+                                   tool_version, self.make_params or [],
+                                   "full")
+
+    def diagnostics(self, records):
+        """Return the dict of the normalized diagnostic(Diagnostic.key()) to
+        the records. The line and the column numbers are not in the key since
+        the patch moves the lines.
+        """
+        diags = {}
+        for record in records:
+            diags.setdefault(record.key(), []).append(record)
+
+        return diags
+
+    def new_diagnostics(self, records, baseline):
+        """Return the records which are not in the baseline. The diagnostics
+        are counted, so the same diagnostic added to the file again is
+        reported too.
+        """
+        base_count = {}
+        for diag in baseline:
+            base_count[diag] = base_count.get(diag, 0) + 1
+
+        new_records = []
+        for diag, diag_records in self.diagnostics(records).items():
+            new_records += diag_records[base_count.get(diag, 0):]
+
+        return new_records
+
+    def build_baseline(self, repo, base_commit):
+        """Build the default targets at the base commit and return the
+        normalized diagnostics or None if it fails. The base commit is
+        checked out in the "base" worktree of the repo and built in a new
+        output directory, so the diagnostics of all objects are found.
+        """
+        self.log_info(f"GenericKernelBuild: Build baseline: {base_commit}")
+        with repo.worktree("base", base_commit) as base_repo:
+            if not base_repo:
+                self.log_err("GenericKernelBuild: Failed to setup the "
+                             "worktree for the baseline")
+                return None
+
+            out_dir = tempfile.mkdtemp(prefix=f"{self.name}-baseline-",
+                                       dir=self.baseline_root)
+            try:
+                return self._build_baseline(base_repo.path(), out_dir)
+            finally:
+                shutil.rmtree(out_dir, ignore_errors=True)
+
+    def _build_baseline(self, src_dir, out_dir):
+        # Output directory build requires the clean source
+        if os.path.exists(os.path.join(src_dir, ".config")):
+            (ret, stdout, stderr) = cmd_run(["make", "mrproper"], cwd=src_dir)
+            if ret:
+                self.log_err("GenericKernelBuild: Failed to clean the "
+                             "baseline source")
+                return None
+
+        # Same compiler as the build, but the stats are not counted
+        env = None
+        if self.ccache:
+            env = self.ccache.env(base_dir=src_dir)
+            env.update(KBUILD_REPRODUCIBLE_ENV)
+
+        params = [f"O={out_dir}"] + self.cc_params()
+        shutil.copy(self.kernel_config, os.path.join(out_dir, ".config"))
+        (ret, stdout, stderr) = cmd_run(["make", "olddefconfig"] + params,
+                                        add_env=env, cwd=src_dir)
+        if ret:
+            self.log_err("GenericKernelBuild: Failed to config the baseline")
+            return None
+
+        def src_path(path):
+            full_path = os.path.normpath(os.path.join(out_dir, path))
+            if not full_path.startswith(src_dir + os.sep):
+                return path
+            return os.path.relpath(full_path, src_dir)
+
+        parser = DiagnosticParser(self.name, src_path=src_path)
+        cmd = ["make", "-j4"] + params + (self.make_params or [])
+        cmd += self.default_targets()
+        (ret, stdout, stderr) = cmd_run(cmd, add_env=env, cwd=src_dir,
+                                        stderr_cb=parser.feed,
+                                        stderr_tail=STDERR_TAIL)
+        if ret:
+            self.log_err("GenericKernelBuild: Baseline build failed")
+            return None
+
+        return [record.key() for record in parser.store]
+
+    def load_baseline(self, store, repo, base_commit, tool_version):
+        """Return the baseline from the store. If the store doesn't have it,
+        build the baseline and save it to the store.
+        """
+        key = self.baseline_key(base_commit, tool_version)
+        data = store.get(self.name, key)
+        if data is not None:
+            self.log_info("GenericKernelBuild: Use the saved baseline")
+            return data['diagnostics']
+
+        baseline = self.build_baseline(repo, base_commit)
+        if baseline is None:
+            return None
+
+        store.put(self.name, key, {'base_commit': base_commit,
+                                   'tool_version': tool_version,
+                                   'diagnostics': baseline})
+        return baseline
+
+    def src_path(self, path):
+        """Convert the path in the build output to the path relative to the
+        source directory"""
+        if not self.build_tree:
+            return path
+
+        return self.build_tree.src_path(path)
+
     def post_run(self):
         self.log_dbg("GenericKernelBuild: Post Run...")
 
+        CCache.remove_stats_log(self.ccache_log)
+        self.ccache_log = None
+
+        if self.build_tree:
+            self.log_dbg("GenericKernelBuild: Keep the output directory")
+            return
+
         # Clean
         cmd = ['make', 'clean']
         (ret, stdout, stderr) = cmd_run(cmd, cwd=self.work_dir)
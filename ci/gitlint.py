@@ -4,7 +4,7 @@ import sys
 sys.path.insert(0, '../libs')
 from libs import cmd_run
 
-from ci import Base, Verdict, EndTest, submit_pw_check
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
 
 class GitLint(Base):
     """Git Lint class
@@ -25,6 +25,9 @@ class GitLint(Base):
 
         super().__init__()
 
+        # Only reads the patches
+        self.tree_access = TreeAccess.NONE
+
         self.log_dbg("Initialization completed")
 
     def run(self):
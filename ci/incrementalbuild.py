@@ -5,15 +5,23 @@ import sys
 sys.path.insert(0, '../libs')
 from libs import RepoTool, cmd_run
 
-from ci import Base, Verdict, EndTest, submit_pw_check
-from ci import BuildKernel, BuildBluez
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
+from ci import BuildKernel, BuildBluez, GenericKernelBuild
 
 class IncrementalBuild(Base):
     """Incremental Build class
     This class build the targe after applying the each patch in the series
+    The build tree is kept between the patches. After the first patch, the
+    kernel target rebuilds only the directories affected by the files changed
+    in the patch, and the user space target relies on the incremental make in
+    the configured build tree.
+    The patches are applied in the "incremental" worktree of the src_repo
+    pool, so the source tree is not changed.
+    If the selector is set, the patch is built only if the files changed in
+    the patch require this test.
     """
 
-    def __init__(self, ci_data, space, kernel_config=None):
+    def __init__(self, ci_data, space, kernel_config=None, selector=None):
 
         self.name = "IncrementalBuild"
         self.desc = "Incremental build with the patches in the series"
@@ -21,21 +29,30 @@ class IncrementalBuild(Base):
         self.kernel_config = kernel_config
         self.space = space
         self.ci_data = ci_data
+        self.selector = selector
+
+        # Build in the worktree
+        worktree_dir = ci_data.src_repo.worktree_path("incremental")
 
         if self.space == "kernel":
             # Set the dry_run=True so it won't submit the result to the pw.
             self.target = BuildKernel(self.ci_data, kernel_config=kernel_config,
-                                      dry_run=True)
+                                      src_dir=worktree_dir, dry_run=True)
         elif self.space == "user":
             _params = ["--disable-android"]
             # Set the dry_run=True so it won't submit the result to the pw.
             self.target = BuildBluez(self.ci_data, config_params=_params,
-                                     dry_run=True)
+                                     src_dir=worktree_dir, dry_run=True)
         else:
             self.target = None
 
         super().__init__()
 
+        # It checks out the base and applies the patches in the worktree
+        if self.target:
+            self.resources = self.target.resources
+        self.tree_access = TreeAccess.NONE
+
         self.log_dbg("Initialization completed")
 
     def run(self):
@@ -47,39 +64,59 @@ class IncrementalBuild(Base):
             self.log_err(f"Invalid setup: space: {self.space}")
             self.add_failure_end_test("Invalid setup")
 
-        # Make the source base to workflow branch
-        if self.ci_data.src_repo.git_checkout("origin/workflow"):
-            self.log_err(f"Failed to checkout: {self.ci_data.src_repo.stderr}")
-            self.add_failure_end_test(self.ci_data.src_repo.stderr)
+        # Make the worktree base to workflow branch
+        with self.ci_data.src_repo.worktree("incremental",
+                                            self.ci_data.base_commit()) as repo:
+            if not repo:
+                self.log_err("Failed to setup the worktree")
+                self.add_failure_end_test("Failed to setup the worktree")
+
+            self.build_patches(repo)
+
+    def build_patches(self, repo):
+        """Apply the patches in the series to the repo one by one and build
+        the target for each patch"""
 
         # Get patches from patchwork series
+        # The first build builds the default targets
+        first_build = True
         for patch in self.ci_data.series['patches']:
             self.log_dbg(f"Patch ID: {patch['id']}")
 
-            # Save patch mbox to file
+            # Save patch mbox to file. Use own file name since CheckPatch may
+            # write the same patch at the same time.
             patch_file = self.ci_data.pw.save_patch_mbox(patch['id'],
                             os.path.join(self.ci_data.patch_dir,
-                                         f"{patch['id']}.patch"))
+                                         f"{patch['id']}.incr.patch"))
             self.log_dbg(f"Save patch: {patch_file}")
 
             # Apply patch
-            if self.ci_data.src_repo.git_am(patch_file):
+            if repo.git_am(patch_file):
                 self.log_err("Failed to apply patch")
                 self.log_info("Cleaning git tree and retrying")
-                self.ci_data.src_repo.git_clean()
-                if self.ci_data.src_repo.git_am(patch_file):
+                repo.git_clean()
+                if repo.git_am(patch_file):
                     self.log_err("Failed to apply patch. Giving up")
-                    msg = self.ci_data.src_repo.stderr
-                    self.ci_data.src_repo.git_am(abort=True)
+                    msg = repo.stderr
+                    repo.git_am(abort=True)
                     self.add_failure_end_test(msg)
 
             # Test Build
-            try:
-                self.target.run()
-            except EndTest as e:
-                self.log_err("Build failed")
-            finally:
-                self.log_info(f"Test Verdict: {self.target.verdict.name}")
+            if not self.is_selected(repo):
+                self.log_info("No related change in the patch. Skip the build")
+                self.add_stat("skipped patches",
+                              self.stats.get("skipped patches", 0) + 1)
+            elif self.set_targets(repo, first_build):
+                try:
+                    self.target.run()
+                except EndTest as e:
+                    self.log_err("Build failed")
+                finally:
+                    self.log_info(f"Test Verdict: {self.target.verdict.name}")
+                first_build = False
+
+            # Stats of the target are accumulated over the patches
+            self.stats.update(self.target.stats)
 
             # Update the verdict from self.target to this object
             if self.target.verdict == Verdict.FAIL:
@@ -98,6 +135,42 @@ class IncrementalBuild(Base):
                             None, self.ci_data.config['dry_run'])
             self.success()
 
+    def is_selected(self, repo):
+        """Return True if the files changed in the current patch require the
+        build"""
+        if not self.selector or not self.selector.enable:
+            return True
+
+        files = repo.git_diff_files("HEAD~1")
+        if files is None:
+            return True
+
+        return self.selector.is_required(self.name, files)
+
+    def set_targets(self, repo, first_build):
+        """Set the build targets of the kernel target for the current patch.
+        The first build builds the default targets. Returns False if nothing
+        needs to be built for the patch.
+        """
+        if not isinstance(self.target, GenericKernelBuild):
+            return True
+
+        self.target.targets = None
+        if first_build:
+            return True
+
+        files = repo.git_diff_files("HEAD~1")
+        if files is None:
+            self.log_err("Failed to get the changed files. Full build")
+            return True
+
+        self.target.targets = self.target.affected_targets(files)
+        if self.target.targets == []:
+            self.log_info("No source change in the patch. Skip the build")
+            return False
+
+        return True
+
     def post_run(self):
         self.log_dbg("Post Run...")
 
@@ -105,13 +178,5 @@ class IncrementalBuild(Base):
             self.log_info("No verdict. skip post-run")
             return
 
-        if self.space == 'user':
-            cmd = ["make", "maintainer-clean"]
-        else: # kernel
-            cmd = ['make', 'clean']
-
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Fail to clean the source")
-
-        # AR: hum... should it continue the test?
+        # The target keeps its build tree for the next build
+        self.target.post_run()
@@ -3,12 +3,12 @@ import sys
 sys.path.insert(0, '../libs')
 from libs import cmd_run
 
-from ci import Base, Verdict, submit_pw_check
+from ci import Base, TreeAccess, Verdict, submit_pw_check
 
 class MakeCheck(Base):
     """BlueZ Make Check class
     This class runs 'make check' with Bluez, and it assumes that the source
-    is already compiled
+    is already compiled by BuildBluez. It uses the same build tree.
     """
 
     def __init__(self, ci_data):
@@ -18,8 +18,15 @@ class MakeCheck(Base):
         self.desc = "Run Bluez Make Check"
         self.ci_data = ci_data
 
+        # Build tree of BuildBluez which uses the default config options
+        self.build_dir = ci_data.build_trees.get_tree(ci_data.src_dir).path
+
         super().__init__()
 
+        self.resources = {'cpu': 1, 'memory': 1024,
+                          f"build_tree:{self.build_dir}": 1}
+        self.tree_access = TreeAccess.SHARED
+
         self.log_dbg("Initialization completed")
 
     def run(self):
@@ -28,7 +35,7 @@ class MakeCheck(Base):
         self.start_timer()
 
         cmd = ["make", "check"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
+        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.build_dir)
         if ret:
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                             self.name, Verdict.FAIL,
@@ -48,14 +55,4 @@ class MakeCheck(Base):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        if self.verdict == Verdict.PENDING:
-            self.log_info("No verdict. skip post-run")
-            return
-
-        # Clean the source
-        cmd = ["make", "maintainer-clean"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Fail to clean the source")
-
-        # AR: hum... should it continue the test?
+        # Nothing to clean. The build tree is owned by BuildBluez.
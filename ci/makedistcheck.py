@@ -9,7 +9,7 @@ from ci import GenericBuild, Verdict, EndTest, submit_pw_check
 
 class MakeDistcheck(GenericBuild):
     """BlueZ Make Distcheck class
-    This class runs 'make distcheck'. It expects the source is clean
+    This class runs 'make distcheck' in the build tree for its config options
     """
 
     def __init__(self, ci_data):
@@ -26,7 +26,9 @@ class MakeDistcheck(GenericBuild):
                          "--disable-android"]
         make_params = ["distcheck"]
         super().__init__(config_params=config_params, make_params=make_params,
-                         use_fakeroot=True, work_dir=ci_data.src_dir)
+                         use_fakeroot=True, work_dir=ci_data.src_dir,
+                         ccache=ci_data.ccache,
+                         build_trees=ci_data.build_trees)
 
         self.log_dbg("Initialization completed")
 
@@ -62,14 +64,7 @@ class MakeDistcheck(GenericBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        if self.verdict == Verdict.PENDING:
-            self.log_info("No verdict. skip post-run")
-            return
+        super().post_run()
 
-        # Clean the source
-        cmd = ["make", "maintainer-clean"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Fail to clean the source")
-
-        # AR: hum... should it continue the test?
+        # Nothing to clean. The build tree is kept for other tests with the
+        # same config options.
@@ -11,10 +11,10 @@ from ci import GenericBuild
 class MakeExtEll(GenericBuild):
     """BlueZ Make with External ELL class
     This class builds the BlueZ with exteranl ell option. It assumes that the
-    ELL is already installed on the system
+    ELL is already installed on the system or in the ell_pkg_config_path.
     """
 
-    def __init__(self, ci_data):
+    def __init__(self, ci_data, ell_pkg_config_path=None):
         # To use exteranl ell, use the following config params
         # config: --enable-external-ell --disable-lsan --disable-asan --disable-ubsan --disable-android
 
@@ -22,12 +22,26 @@ class MakeExtEll(GenericBuild):
         self.name = "bluezmakeextell"
         self.desc = "Build Bluez with External ELL"
         self.ci_data = ci_data
+        self.ell_pkg_config_path = ell_pkg_config_path
 
         config_params = ["--enable-external-ell", "--disable-lsan", "--disable-asan", "--disable-ubsan", "--disable-android"]
-        super().__init__(config_params=config_params, work_dir=ci_data.src_dir)
+        super().__init__(config_params=config_params, work_dir=ci_data.src_dir,
+                         ccache=ci_data.ccache,
+                         build_trees=ci_data.build_trees,
+                         compile_timer=ci_data.compile_timer)
 
         self.log_dbg("Initialization completed")
 
+    def build_env(self, stats=False):
+        env = super().build_env(stats)
+        if not self.ell_pkg_config_path:
+            return env
+
+        if env is None:
+            env = {}
+        env['PKG_CONFIG_PATH'] = self.ell_pkg_config_path
+        return env
+
     def run(self):
         self.log_dbg("Run")
 
@@ -60,14 +74,7 @@ class MakeExtEll(GenericBuild):
     def post_run(self):
         self.log_dbg("Post Run...")
 
-        if self.verdict == Verdict.PENDING:
-            self.log_info("No verdict. skip post-run")
-            return
-
-        # Clean the source
-        cmd = ["make", "maintainer-clean"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Fail to clean the source")
+        super().post_run()
 
-        # AR: hum... should it continue the test?
+        # Nothing to clean. The build tree is kept for other tests with the
+        # same config options.
@@ -1,15 +1,27 @@
-from gettext import install
 import os
 import sys
+import shutil
+import hashlib
+import plistlib
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, '../libs')
-from libs import RepoTool, cmd_run
+from libs import CacheStore, cmd_run
 
-from ci import Base, Verdict, EndTest, submit_pw_check
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
 
 class ScanBuild(Base):
     """Run scan-build class
     This class runs the scan-build and reports any issue found by the scan-build
+    The parsed result of the base scan is saved in the cache store for the
+    base commit and the scan-build(clang) version, so it is scanned only once
+    for the base. If the result is not saved yet, the base is checked out in
+    the "base" worktree of the src_repo pool and scanned at the same time with
+    the patched source.
+    The bugs are read from the plist reports of scan-build(no HTML report).
+    Each bug has the fingerprint of the (checker, file, function, path events)
+    without the line numbers, so the bugs moved by the patch are not reported
+    as new. The bugs in the patched source not in the base are reported.
     """
 
     def __init__(self, ci_data):
@@ -19,96 +31,132 @@ class ScanBuild(Base):
         self.desc = "Run Scan Build"
         self.ci_data = ci_data
 
+        self.config_params = ["--disable-asan", "--disable-lsan",
+                              "--disable-ubsan", "--disable-android"]
+        self.build_tree = ci_data.build_trees.get_tree(ci_data.src_dir,
+                                    ["scan-build"] + self.config_params)
+        self.build_dir = self.build_tree.path
+
+        # Key of the saved base result
+        self.base_commit = ci_data.base_commit()
+        self.base_key = CacheStore.make_key(self.base_commit,
+                                            self.scan_build_version(),
+                                            self.config_params, "plist")
+
         super().__init__()
 
-        self.log_dbg("Initialization completed")
+        # The base is scanned in its own worktree. It only reads the source
+        # tree.
+        self.resources = {'cpu': 4, 'memory': 2048,
+                          f"build_tree:{self.build_dir}": 1}
+        self.tree_access = TreeAccess.SHARED
 
-    def scan_build(self, error_filename):
-        # Build and save the error log
-        # After saving the error log, it will cleans the build
+        self.log_dbg("Initialization completed")
 
-        # Configure the build for base
-        cmd = ["./bootstrap-configure", "--disable-asan", "--disable-lsan",
-               "--disable-ubsan", "--disable-android"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
+    def scan_build_version(self):
+        """scan-build has no version. Use the version of clang"""
+        (ret, stdout, stderr) = cmd_run(["clang", "--version"])
         if ret:
-            self.log_err("Build config failed")
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Build Config FAIL",
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test(stderr)
+            self.log_err("Failed to read the clang version")
+            return None
 
-        # Scan Build Make
-        cmd = ["scan-build", "make", "-j4"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret:
-            self.log_err("Scan Build failed")
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Scan Build FAIL",
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test(stderr)
+        return stdout.strip().split("\n")[0]
+
+    @staticmethod
+    def report_dir(build_tree):
+        return os.path.join(build_tree.path, "scan-build-reports")
 
-        # Save the stderr for later use
-        err_file = os.path.join(self.ci_data.src_dir, error_filename)
-        with open(err_file, 'w+') as f:
-            f.write(stderr)
-        self.log_dbg(f"Saved output for base build: {err_file}")
+    def scan_build(self, build_tree, config_params):
+        """Configure and scan the source in the build tree. Returns the
+        (ret, stderr) and the plist reports are in the report_dir().
+        The build tree is kept, so the next scan builds only the changes.
+        """
 
-        # Clean the source
-        cmd = ["make", "maintainer-clean"]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
+        # Configure the build tree once
+        if not build_tree.configured:
+            cmd = build_tree.configure_cmd() + config_params
+            (ret, stdout, stderr) = cmd_run(cmd, cwd=build_tree.path)
+            if ret:
+                self.log_err("Build config failed")
+                return (ret, stderr)
+            build_tree.configured = True
+
+        # Scan Build Make. The reports of the previous scan are removed.
+        report_dir = self.report_dir(build_tree)
+        shutil.rmtree(report_dir, ignore_errors=True)
+        cmd = ["scan-build", "-plist", "-o", report_dir, "make", "-j4"]
+        (ret, stdout, stderr) = cmd_run(cmd, cwd=build_tree.path)
         if ret:
-            self.log_err("Build clean failed")
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Scan Build FAIL",
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test(stderr)
+            self.log_err("Scan Build failed")
 
-        return err_file
+        return (ret, stderr)
 
     def run(self):
 
         self.log_dbg("Run")
         self.start_timer()
 
-        # Create the temp branch (HEAD) to come back later
-        if self.ci_data.src_repo.git_checkout("patched", create_branch=True):
-            self.log_err("Failed to create branch")
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Setup failed",
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test("Setup failed")
-
-        # Checkout the source to the base where it has no patches applied
-        if self.ci_data.src_repo.git_checkout("origin/workflow"):
-            self.log_err("Failed to checkout to base branch")
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Setup failed",
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test("Setup failed")
-
-        # Run scan build with base, and save the error log
-        base_err_file = self.scan_build("scan_build_base.err")
-
-        # Now checked out the patched branch
-        if self.ci_data.src_repo.git_checkout("patched"):
-            self.log_err(f"Failed to checkout to patched branch")
+        if not self.base_commit:
+            self.log_err("Unable to find the base commit")
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                             self.name, Verdict.FAIL,
                             "Setup failed",
                             None, self.ci_data.config['dry_run'])
             self.add_failure_end_test("Setup failed")
 
-        # Run scan build with patched, and save the error log
-        patched_err_file = self.scan_build("scan_build_patched.err")
-
-        # Compare two error files
-        results = self.compare_outputs(base_err_file, patched_err_file)
+        base_result = self.ci_data.cache_store.get(self.name, self.base_key)
+        if base_result is not None:
+            self.log_info("Use the saved base scan result")
+            self.add_stat("base scan", "cached")
+
+            (ret, patched_out) = self.scan_build(self.build_tree,
+                                                 self.config_params)
+            if ret:
+                self.scan_build_failed(patched_out)
+            base_fingerprints = set(base_result['fingerprints'])
+        else:
+            self.add_stat("base scan", "scanned")
+
+            with self.ci_data.src_repo.worktree("base",
+                                                self.base_commit) as base_repo:
+                if not base_repo:
+                    submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                                    self.name, Verdict.FAIL,
+                                    "Setup failed",
+                                    None, self.ci_data.config['dry_run'])
+                    self.add_failure_end_test("Setup failed")
+
+                base_tree = self.ci_data.build_trees.get_tree(base_repo.path(),
+                                        ["scan-build"] + self.config_params)
+
+                # Scan the base and the patched at the same time
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    base_future = executor.submit(self.scan_build, base_tree,
+                                                  self.config_params)
+                    patched_future = executor.submit(self.scan_build,
+                                                     self.build_tree,
+                                                     self.config_params)
+                    (ret, base_out) = base_future.result()
+                    (patched_ret, patched_out) = patched_future.result()
+
+            if ret:
+                self.scan_build_failed(base_out)
+            if patched_ret:
+                self.scan_build_failed(patched_out)
+
+            base_fingerprints = set(bug['fingerprint'] for bug in
+                                    self.read_reports(base_tree))
+            self.ci_data.cache_store.put(self.name, self.base_key,
+                                         {'fingerprints':
+                                          sorted(base_fingerprints)})
+
+        patched_bugs = self.read_reports(self.build_tree)
+        self.add_stat("bugs", f"base {len(base_fingerprints)}, "
+                              f"patched {len(patched_bugs)}")
+
+        # Compare two results
+        results = self.compare_results(base_fingerprints, patched_bugs,
+                                       self.ci_data.changed_line_index())
         if results:
             # Add warning...
             self.log_dbg("Found differnece in two build scans: " + results)
@@ -126,114 +174,106 @@ class ScanBuild(Base):
                         None, self.ci_data.config['dry_run'])
         self.success()
 
+    def scan_build_failed(self, stderr):
+        submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                        self.name, Verdict.FAIL,
+                        "Scan Build FAIL",
+                        None, self.ci_data.config['dry_run'])
+        self.add_failure_end_test(stderr)
+
     def post_run(self):
         self.log_dbg("Post Run...")
 
-    def compare_outputs(self, base_err_file, patched_err_file):
-        base_dir = os.path.join(self.ci_data.src_dir, "scan_build_base")
-        self.parse_err_file(base_err_file, base_dir)
-        patched_dir = os.path.join(self.ci_data.src_dir, "scan_build_patched")
-        self.parse_err_file(patched_err_file, patched_dir)
-
-        return self.diff_dirs(base_dir, patched_dir)
-
-    def read_err_lines(self, err_file):
-        err_lines = ""
-
-        self.log_dbg(f"Read err_file: {err_file}")
-
-        if os.path.isfile(err_file):
-            with open(err_file) as f:
-                err_lines = f.read()
-            return err_lines
-
-        if os.path.isdir(err_file):
-            for f in os.listdir(err_file):
-                err_lines += self.read_err_lines(os.path.join(err_file, f))
-
-        return err_lines
-
-    def diff_dirs(self, base_dir, patched_dir):
+    def compare_results(self, base_fingerprints, patched_bugs, index=None):
         """
-        Diff two folders and find the new error in the patched dir
+        Return the bugs in the patched result which are not in the base. If
+        the index(libs.LineIndex) is given, only the bugs in the lines changed
+        by the series are returned.
         """
+        new_bugs = [bug for bug in patched_bugs
+                    if bug['fingerprint'] not in base_fingerprints]
 
-        err_lines = ""
-        err_file = ""
+        if index:
+            new_bugs = [bug for bug in new_bugs
+                        if index.contains(bug['file'], bug['line'])]
 
-        cmd = ["diff", "-qr", base_dir, patched_dir]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.ci_data.src_dir)
-        if ret == 0:
-            self.log_dbg("No changes found - base and patched")
+        if not new_bugs:
+            self.log_dbg("No new bug found in patched")
             return None
 
-        for line in stdout.splitlines():
-            if line.startswith("Only in"):
-                if line.find(patched_dir) != -1:
-                    self.log_dbg("Found new issue in patched dir")
-                    # line looks like this:
-                    # "Only in /home/han1/work/dev/scratch/prs/1591/patched: lib"
-                    # "Only in /home/han1/work/dev/scratch/prs/1591/patched/monitor: hwdb.c.err"
-                    temp = line.replace("Only in ", '').split(": ")
-                    err_file = os.path.join(temp[0], temp[1])
-                    err_lines += self.read_err_lines(err_file)
-                continue
-
-            if line.startswith("Files "):
-                # line looks like this:
-                # Files /home/han1/work/dev/scratch/prs/1591/base/tools/test-runner.c.err and /home/han1/work/dev/scratch/prs/1591/patched/tools/test-runner.c.err differ
-                err_file = line.split(" and ")[1].split(" ")[0]
-                err_lines += self.read_err_lines(err_file)
-
-        return err_lines
-
-    def parse_err_file(self, err_file, out_dir):
-        """
-        Read scan-build error output file and create the file with error
-        output
-        """
-        self.log_dbg(f"Parse error file({err_file}) to {out_dir}")
-
-        file1 = open(err_file, 'r')
-        lines = file1.readlines()
-        file1.close()
-
-        err_lines = ""
-
-        for line in lines:
-
-            # ignore if the line is empty line
-            if line.strip() == "":
-                continue
-
-            # Found key string
-            if line.find(' generated.') >= 0:
-                err_lines += line
-
-                line1 = err_lines.splitlines()[0]
+        for bug in new_bugs:
+            self.log_dbg(f"Found new bug in patched: {bug['file']}: "
+                         f"{bug['fingerprint']}")
 
-                # Some output starts with "In file included from "
-                if line1.find("In file included", 0, 20) >= 0:
-                    line1 = line1.replace("In file included from ", '')
+        return "\n".join(bug['text'] for bug in new_bugs) + "\n"
 
-                file_path = line1.split(':')[0]
-
-                target_path = os.path.join(out_dir,
-                                           os.path.dirname(file_path))
-                target_file = os.path.join(target_path,
-                                           os.path.basename(file_path) + ".err")
-
-                if not os.path.exists(target_path):
-                    os.makedirs(target_path, exist_ok=True)
-
-                # Save to local file
-                with open(target_file, 'w+') as f:
-                    f.write(err_lines)
-
-                self.log_dbg(f"err file is created: {target_file}")
-
-                # reset and continue
-                err_lines = ""
-                continue
-
-            err_lines += line
+    def read_reports(self, build_tree):
+        """Read the plist reports of the scan and return the list of the bugs.
+        The bug found in the multiple reports(i.e. the header included by
+        the sources) is returned once.
+        """
+        bugs = []
+        fingerprints = set()
+
+        for root, dir_names, file_names in os.walk(self.report_dir(build_tree)):
+            for fn in sorted(file_names):
+                if not fn.endswith(".plist"):
+                    continue
+
+                for bug in self.parse_plist(os.path.join(root, fn),
+                                            build_tree):
+                    if bug['fingerprint'] in fingerprints:
+                        continue
+                    fingerprints.add(bug['fingerprint'])
+                    bugs.append(bug)
+
+        self.log_dbg(f"Found {len(bugs)} bugs in {build_tree.path}")
+        return bugs
+
+    def parse_plist(self, plist_file, build_tree):
+        """Parse the plist report and return the list of the bugs. The bug is
+        the dict of the fingerprint, the file and the line in the source
+        tree, and the text for the report."""
+        try:
+            with open(plist_file, 'rb') as f:
+                data = plistlib.load(f)
+        except (OSError, plistlib.InvalidFileException) as e:
+            self.log_err(f"Failed to read the report: {plist_file}: {e}")
+            return []
+
+        files = [build_tree.src_path(path) for path in data.get('files', [])]
+
+        bugs = []
+        for diag in data.get('diagnostics', []):
+            location = diag['location']
+            file_path = files[location['file']]
+            checker = diag.get('check_name', diag.get('type', ''))
+            function = diag.get('issue_context', '')
+
+            # The path to the bug without the line numbers
+            events = []
+            for piece in diag.get('path', []):
+                if piece.get('kind') != 'event':
+                    continue
+                message = " ".join(piece.get('message', '').split())
+                events.append(f"{files[piece['location']['file']]}: "
+                              f"{message}")
+
+            text = (f"{file_path}:{location['line']}:{location['col']}: "
+                    f"warning: {diag.get('description', '')} [{checker}]")
+            if function:
+                text = f"{file_path}: In function '{function}':\n{text}"
+
+            bugs.append({'fingerprint': self.fingerprint(checker, file_path,
+                                                         function, events),
+                         'file': file_path,
+                         'line': location['line'],
+                         'text': text})
+
+        return bugs
+
+    @staticmethod
+    def fingerprint(checker, file_path, function, events):
+        """Return the fingerprint of the bug"""
+        data = "\n".join([checker, file_path, function] + events)
+        return hashlib.sha1(data.encode()).hexdigest()
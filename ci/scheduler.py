@@ -0,0 +1,152 @@
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, '../libs')
+from libs import log_debug, log_error, log_info
+
+from ci import TreeAccess
+
+class Scheduler:
+    """Test Scheduler class
+    This class runs the tests in the test list concurrently. A test starts
+    when all tests in its requires list are finished and its resources are
+    available within the budget.
+    Resources:
+    cpu - number of cpu slots. Default is the number of cpus.
+    memory - memory in MB. Default is the available memory of the system.
+    Other resource names are used as a lock with a capacity of 1.
+    The source tree is shared by the tests with TreeAccess.SHARED, and
+    TreeAccess.EXCLUSIVE test runs without any other test using the tree.
+    """
+
+    def __init__(self, test_list, config=None):
+        self.test_list = test_list
+
+        if config is None:
+            config = {}
+
+        self.budget = {
+            'cpu': config.get('cpu') or os.cpu_count() or 1,
+            'memory': config.get('memory') or self._available_memory(),
+        }
+        self.max_workers = config.get('max-workers') or len(test_list) or 1
+
+        self._used = {}
+        self._tree_users = 0
+        self._tree_exclusive = False
+
+        log_info(f"Scheduler: budget: {self.budget}")
+
+    def _available_memory(self):
+        """Read the available memory in MB from /proc/meminfo"""
+        try:
+            with open("/proc/meminfo", "r") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) // 1024
+        except OSError:
+            pass
+
+        # Unknown. No limit
+        return 0
+
+    def _demand(self, test):
+        """Return the resources of the test. The amount over the budget is
+        limited to the budget, so the test can run alone.
+        """
+        demand = {}
+        for name, amount in test.resources.items():
+            if name in self.budget:
+                if not self.budget[name]:
+                    continue
+                amount = min(amount, self.budget[name])
+            demand[name] = amount
+
+        return demand
+
+    def _available(self, test):
+        if test.tree_access == TreeAccess.EXCLUSIVE:
+            if self._tree_users:
+                return False
+        elif test.tree_access == TreeAccess.SHARED:
+            if self._tree_exclusive:
+                return False
+
+        for name, amount in self._demand(test).items():
+            capacity = self.budget.get(name, 1)
+            if self._used.get(name, 0) + amount > capacity:
+                return False
+
+        return True
+
+    def _acquire(self, test):
+        if test.tree_access != TreeAccess.NONE:
+            self._tree_users += 1
+        if test.tree_access == TreeAccess.EXCLUSIVE:
+            self._tree_exclusive = True
+
+        for name, amount in self._demand(test).items():
+            self._used[name] = self._used.get(name, 0) + amount
+
+    def _release(self, test):
+        if test.tree_access != TreeAccess.NONE:
+            self._tree_users -= 1
+        if test.tree_access == TreeAccess.EXCLUSIVE:
+            self._tree_exclusive = False
+
+        for name, amount in self._demand(test).items():
+            self._used[name] -= amount
+
+    def _is_ready(self, test, done):
+        for required in test.requires:
+            # Ignore the test which is not in the list
+            if required in self.test_list and required not in done:
+                return False
+
+        return True
+
+    def run(self, run_test):
+        """Run all tests with run_test(test) and return when all tests are
+        finished.
+        """
+        pending = list(self.test_list)
+        running = {}
+        done = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Start the tests in the list order
+                for test in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    if not self._is_ready(test, done):
+                        continue
+                    if not self._available(test):
+                        continue
+
+                    self._acquire(test)
+                    pending.remove(test)
+                    log_info(f"Scheduler: Start {test.name}")
+                    running[executor.submit(run_test, test)] = test
+
+                if not running:
+                    # Nothing can start. Circular requires in the list
+                    log_error("Scheduler: Unable to schedule: "
+                              f"{[test.name for test in pending]}")
+                    test = pending.pop(0)
+                    self._acquire(test)
+                    running[executor.submit(run_test, test)] = test
+
+                finished, not_done = wait(running,
+                                          return_when=FIRST_COMPLETED)
+                for future in finished:
+                    test = running.pop(future)
+                    self._release(test)
+                    done.append(test)
+
+                    exc = future.exception()
+                    if exc:
+                        log_error(f"Scheduler: {test.name}: {exc.__class__}")
+                    log_info(f"Scheduler: Done {test.name}")
+                log_debug(f"Scheduler: used: {self._used}")
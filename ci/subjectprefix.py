@@ -1,4 +1,4 @@
-from ci import Base, Verdict, EndTest, submit_pw_check
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
 
 class SubjectPrefix(Base):
     """Check Subject Prefix class
@@ -14,6 +14,9 @@ class SubjectPrefix(Base):
 
         super().__init__()
 
+        # Only reads the patches
+        self.tree_access = TreeAccess.NONE
+
         self.log_dbg("Initialization completed")
 
     def run(self):
@@ -0,0 +1,70 @@
+import sys
+import threading
+
+sys.path.insert(0, '../libs')
+from libs import log_error, log_info
+
+from ci.testeroutput import LOG_TAIL, BatchOutputParser
+
+class TesterBatch:
+    """Tester Batch class
+    This class runs the group of the testers one after another in one VM, so
+    the VM boots once for the group. The TestRunner of each tester in the
+    group shares the object and the first TestRunner asking for the result
+    runs the batch. If the kernel crashes, the crashed tester fails and the
+    testers after it run in a new VM.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+
+        self._lock = threading.Lock()
+        self._results = None
+
+        log_info(f"TesterBatch: {self.names}")
+
+    def result(self, runner):
+        """Return (ret, stderr, parser) of the tester of the runner. The
+        batch runs with the runner if it isn't run yet."""
+        with self._lock:
+            if self._results is None:
+                self._results = self._run(runner)
+
+        return self._results[runner.test_name]
+
+    def _run(self, runner):
+        results = {}
+        remaining = list(self.names)
+
+        while remaining:
+            log_info(f"TesterBatch: Run {remaining}")
+            batch_parser = BatchOutputParser(remaining, tail=LOG_TAIL)
+            script = runner.batch_script(remaining)
+            (ret, stderr, parser) = runner.run_vm(["/bin/sh", script],
+                                                  parser=batch_parser)
+
+            for name in batch_parser.finished():
+                # The tester exits with non-zero if any test case fails. It
+                # failed to run only if no summary is found.
+                tester_parser = batch_parser.parsers[name]
+                tester_ret = batch_parser.rets[name]
+                if tester_parser.summary:
+                    tester_ret = 0
+                results[name] = (tester_ret, stderr, tester_parser)
+
+            if not batch_parser.crashed:
+                # The testers not finished without the crash
+                for name in remaining:
+                    if name not in results:
+                        results[name] = (ret or 1, stderr,
+                                         batch_parser.parsers[name])
+                break
+
+            crashed = batch_parser.crashed
+            log_error(f"TesterBatch: Kernel crashed in {crashed}")
+            results[crashed] = (ret, stderr, batch_parser.parsers[crashed])
+
+            # Run the testers after the crashed tester in a new VM
+            remaining = [name for name in remaining if name not in results]
+
+        return results
@@ -0,0 +1,232 @@
+import re
+from collections import deque, OrderedDict
+
+# Lines of the tester output kept for the report
+LOG_TAIL = 100
+
+# Color codes in the tester output
+ANSI_RE = re.compile(r'\x1B\[[0-9;]*m')
+
+# Kernel events which end the VM run
+FATAL_RE = re.compile(r'^(BUG:|general protection fault|Kernel panic)')
+
+# Kernel warnings. The test fails but the VM keeps running.
+WARNING_RE = re.compile(r'^WARNING:')
+
+# "Name - test passed" printed while the test case is running
+PROGRESS_RE = re.compile(r'^(?P<name>.+?) - (?P<event>test passed|test failed|'
+                         r'test timed out|test not run)$')
+
+# "Name     Passed     0.123 seconds" in the test summary
+CASE_RE = re.compile(r'^(?P<name>.+?)\s+(?P<result>Passed|Failed|Timed out|'
+                     r'Not Run)(\s+(?P<time>[\d.]+) seconds)?\s*$')
+
+# Delimiters of the testers in the batch
+BATCH_START_RE = re.compile(r'^=== TESTER START: (?P<name>\S+) ===$')
+BATCH_END_RE = re.compile(r'^=== TESTER END: (?P<name>\S+) (?P<ret>\d+) ===$')
+
+SUMMARY_RE = re.compile(r'^Total:\s+(?P<total>\d+),\s+Passed:\s+(?P<passed>\d+)'
+                        r'\s+\(.+%\),\s+Failed:\s+(?P<failed>\d+),'
+                        r'\s+Not\s+Run:\s+(?P<notrun>\d+)')
+
+# Result of the test case from the progress event
+PROGRESS_RESULTS = {"test passed": "Passed",
+                    "test failed": "Failed",
+                    "test timed out": "Timed out",
+                    "test not run": "Not Run"}
+
+FAILED_RESULTS = ("Failed", "Timed out")
+
+# Rank of the results. The worst result is kept when the results are merged.
+RESULT_RANK = {"Passed": 0, "Not Run": 1, "Failed": 2, "Timed out": 2}
+
+
+class TestCase:
+    """Result of the test case in the tester"""
+
+    __slots__ = ('name', 'result', 'elapsed')
+
+    def __init__(self, name, result, elapsed=None):
+        self.name = name
+        self.result = result
+        self.elapsed = elapsed
+
+    def failed(self):
+        return self.result in FAILED_RESULTS
+
+    def line(self):
+        """Return the line of the test case for the report"""
+        line = f"{self.name:<52} {self.result:<10}"
+        if self.elapsed is not None:
+            line += f" {self.elapsed:8.3f} seconds"
+        return line
+
+
+class TesterOutputParser:
+    """Tester Output Parser class
+    This class parses the output of the test-runner line by line while the
+    VM is running(cmd_run(stdout_cb=parser.feed)). The results of the test
+    cases are kept as the TestCase records and the last lines of the output
+    are kept for the report. feed() returns True when the fatal kernel event
+    such as "BUG:" or "Kernel panic" is found, so the VM can be stopped
+    without waiting for the timeout.
+    """
+
+    def __init__(self, tail=LOG_TAIL):
+        self.cases = OrderedDict()
+        self.summary = None
+        self.summary_line = None
+        self.fatal = None
+        self.warnings = []
+        self.tail = deque(maxlen=tail)
+
+        self._in_summary = False
+
+    def feed(self, line):
+        """Parse the line. Returns True if the run needs to be stopped"""
+        line = ANSI_RE.sub("", line)
+        self.tail.append(line)
+
+        if FATAL_RE.match(line):
+            self.fatal = line
+            return True
+
+        if WARNING_RE.match(line):
+            self.warnings.append(line)
+            return False
+
+        if line.startswith("Test Summary"):
+            self._in_summary = True
+            return False
+
+        match = SUMMARY_RE.match(line)
+        if match:
+            self.summary = match.groupdict()
+            self.summary_line = line
+            self._in_summary = False
+            return False
+
+        if self._in_summary:
+            match = CASE_RE.match(line)
+            if match:
+                elapsed = match.group('time')
+                self._set_case(match.group('name'), match.group('result'),
+                               float(elapsed) if elapsed else None)
+            return False
+
+        match = PROGRESS_RE.match(line)
+        if match:
+            self._set_case(match.group('name'),
+                           PROGRESS_RESULTS[match.group('event')])
+
+        return False
+
+    def _set_case(self, name, result, elapsed=None):
+        case = self.cases.get(name)
+        if case is None:
+            self.cases[name] = TestCase(name, result, elapsed)
+            return
+
+        case.result = result
+        if elapsed is not None:
+            case.elapsed = elapsed
+
+    @classmethod
+    def merge(cls, parsers, tail=LOG_TAIL):
+        """Return the parser with the results of the parsers, i.e. the
+        shards of the tester. The summary is made from the merged test
+        cases. If the test case is in multiple parsers, the worst result is
+        kept."""
+        merged = cls(tail=tail)
+        finished = True
+        for parser in parsers:
+            for case in parser.cases.values():
+                old = merged.cases.get(case.name)
+                if old and RESULT_RANK.get(old.result, 0) > \
+                   RESULT_RANK.get(case.result, 0):
+                    continue
+                merged._set_case(case.name, case.result, case.elapsed)
+            merged.warnings += parser.warnings
+            merged.tail.extend(parser.tail)
+            if parser.fatal and not merged.fatal:
+                merged.fatal = parser.fatal
+            if not parser.summary:
+                finished = False
+
+        # No summary if any of the parsers has no summary
+        if not finished:
+            return merged
+
+        cases = list(merged.cases.values())
+        total = len(cases)
+        passed = len([c for c in cases if c.result == "Passed"])
+        failed = len([c for c in cases if c.failed()])
+        notrun = total - passed - failed
+        percent = (passed * 100.0 / total) if total else 0.0
+
+        merged.summary = {"total": str(total), "passed": str(passed),
+                          "failed": str(failed), "notrun": str(notrun)}
+        merged.summary_line = (f"Total: {total}, "
+                               f"Passed: {passed} ({percent:.1f}%), "
+                               f"Failed: {failed}, Not Run: {notrun}")
+        return merged
+
+    def failed_cases(self):
+        return [case for case in self.cases.values() if case.failed()]
+
+    def log_tail(self):
+        return "\n".join(self.tail)
+
+
+class BatchOutputParser:
+    """Batch Output Parser class
+    This class parses the output of the testers running one after another in
+    one VM. The output of each tester is between the delimiters printed by
+    the batch script and it is passed to the TesterOutputParser of the
+    tester. feed() returns True when the kernel crashes, and the tester
+    running at the time is the crashed tester.
+    """
+
+    def __init__(self, names, tail=LOG_TAIL):
+        self.names = list(names)
+        self.parsers = {name: TesterOutputParser(tail=tail) for name in names}
+        self.rets = {}
+        self.crashed = None
+
+        self._current = None
+
+    def feed(self, line):
+        """Parse the line. Returns True if the run needs to be stopped"""
+        clean = ANSI_RE.sub("", line).strip()
+
+        match = BATCH_START_RE.match(clean)
+        if match and match.group('name') in self.parsers:
+            self._current = match.group('name')
+            return False
+
+        match = BATCH_END_RE.match(clean)
+        if match and match.group('name') in self.parsers:
+            self.rets[match.group('name')] = int(match.group('ret'))
+            self._current = None
+            return False
+
+        if self._current:
+            if self.parsers[self._current].feed(line):
+                self.crashed = self._current
+                return True
+            return False
+
+        # Crash outside of the tester belongs to the next tester
+        if FATAL_RE.match(ANSI_RE.sub("", line)):
+            for name in self.names:
+                if name not in self.rets:
+                    self.parsers[name].feed(line)
+                    self.crashed = name
+                    break
+            return True
+
+        return False
+
+    def finished(self):
+        """Return the list of the testers finished"""
+        return [name for name in self.names if name in self.rets]
@@ -0,0 +1,66 @@
+import sys
+import threading
+from contextlib import contextmanager
+
+sys.path.insert(0, '../libs')
+from libs import log_debug, log_info
+
+class TesterPool:
+    """Tester Pool class
+    This class limits the test-runner VMs running at the same time. Each VM
+    needs a slot from the pool before it boots. The number of VMs is limited
+    by max-vms and the total memory of the VMs(vm-memory in MB per VM) is
+    limited by memory-budget. Config example in TestRunner section:
+        "max-vms": 4, "vm-memory": 1024, "memory-budget": 4096
+    """
+
+    def __init__(self, config=None):
+        if config is None:
+            config = {}
+
+        self.max_vms = config.get('max-vms', 1)
+        self.vm_memory = config.get('vm-memory', 1024)
+        self.memory_budget = config.get('memory-budget', 0)
+        if not self.memory_budget:
+            self.memory_budget = self.max_vms * self.vm_memory
+
+        self._cond = threading.Condition()
+        self._vms = 0
+        self._memory = 0
+
+        log_info(f"TesterPool: max-vms={self.max_vms} "
+                 f"vm-memory={self.vm_memory} "
+                 f"memory-budget={self.memory_budget}")
+
+    def _available(self, memory):
+        if self._vms >= self.max_vms:
+            return False
+
+        # A VM can always run alone even if it is bigger than the budget
+        if self._vms and self._memory + memory > self.memory_budget:
+            return False
+
+        return True
+
+    @contextmanager
+    def vm(self, name, memory=None):
+        """Wait for a VM slot and hold it while in the context"""
+        if memory is None:
+            memory = self.vm_memory
+
+        with self._cond:
+            while not self._available(memory):
+                log_debug(f"TesterPool: {name}: waiting for a VM slot")
+                self._cond.wait()
+            self._vms += 1
+            self._memory += memory
+            log_debug(f"TesterPool: {name}: VM started ({self._vms} running)")
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._vms -= 1
+                self._memory -= memory
+                self._cond.notify_all()
+            log_debug(f"TesterPool: {name}: VM finished")
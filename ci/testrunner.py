@@ -1,17 +1,57 @@
 import os
 import sys
-import re
+import heapq
+import shlex
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, '../libs')
-from libs import cmd_run
+from libs import cmd_run, CacheStore, RepoTool
 
-from ci import Base, Verdict, EndTest, submit_pw_check
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
+from ci.testeroutput import ANSI_RE, LOG_TAIL, TesterOutputParser
+
+# Duration of the test case without the history for the sharding
+DEFAULT_CASE_TIME = 1.0
+
+def prefix_groups(names):
+    """Group the test case names by the name prefix filter(tester -p) which
+    runs them. "Foo 1" also runs "Foo 10", so "Foo 10" is in the group of
+    "Foo 1". Returns the OrderedDict of the prefix to the names."""
+    groups = OrderedDict()
+    prefix = None
+    # The names starting with the prefix are sorted right after the prefix
+    for name in sorted(set(names)):
+        if prefix is None or not name.startswith(prefix):
+            prefix = name
+            groups[prefix] = []
+        groups[prefix].append(name)
+
+    return groups
 
 class TestRunner(Base):
     """Test Runner class
     This class runs the test-runner with the test targer
+    The output is parsed while the tester is running. If the kernel in the VM
+    crashes(i.e. "BUG:" or "Kernel panic"), the VM is killed right away and the
+    last lines of the output are reported.
+    If rerun_config is given, the failed and timed out test cases are run
+    again with the name prefix filter(-p) of the tester. Config example:
+        "rerun": {"attempts": 1, "max-cases": 10}
+    The test cases passed in the rerun are flaky and the history of the test
+    cases is saved in the cache store, so the known flaky cases are marked in
+    the report.
+    If shards is more than 1, the test cases of the tester(tester -l) are
+    split into the shards balanced by the durations in the history, and each
+    shard runs in its own VM. The results of the shards are merged into one
+    result.
+    If batch(ci.TesterBatch) is given, the tester runs in the VM with the
+    other testers in the batch.
     """
-    def __init__(self, ci_data, test_name, bluez_src_dir):
+    def __init__(self, ci_data, test_name, bluez_src_dir, kernel_img=None,
+                 tester_pool=None, rerun_config=None, shards=1, batch=None):
 
         # Common
         self.name = f"TestRunner_{test_name}"
@@ -22,26 +62,40 @@ class TestRunner(Base):
         self.test_name = test_name
         self.test_runner = os.path.join(bluez_src_dir, "tools/test-runner")
         self.test_img = os.path.join(self.ci_data.src_dir, "arch/x86/boot/bzImage")
+        if kernel_img:
+            self.test_img = kernel_img
         self.test_summary = None
+        self.test_cases = []
 
-        super().__init__()
+        # Limits the VMs running at the same time
+        self.tester_pool = tester_pool
 
-        self.log_dbg("Initialization completed")
+        # Rerun of the failed test cases
+        if rerun_config is None:
+            rerun_config = {}
+        self.rerun_attempts = rerun_config.get('attempts', 0)
+        self.rerun_max_cases = rerun_config.get('max-cases', 10)
+        self.history_key = CacheStore.make_key(test_name)
 
-    def parse_result(self, results):
-        """
-        Parse the result line generated by the tester and returns the dict
-        with total, passed, failed, not run, otherwise None.
-        """
+        # Number of VMs to run the test cases
+        self.shards = shards
 
-        regex = r"^Total:\s+(?P<total>\d+)\,\s+Passed:\s+(?P<passed>\d+)\s+\(.+\%\)\,\s+Failed:\s+(?P<failed>\d+)\,\s+Not\s+Run:\s+(?P<notrun>\d+)"
-        matches = re.search(regex, results)
-        if not matches:
-            self.log_err("Unable to parse the result line: {results}")
-            return None
+        # Testers running in the same VM
+        self.batch = batch
+
+        # Directory of the scripts run in the VM. It is created for each run
+        # since the cache root is shared with other jobs.
+        self.script_dir = None
+
+        super().__init__()
 
-        self.log_dbg(f"Result: {matches.groupdict().items()}")
-        return matches.groupdict()
+        # Runs the VM with the binaries built by TestRunnerSetup
+        self.resources = {'cpu': 1, 'memory': 1024}
+        if self.tester_pool:
+            self.resources['memory'] = self.tester_pool.vm_memory
+        self.tree_access = TreeAccess.NONE
+
+        self.log_dbg("Initialization completed")
 
     def run(self):
         self.log_dbg("Run")
@@ -57,9 +111,30 @@ class TestRunner(Base):
                             None, self.ci_data.config['dry_run'])
             self.add_failure_end_test("No tester found")
 
+        self.script_dir = tempfile.mkdtemp(prefix=f"{self.test_name}-",
+                                           dir=self.script_root())
+
         # Running tester
-        cmd = [self.test_runner, "-k", self.test_img, "--", tester_path]
-        (ret, stdout, stderr) = cmd_run(cmd, cwd=self.bluez_src_dir)
+        if self.batch:
+            (ret, stderr, parser) = self.batch.result(self)
+        elif self.shards > 1:
+            (ret, stderr, parser) = self.run_shards(tester_path)
+        else:
+            (ret, stderr, parser) = self.run_vm([tester_path])
+
+        self.test_cases = list(parser.cases.values())
+        self.add_stat("test cases", len(self.test_cases))
+
+        if parser.fatal:
+            self.log_err(f"Kernel crashed: {parser.fatal}")
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.FAIL,
+                            f"{self.name}: {parser.fatal}",
+                            None, self.ci_data.config['dry_run'])
+            self.add_failure(parser.fatal)
+            self.add_failure("\nLog")
+            self.add_failure_end_test(parser.log_tail())
+
         if ret:
             self.log_err("Test failed to run")
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
@@ -68,66 +143,283 @@ class TestRunner(Base):
                             None, self.ci_data.config['dry_run'])
             self.add_failure_end_test(stderr)
 
-        # Process the result
-        stdout_clean = re.sub(r"\x1B\[\d?\;?\d+m", "", stdout)
-        check_fail = False
-        bug = None
-        failed_tc = []
+        if not parser.summary:
+            self.add_failure_end_test("No test result found\n" +
+                                      parser.log_tail())
 
         # verdict result
-        for line in stdout_clean.splitlines():
-            if re.search(r"^Total: ", line):
-                self.test_summary = line
-
-                result = self.parse_result(line)
-                if result["failed"] != "0" or bug:
-                    self.log_dbg("Some test failed")
-
-                    if bug:
-                        desc = f"{self.name}: {bug}"
-                    else:
-                        desc = f"{self.name}: {line}"
-
-                    submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                                    self.name, Verdict.FAIL,
-                                    desc,
-                                    None, self.ci_data.config['dry_run'])
-                    self.add_failure(line)
-
-                    # Adding Failed test cases
-                    if len(failed_tc):
-                        self.add_failure("\nFailed Test Cases")
-                        for tc in failed_tc:
-                            self.add_failure(tc)
-
-                    # No need to check failure
-                    check_fail = False
-                    raise EndTest
-
-                submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                                self.name, Verdict.PASS,
-                                "TestRunner PASS",
-                                None, self.ci_data.config['dry_run'])
-                self.success()
-                return
-
-            if re.search(r"^(BUG:|WARNING:|general protection fault|Kernel panic)", line):
-                bug = line
-                self.add_failure(line)
-
-            if re.search(r"^Test Summary", line):
-                self.log_dbg("Start to check fail in the line")
-                check_fail = True
-
-            if check_fail and re.search(r"Failed", line):
-                self.log_dbg("Found a failed tc")
-                failed_tc.append(line)
-
-            if check_fail and re.search(r"Timed out", line):
-                self.log_dbg("Found a failed tc: Timed out")
-                failed_tc.append(line)
-
-        self.add_failure_end_test("No test result found")
+        self.test_summary = parser.summary_line
+        self.log_dbg(f"Result: {parser.summary}")
+
+        failed_tc = parser.failed_cases()
+        flaky_tc = []
+        if parser.summary["failed"] != "0" and not parser.warnings:
+            flaky_tc = self.rerun_cases(tester_path, failed_tc)
+            failed_tc = [tc for tc in failed_tc if tc not in flaky_tc]
+        history = self.update_history(parser.cases.values(), flaky_tc)
+
+        if flaky_tc and not failed_tc and not parser.warnings:
+            self.log_info("Failed test cases passed in the rerun")
+            output = f"{parser.summary_line}\n\nFlaky Test Cases"
+            for tc in flaky_tc:
+                output += "\n" + tc.line()
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.WARNING,
+                            f"{self.name}: Flaky test cases",
+                            None, self.ci_data.config['dry_run'])
+            self.warning(output)
+            raise EndTest
+
+        if parser.summary["failed"] != "0" or parser.warnings:
+            self.log_dbg("Some test failed")
+
+            if parser.warnings:
+                desc = f"{self.name}: {parser.warnings[0]}"
+                for warning in parser.warnings:
+                    self.add_failure(warning)
+            else:
+                desc = f"{self.name}: {parser.summary_line}"
+
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.FAIL,
+                            desc,
+                            None, self.ci_data.config['dry_run'])
+            self.add_failure(parser.summary_line)
+
+            # Adding Failed test cases
+            if len(failed_tc):
+                self.add_failure("\nFailed Test Cases")
+                for tc in failed_tc:
+                    self.add_failure(tc.line() + self.flaky_note(history,
+                                                                 tc.name))
+            if len(flaky_tc):
+                self.add_failure("\nFlaky Test Cases(passed in the rerun)")
+                for tc in flaky_tc:
+                    self.add_failure(tc.line())
+
+            raise EndTest
+
+        submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                        self.name, Verdict.PASS,
+                        "TestRunner PASS",
+                        None, self.ci_data.config['dry_run'])
+        self.success()
+
+    def run_vm(self, tester_cmd, parser=None):
+        """Run the command in the VM and return (ret, stderr, parser). The
+        output is parsed while the VM is running and the VM is killed if the
+        kernel crashes."""
+        if parser is None:
+            parser = TesterOutputParser(tail=LOG_TAIL)
+        cmd = [self.test_runner, "-k", self.test_img, "--"] + tester_cmd
+        if self.tester_pool:
+            with self.tester_pool.vm(self.name):
+                (ret, stdout, stderr) = cmd_run(cmd, cwd=self.bluez_src_dir,
+                                                stdout_cb=parser.feed,
+                                                stdout_tail=LOG_TAIL)
+        else:
+            (ret, stdout, stderr) = cmd_run(cmd, cwd=self.bluez_src_dir,
+                                            stdout_cb=parser.feed,
+                                            stdout_tail=LOG_TAIL)
+
+        return (ret, stderr, parser)
+
+    def case_script(self, tester_path, names, suffix):
+        """Write the script which runs each test case with the tester and
+        return the path of the script. The script is saved in the script
+        directory of the run(script_root()). The name prefix filter(-p)
+        runs the test cases starting with the name, so the name starting
+        with other name in the list is not run again."""
+        script = os.path.join(self.script_dir, f"{self.test_name}-{suffix}.sh")
+
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\n")
+            for name in prefix_groups(names):
+                f.write(f"{shlex.quote(tester_path)} "
+                        f"-p {shlex.quote(name)}\n")
+
+        return script
+
+    def batch_script(self, names):
+        """Write the script which runs the testers one after another with
+        the delimiters and return the path of the script"""
+        script = os.path.join(self.script_dir, f"batch-{names[0]}.sh")
+
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\n")
+            for name in names:
+                tester_path = os.path.join(self.bluez_src_dir, "tools", name)
+                f.write(f"echo '=== TESTER START: {name} ==='\n")
+                f.write(f"{shlex.quote(tester_path)}\n")
+                f.write(f"echo \"=== TESTER END: {name} $? ===\"\n")
+
+        return script
+
+    def list_cases(self, tester_path):
+        """Return the list of the test case names in the tester. The list is
+        saved in the cache store for the BlueZ commit."""
+        bluez_commit = RepoTool("bluez", self.bluez_src_dir).git_rev_parse(
+                                                                    "HEAD")
+        key = CacheStore.make_key(bluez_commit, self.test_name)
+        data = self.ci_data.cache_store.get("TestRunner-cases", key)
+        if data is not None:
+            return data['cases']
+
+        (ret, stdout, stderr) = cmd_run([tester_path, "-l"])
+        if ret:
+            self.log_err(f"Failed to list the test cases: {stderr}")
+            return None
+
+        cases = []
+        for line in ANSI_RE.sub("", stdout).splitlines():
+            if line.strip() and line.strip() not in cases:
+                cases.append(line.strip())
+
+        if bluez_commit:
+            self.ci_data.cache_store.put("TestRunner-cases", key,
+                                         {'cases': cases})
+        return cases
+
+    def split_cases(self, cases, history):
+        """Split the test cases into the shards. The test cases run by the
+        same name prefix(prefix_groups()) stay in one shard, so each test case
+        runs once. The longest group goes to the shard with the shortest
+        total time first. Returns the list of the prefixes of each shard."""
+        def _time(name):
+            entry = history.get(name)
+            if entry and entry.get("time"):
+                return entry["time"]
+            return DEFAULT_CASE_TIME
+
+        groups = prefix_groups(cases)
+        group_time = {prefix: sum(_time(name) for name in names)
+                      for prefix, names in groups.items()}
+
+        shards = [(0.0, i, []) for i in range(self.shards)]
+        heapq.heapify(shards)
+        for prefix in sorted(groups, key=lambda p: group_time[p],
+                             reverse=True):
+            (total, idx, names) = heapq.heappop(shards)
+            names.append(prefix)
+            heapq.heappush(shards, (total + group_time[prefix], idx, names))
+
+        return [names for (total, idx, names) in sorted(shards,
+                                                        key=lambda s: s[1])
+                if names]
+
+    def run_shards(self, tester_path):
+        """Run the test cases in the shards at the same time and return
+        (ret, stderr, parser) with the merged result"""
+        cases = self.list_cases(tester_path)
+        if not cases:
+            self.log_info("No test case list. Run without the sharding")
+            return self.run_vm([tester_path])
+
+        history = self.ci_data.cache_store.get("TestRunner-history",
+                                               self.history_key) or {}
+        shards = self.split_cases(cases, history)
+        self.add_stat("shards", len(shards))
+
+        scripts = [self.case_script(tester_path, names, f"shard{idx}")
+                   for idx, names in enumerate(shards)]
+        with ThreadPoolExecutor(max_workers=len(scripts)) as executor:
+            results = list(executor.map(
+                            lambda script: self.run_vm(["/bin/sh", script]),
+                            scripts))
+
+        ret = 0
+        stderr = ""
+        for (shard_ret, shard_stderr, shard_parser) in results:
+            if shard_ret:
+                ret = shard_ret
+                stderr += shard_stderr
+
+        parser = TesterOutputParser.merge([r[2] for r in results],
+                                          tail=LOG_TAIL)
+        return (ret, stderr, parser)
+
+    def rerun_cases(self, tester_path, failed_tc):
+        """Run the failed test cases again and return the test cases passed
+        in the rerun. All test cases are run in one VM for each attempt. The
+        name prefix filter also runs the test cases starting with the failed
+        name, but only the results of the failed test cases are used."""
+        if not self.rerun_attempts or not failed_tc:
+            return []
+
+        if len(failed_tc) > self.rerun_max_cases:
+            self.log_info(f"Too many failed test cases to rerun: "
+                          f"{len(failed_tc)}")
+            return []
+
+        remaining = list(failed_tc)
+        passed = []
+        for attempt in range(self.rerun_attempts):
+            self.log_info(f"Rerun {len(remaining)} test cases: "
+                          f"attempt {attempt + 1}")
+            script = self.case_script(tester_path,
+                                      [tc.name for tc in remaining], "rerun")
+            (ret, stderr, parser) = self.run_vm(["/bin/sh", script])
+            if parser.fatal:
+                self.log_err(f"Kernel crashed in the rerun: {parser.fatal}")
+                break
+
+            for tc in list(remaining):
+                rerun_tc = parser.cases.get(tc.name)
+                if rerun_tc and rerun_tc.result == "Passed":
+                    self.log_info(f"Passed in the rerun: {tc.name}")
+                    remaining.remove(tc)
+                    passed.append(tc)
+
+            if not remaining:
+                break
+
+        self.add_stat("rerun", f"{len(passed)}/{len(failed_tc)} passed")
+        return passed
+
+    def update_history(self, cases, flaky_tc):
+        """Update the saved history of the test cases and return it. The
+        history has the number of runs, failures and flaky results(failed and
+        passed in the rerun) and the duration of each test case."""
+        store = self.ci_data.cache_store
+        history = store.get("TestRunner-history", self.history_key) or {}
+
+        flaky_names = [tc.name for tc in flaky_tc]
+        for tc in cases:
+            entry = history.setdefault(tc.name, {"runs": 0, "failures": 0,
+                                                 "flaky": 0})
+            entry["runs"] += 1
+            if tc.failed():
+                entry["failures"] += 1
+            if tc.name in flaky_names:
+                entry["flaky"] += 1
+            if tc.elapsed is not None:
+                # Moving average of the duration
+                if entry.get("time"):
+                    entry["time"] = (entry["time"] + tc.elapsed) / 2
+                else:
+                    entry["time"] = tc.elapsed
+
+        store.put("TestRunner-history", self.history_key, history)
+        return history
+
+    def flaky_note(self, history, name):
+        """Return the note for the known flaky test case"""
+        entry = history.get(name)
+        if not entry or not entry["flaky"]:
+            return ""
+
+        return f" (known flaky: {entry['flaky']}/{entry['runs']} runs)"
+
+    def script_root(self):
+        """Return the directory of the script directories. The VM sees the
+        host file system, so it is in the cache root."""
+        root = os.path.join(self.ci_data.cache_root, "tester")
+        os.makedirs(root, exist_ok=True)
+        return root
 
     def post_run(self):
         self.log_dbg("Post Run...")
+
+        if self.script_dir:
+            shutil.rmtree(self.script_dir, ignore_errors=True)
+            self.script_dir = None
@@ -1,13 +1,21 @@
 import os
 import sys
+import glob
 import shutil
 
-from ci import Base, Verdict, EndTest, submit_pw_check
+sys.path.insert(0, '../libs')
+from libs import CacheStore, RepoTool
+
+from ci import Base, TreeAccess, Verdict, EndTest, submit_pw_check
 from ci import BuildKernel, BuildBluez
 
 class TestRunnerSetup(Base):
     """Test Runner Setup class
     This class builds the bluez and kernel for test-runner
+    The test-runner and the tester binaries are saved in the cache store for
+    the BlueZ commit and the configure options, and the bzImage is saved for
+    the kernel source tree and the tester config. The saved artifacts are
+    restored instead of the build.
     """
 
     def __init__(self, ci_data, bluez_src_dir, tester_config=None):
@@ -27,17 +35,28 @@ class TestRunnerSetup(Base):
         # BlueZ build object
         _params = ["--disable-lsan", "--disable-asan", "--disable-ubsan",
                    "--disable-android"]
+        self.bluez_params = _params
+        # TestRunner runs the tools from the source directory. Build in-tree.
         self.bluez_build = BuildBluez(ci_data, config_params=_params,
                                       src_dir=self.bluez_src_dir,
-                                      dry_run=True)
+                                      dry_run=True, use_build_tree=False)
 
         # Kernel build object
         self.kernel_build = BuildKernel(ci_data,
                                         kernel_config=self.tester_config,
                                         simple_build=False, dry_run=True)
 
+        # Kernel image used by TestRunner
+        self.kernel_img = os.path.join(self.kernel_build.build_dir,
+                                       "arch/x86/boot/bzImage")
+
         super().__init__()
 
+        # Two builds run one after another
+        self.resources = dict(self.bluez_build.resources)
+        self.resources.update(self.kernel_build.resources)
+        self.tree_access = TreeAccess.SHARED
+
         self.log_dbg("Initialization completed")
 
     def run(self):
@@ -45,19 +64,7 @@ class TestRunnerSetup(Base):
         self.log_dbg("Run")
         self.start_timer()
 
-        self.log_info("Building BlueZ")
-        try:
-            self.bluez_build.run()
-        except EndTest as e:
-            self.log_err("Failed to build BlueZ")
-
-        if self.bluez_build.verdict == Verdict.FAIL:
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "BlueZ Make FAIL: " + self.bluez_build.output,
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test("Bluez: " + self.bluez_build.output)
-        self.log_info("Building BlueZ success")
+        self.build_bluez()
 
         # Check test-runner
         self.log_dbg("Checking test-runner binary")
@@ -70,25 +77,11 @@ class TestRunnerSetup(Base):
             self.add_failure_end_test("Build Error: No test-runner found")
         self.log_info("Found test-runner binary")
 
-        self.log_info("Building test kernel image")
-        try:
-            self.kernel_build.run()
-        except EndTest as e:
-            self.log_err("Failed to build kernel")
-
-        if self.kernel_build.verdict == Verdict.FAIL:
-            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
-                            self.name, Verdict.FAIL,
-                            "Kernel Build FAIL: " + self.kernel_build.output,
-                            None, self.ci_data.config['dry_run'])
-            self.add_failure_end_test("Kernel: " + self.kernel_build.output)
-        self.log_info("Building kernel success")
+        self.build_kernel()
 
         # Check kernel image
         self.log_dbg("Checking kernel image")
-        bzimage_path = os.path.join(self.ci_data.src_dir,
-                                    "arch/x86/boot/bzImage")
-        if not os.path.exists(bzimage_path):
+        if not os.path.exists(self.kernel_img):
             submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
                             self.name, Verdict.FAIL,
                             "Kernel Build FAIL: No bzImage found",
@@ -104,5 +97,85 @@ class TestRunnerSetup(Base):
         self.log_info("TestRunnerSetup PASS")
         self.success()
 
+    def bluez_artifacts(self):
+        """Return the tester binaries relative to the BlueZ source"""
+        files = ["tools/test-runner"]
+        for fn in sorted(glob.glob(os.path.join(self.bluez_src_dir, "tools",
+                                                "*-tester"))):
+            files.append(os.path.relpath(fn, self.bluez_src_dir))
+
+        return [fn for fn in files
+                if os.path.exists(os.path.join(self.bluez_src_dir, fn))]
+
+    def build_bluez(self):
+        store = self.ci_data.cache_store
+        bluez_repo = RepoTool("bluez", self.bluez_src_dir)
+        bluez_commit = bluez_repo.git_rev_parse("HEAD")
+        key = CacheStore.make_key(bluez_commit, self.bluez_params)
+
+        if bluez_commit and store.get_dir(f"{self.name}-bluez", key,
+                                          self.bluez_src_dir, clean=False):
+            self.log_info("Restored BlueZ tools from the cache")
+            self.add_stat("artifact cache(BlueZ)", "hit")
+            return
+        self.add_stat("artifact cache(BlueZ)", "miss")
+
+        self.log_info("Building BlueZ")
+        try:
+            self.bluez_build.run()
+        except EndTest as e:
+            self.log_err("Failed to build BlueZ")
+
+        for name, value in self.bluez_build.stats.items():
+            self.add_stat(f"{name}(BlueZ)", value)
+
+        if self.bluez_build.verdict == Verdict.FAIL:
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.FAIL,
+                            "BlueZ Make FAIL: " + self.bluez_build.output,
+                            None, self.ci_data.config['dry_run'])
+            self.add_failure_end_test("Bluez: " + self.bluez_build.output)
+        self.log_info("Building BlueZ success")
+
+        if bluez_commit:
+            store.put_dir(f"{self.name}-bluez", key, self.bluez_src_dir,
+                          files=self.bluez_artifacts())
+
+    def build_kernel(self):
+        store = self.ci_data.cache_store
+        tree_hash = self.ci_data.src_repo.git_rev_parse("HEAD^{tree}")
+        key = CacheStore.make_key(tree_hash, self.kernel_build.config_hash())
+        img_file = os.path.relpath(self.kernel_img,
+                                   self.kernel_build.build_dir)
+
+        if tree_hash and store.get_dir(f"{self.name}-kernel", key,
+                                       self.kernel_build.build_dir,
+                                       clean=False):
+            self.log_info("Restored kernel image from the cache")
+            self.add_stat("artifact cache(Kernel)", "hit")
+            return
+        self.add_stat("artifact cache(Kernel)", "miss")
+
+        self.log_info("Building test kernel image")
+        try:
+            self.kernel_build.run()
+        except EndTest as e:
+            self.log_err("Failed to build kernel")
+
+        for name, value in self.kernel_build.stats.items():
+            self.add_stat(f"{name}(Kernel)", value)
+
+        if self.kernel_build.verdict == Verdict.FAIL:
+            submit_pw_check(self.ci_data.pw, self.ci_data.patch_1,
+                            self.name, Verdict.FAIL,
+                            "Kernel Build FAIL: " + self.kernel_build.output,
+                            None, self.ci_data.config['dry_run'])
+            self.add_failure_end_test("Kernel: " + self.kernel_build.output)
+        self.log_info("Building kernel success")
+
+        if tree_hash and os.path.exists(self.kernel_img):
+            store.put_dir(f"{self.name}-kernel", key,
+                          self.kernel_build.build_dir, files=[img_file])
+
     def post_run(self):
         self.log_dbg("Post Run...")
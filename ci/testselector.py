@@ -0,0 +1,94 @@
+import sys
+from fnmatch import fnmatch
+
+sys.path.insert(0, '../libs')
+from libs import log_debug, log_info
+
+class TestSelector:
+    """Test Selector class
+    This class selects the tests to run with the files changed in the series
+    or in the patch. The rules map the path globs to the test names(globs) and
+    the first rule matching the file decides the tests required for the file.
+    A file not matched by any rule requires all tests, so a change the rules
+    don't know about is always fully tested. The tests in "always" run for
+    any change. Config example:
+        "test-selection": {
+          "enable": true,
+          "user": {
+            "always": ["CheckPatch", "GitLint"],
+            "rules": [
+              {"paths": ["doc/*.txt"], "tests": []},
+              {"paths": ["src/*"], "tests": ["*"]}
+            ]
+          }
+        }
+    """
+
+    def __init__(self, config=None, space=None):
+        if config is None:
+            config = {}
+
+        self.enable = config.get('enable', False)
+
+        space_config = config.get(space, {})
+        self.always = space_config.get('always', [])
+        self.rules = space_config.get('rules', [])
+
+        log_info(f"TestSelector: enable={self.enable} "
+                 f"rules={len(self.rules)}")
+
+    def _match_rule(self, filename):
+        """Return the first rule matching the file or None"""
+        for rule in self.rules:
+            for pattern in rule.get('paths', []):
+                if fnmatch(filename, pattern):
+                    return rule
+        return None
+
+    def required_tests(self, files):
+        """Return the list of test name globs required by the files or None
+        if all tests are required"""
+        if not self.enable or files is None:
+            return None
+
+        required = list(self.always)
+        for filename in files:
+            rule = self._match_rule(filename)
+            if rule is None:
+                log_debug(f"TestSelector: no rule for {filename}. All tests")
+                return None
+
+            log_debug(f"TestSelector: {filename}: {rule.get('tests', [])}")
+            required += rule.get('tests', [])
+
+        return required
+
+    @staticmethod
+    def _in_required(name, required):
+        if required is None:
+            return True
+
+        return any(fnmatch(name, pattern) for pattern in required)
+
+    def is_required(self, name, files):
+        """Return True if the test is required by the files"""
+        return self._in_required(name, self.required_tests(files))
+
+    def select(self, test_list, files):
+        """Return the list of tests not required by the files. The tests
+        required by the selected tests are also selected."""
+        selected = set()
+
+        def _select(test):
+            if test in selected:
+                return
+            selected.add(test)
+            for req in test.requires:
+                _select(req)
+
+        required = self.required_tests(files)
+        for test in test_list:
+            if self._in_required(test.name, required):
+                _select(test)
+
+        return [test for test in test_list if test not in selected]
@@ -61,7 +61,15 @@ function clone_ell {
     # remove if already exist
     DEST_DIR=$1
     rm -rf $DEST_DIR
-    git clone --depth=1 https://git.kernel.org/pub/scm/libs/ell/ell $DEST_DIR
+    # Clone with the local mirror as reference. Without the mirror, the
+    # shallow clone is used.
+    /mirror.py -c /config.json clone --fallback-depth=1 https://git.kernel.org/pub/scm/libs/ell/ell $DEST_DIR || {
+        echo "Failed to clone with the mirror. Clone with --depth=1"
+        rm -rf $DEST_DIR
+        git clone --depth=1 https://git.kernel.org/pub/scm/libs/ell/ell $DEST_DIR
+    }
+    # Populate the mirror for the next jobs without blocking this job
+    /mirror.py -c /config.json update https://git.kernel.org/pub/scm/libs/ell/ell > /dev/null 2>&1 &
     cd $DEST_DIR
     git log -1 --format='%H'
 }
@@ -71,7 +79,15 @@ function clone_bluez {
     # remove if already exist
     DEST_DIR=$1
     rm -rf $DEST_DIR
-    git clone --depth=1 https://git.kernel.org/pub/scm/bluetooth/bluez $DEST_DIR
+    # Clone with the local mirror as reference. Without the mirror, the
+    # shallow clone is used.
+    /mirror.py -c /config.json clone --fallback-depth=1 https://git.kernel.org/pub/scm/bluetooth/bluez $DEST_DIR || {
+        echo "Failed to clone with the mirror. Clone with --depth=1"
+        rm -rf $DEST_DIR
+        git clone --depth=1 https://git.kernel.org/pub/scm/bluetooth/bluez $DEST_DIR
+    }
+    # Populate the mirror for the next jobs without blocking this job
+    /mirror.py -c /config.json update https://git.kernel.org/pub/scm/bluetooth/bluez > /dev/null 2>&1 &
     cd $DEST_DIR
     git log -1 --format='%H'
 }
@@ -3,4 +3,13 @@ from .patchwork import Patchwork, PostException
 from .email import EmailTool
 from .repotool import RepoTool
 from .githubtool import GithubTool
+from .ccache import CCache
+from .compiletimer import CompileTimer
+from .buildtree import BuildTree, BuildTreeManager
+from .cachestore import CacheStore
+from .mirror import MirrorManager
+from .diffparser import PatchDiff, parse_diff, series_files, series_base_files
+from .lineindex import LineIndex
+from .diagnostics import Diagnostic, DiagnosticParser, DiagnosticStore
+from .diagnostics import STDERR_TAIL
 from .context import Context
@@ -0,0 +1,180 @@
+import os
+import json
+import shlex
+import shutil
+import hashlib
+import threading
+
+import libs
+
+
+class BuildTree:
+    """Out-of-tree build directory for one build variant
+    The variant is the list of options that changes the output of the build
+    such as configure flags or the compiler. The source directory is never
+    used for the build output.
+    """
+
+    def __init__(self, manager, src_dir, variant, path):
+        self.manager = manager
+        self.src_dir = src_dir
+        self.variant = variant
+        self.path = path
+
+        # Set by the user of the tree after configure succeeded
+        self.configured = False
+
+    def configure_cmd(self):
+        """Return the configure command for the autotools VPATH build.
+        It uses the same options in the bootstrap-configure of the source
+        and it needs to run in the build tree.
+        """
+        self.manager.bootstrap(self.src_dir)
+
+        configure = os.path.relpath(os.path.join(self.src_dir, "configure"),
+                                    self.path)
+        return [configure] + self.manager.bootstrap_options(self.src_dir)
+
+    def src_path(self, path):
+        """Convert the path in the build output to the path relative to the
+        source directory. The compiler in the build tree sees the sources as
+        ../path/to/src/file.c
+        """
+        full_path = os.path.normpath(os.path.join(self.path, path))
+        if not full_path.startswith(self.src_dir + os.sep):
+            return path
+
+        return os.path.relpath(full_path, self.src_dir)
+
+
+class BuildTreeManager:
+    """Build Tree Manager class
+    This class manages the out-of-tree build directories under the root dir.
+    The build directory is keyed by the source directory and the variant, so
+    the tests with the same variant share the configured and built tree.
+    The tree is removed when it is used first time in this run unless the
+    persist_key(i.e. base commit) is given. The persistent tree is kept across
+    the runs and only one tree is kept for each variant. If there is no tree
+    for the persist_key, the tree of the old key is taken over, so the build
+    starts from the warm tree.
+    """
+
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+        self._trees = {}
+        self._bootstrapped = []
+        self._options = {}
+        self._lock = threading.Lock()
+
+        libs.log_info(f"BuildTreeManager: root: {self._root}")
+
+    def root(self):
+        return self._root
+
+    def _key(self, src_dir, variant):
+        data = json.dumps([os.path.abspath(src_dir), sorted(variant)])
+        return hashlib.sha1(data.encode()).hexdigest()[:16]
+
+    def get_tree(self, src_dir, variant=None, persist_key=None):
+        """Return the BuildTree for the variant. Same object is returned for
+        the same source directory and the variant.
+        """
+        if variant is None:
+            variant = []
+
+        key = self._key(src_dir, variant)
+        if persist_key:
+            key = os.path.join(key, persist_key)
+
+        if key in self._trees:
+            libs.log_debug(f"BuildTreeManager: reuse tree {key}: {variant}")
+            return self._trees[key]
+
+        path = os.path.join(self._root, key)
+        if persist_key:
+            self._take_over(path)
+        elif os.path.exists(path):
+            libs.log_debug(f"BuildTreeManager: remove old tree {path}")
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        libs.log_info(f"BuildTreeManager: new tree {path}: {variant}")
+        tree = BuildTree(self, os.path.abspath(src_dir), variant, path)
+        self._trees[key] = tree
+
+        return tree
+
+    def _take_over(self, path):
+        """Keep the only one persistent tree for the variant. If the path
+        doesn't exist, the latest tree of the variant is moved to the path.
+        """
+        variant_dir = os.path.dirname(path)
+        if not os.path.exists(variant_dir):
+            return
+
+        old_trees = [os.path.join(variant_dir, d)
+                     for d in os.listdir(variant_dir)
+                     if os.path.join(variant_dir, d) != path]
+        old_trees.sort(key=os.path.getmtime)
+
+        if not os.path.exists(path) and old_trees:
+            latest = old_trees.pop()
+            libs.log_info(f"BuildTreeManager: take over {latest} -> {path}")
+            os.rename(latest, path)
+        elif os.path.exists(path):
+            libs.log_info(f"BuildTreeManager: reuse persistent tree {path}")
+
+        for old_tree in old_trees:
+            libs.log_debug(f"BuildTreeManager: remove old tree {old_tree}")
+            shutil.rmtree(old_tree)
+
+    def bootstrap(self, src_dir):
+        """Generate the configure script in the source directory once"""
+        with self._lock:
+            return self._bootstrap(src_dir)
+
+    def _bootstrap(self, src_dir):
+        if src_dir in self._bootstrapped:
+            return 0
+
+        # VPATH build is not allowed if the source is configured in-tree
+        if os.path.exists(os.path.join(src_dir, "config.status")):
+            libs.log_info("BuildTreeManager: source is configured. Clean it")
+            libs.cmd_run(["make", "distclean"], cwd=src_dir)
+
+        (ret, stdout, stderr) = libs.cmd_run(["./bootstrap"], cwd=src_dir)
+        if ret:
+            libs.log_error(f"BuildTreeManager: bootstrap failed: {src_dir}")
+            return ret
+
+        self._bootstrapped.append(src_dir)
+        return 0
+
+    def bootstrap_options(self, src_dir):
+        """Read the configure options from the bootstrap-configure script"""
+        if src_dir in self._options:
+            return self._options[src_dir]
+
+        with open(os.path.join(src_dir, "bootstrap-configure"), "r") as f:
+            script = f.read()
+
+        options = []
+        for line in script.replace("\\\n", " ").splitlines():
+            idx = line.find("./configure")
+            if idx < 0:
+                continue
+
+            for opt in shlex.split(line[idx + len("./configure"):]):
+                # Stop at the end of the command
+                if opt in ("&&", "||", ";"):
+                    break
+                # Skip the script arguments($*, $@)
+                if opt.startswith("$"):
+                    continue
+                options.append(opt)
+            break
+
+        libs.log_debug(f"BuildTreeManager: bootstrap options: {options}")
+        self._options[src_dir] = options
+
+        return options
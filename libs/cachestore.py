@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import tarfile
+import hashlib
+import tempfile
+
+import libs
+
+
+class CacheStore:
+    """Cache Store class
+    This class stores the data(JSON) under the root directory. The data is
+    grouped by the name(i.e. the test name) and identified by the key made
+    from the inputs of the data such as the base commit and the tool version.
+    The directory can be stored as the compressed tarball with put_dir() and
+    restored with get_dir().
+    The data is written atomically, so the runs at the same time never see the
+    partial data.
+    """
+
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+
+        libs.log_info(f"CacheStore: root: {self._root}")
+
+    def root(self):
+        return self._root
+
+    @staticmethod
+    def make_key(*parts):
+        """Return the key for the list of inputs"""
+        data = json.dumps(parts, sort_keys=True)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def path(self, name, key, suffix=""):
+        """Return the path of the entry"""
+        return os.path.join(self._root, name, key + suffix)
+
+    def get(self, name, key):
+        """Return the data of the entry or None if not found"""
+        path = self.path(name, key, ".json")
+        if not os.path.exists(path):
+            libs.log_debug(f"CacheStore: miss: {name}/{key}")
+            return None
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            libs.log_error(f"CacheStore: Failed to read {path}")
+            return None
+
+        libs.log_debug(f"CacheStore: hit: {name}/{key}")
+        return data
+
+    def put(self, name, key, data):
+        """Save the data to the entry"""
+        path = self.path(name, key, ".json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+        libs.log_debug(f"CacheStore: saved: {name}/{key}")
+
+    def get_dir(self, name, key, dest_dir, clean=True):
+        """Extract the saved directory to the dest_dir. The dest_dir is
+        removed first if clean is True. Returns False if not found"""
+        path = self.path(name, key, ".tar.gz")
+        if not os.path.exists(path):
+            libs.log_debug(f"CacheStore: miss: {name}/{key}")
+            return False
+
+        if clean and os.path.exists(dest_dir):
+            shutil.rmtree(dest_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+
+        try:
+            with tarfile.open(path, "r:gz") as tar:
+                tar.extractall(dest_dir)
+        except (OSError, tarfile.TarError):
+            libs.log_error(f"CacheStore: Failed to extract {path}")
+            if clean:
+                shutil.rmtree(dest_dir)
+            return False
+
+        libs.log_debug(f"CacheStore: hit: {name}/{key}")
+        return True
+
+    def put_dir(self, name, key, src_dir, files=None):
+        """Save the directory as the compressed tarball. If files is given,
+        only the files(relative path to the src_dir) are saved."""
+        path = self.path(name, key, ".tar.gz")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            with tarfile.open(fileobj=f, mode="w:gz") as tar:
+                if files is None:
+                    tar.add(src_dir, arcname=".")
+                else:
+                    for fn in files:
+                        tar.add(os.path.join(src_dir, fn), arcname=fn)
+        os.replace(tmp_path, path)
+
+        libs.log_debug(f"CacheStore: saved: {name}/{key}")
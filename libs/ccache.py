@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+
+import libs
+
+
+# Fixed build identity for the kernel. Without these, init/version.o and
+# the generated compile.h change every run and ccache can't hit them.
+KBUILD_REPRODUCIBLE_ENV = {
+    'KBUILD_BUILD_TIMESTAMP': 'Thu Jan  1 00:00:00 UTC 1970',
+    'KBUILD_BUILD_USER': 'bzcafe',
+    'KBUILD_BUILD_HOST': 'bzcafe',
+}
+
+
+# Counters in the stats log(CCACHE_STATSLOG). Other counters such as
+# local_storage_hit(ccache >= 4.6) are logged with these and not counted.
+HIT_COUNTERS = ('direct_cache_hit', 'preprocessed_cache_hit')
+MISS_COUNTERS = ('cache_miss',)
+UNCACHEABLE_COUNTERS = (
+    'autoconf_test', 'bad_compiler_arguments', 'bad_input_file',
+    'bad_output_file', 'called_for_link', 'called_for_preprocessing',
+    'compile_failed', 'compiler_check_failed', 'compiler_produced_empty_output',
+    'compiler_produced_no_output', 'compiler_produced_stdout',
+    'could_not_use_modules', 'could_not_use_precompiled_header',
+    'disabled', 'internal_error', 'missing_cache_file',
+    'modified_input_file', 'multiple_source_files', 'no_input_file',
+    'output_to_stdout', 'preprocessor_error', 'unsupported_code_directive',
+    'unsupported_compiler_option', 'unsupported_environment_variable',
+    'unsupported_source_language',
+)
+
+
+class CCache:
+    """Compiler cache(ccache) helper
+    This class holds the ccache settings from the config and provides the
+    compiler wrapper and the environment variables for the build.
+    Each build uses its own stats log(CCACHE_STATSLOG) so the hit and miss
+    counts can be reported per test.
+    """
+
+    def __init__(self, config=None, cache_root=None):
+        self.enable = False
+        self.cache_dir = None
+        self.max_size = None
+        self.compiler = "gcc"
+
+        if config:
+            self.enable = config.get('enable', False)
+            self.cache_dir = config.get('dir', None)
+            self.max_size = config.get('max-size', None)
+            self.compiler = config.get('compiler', "gcc")
+
+        if not self.cache_dir and cache_root:
+            self.cache_dir = os.path.join(cache_root, "ccache")
+
+        if not self.enable:
+            libs.log_info("CCache: disabled")
+            return
+
+        if not shutil.which("ccache"):
+            libs.log_error("CCache: ccache not found. Disable compiler cache")
+            self.enable = False
+            return
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        if self.max_size:
+            libs.cmd_run(["ccache", "--max-size", self.max_size],
+                         add_env=self.env())
+
+        libs.log_info(f"CCache: enabled: dir={self.cache_dir} "
+                      f"max-size={self.max_size}")
+
+    def cc(self):
+        """Return the compiler wrapped by ccache"""
+        return f"ccache {self.compiler}"
+
+    def env(self, base_dir=None, stats_log=None):
+        """Return the environment variables for the build.
+        base_dir is used to rewrite the absolute paths to the relative paths
+        so the same sources in the different directory can hit the cache.
+        """
+        env = {}
+
+        if self.cache_dir:
+            env['CCACHE_DIR'] = self.cache_dir
+
+        if base_dir:
+            env['CCACHE_BASEDIR'] = os.path.abspath(base_dir)
+            env['CCACHE_NOHASHDIR'] = "true"
+
+        if stats_log:
+            env['CCACHE_STATSLOG'] = stats_log
+
+        return env
+
+    def new_stats_log(self, name):
+        """Create an empty stats log file for the build and return the path"""
+        fd, path = tempfile.mkstemp(prefix=f"ccache-{name}-", suffix=".log")
+        os.close(fd)
+        return path
+
+    @staticmethod
+    def remove_stats_log(stats_log):
+        """Remove the stats log file of the build"""
+        if stats_log and os.path.exists(stats_log):
+            os.remove(stats_log)
+
+    @staticmethod
+    def read_stats(stats_log):
+        """Read the stats log and return the dict with hit, miss and
+        uncacheable counts. The stats log has the counter names for each
+        compiler call, one per line. Only the known counters are counted.
+        """
+        stats = {'hit': 0, 'miss': 0, 'uncacheable': 0}
+
+        if not stats_log or not os.path.exists(stats_log):
+            return stats
+
+        with open(stats_log, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+
+                if line in HIT_COUNTERS:
+                    stats['hit'] += 1
+                elif line in MISS_COUNTERS:
+                    stats['miss'] += 1
+                elif line in UNCACHEABLE_COUNTERS:
+                    stats['uncacheable'] += 1
+
+        return stats
+
+    @staticmethod
+    def format_stats(stats):
+        total = stats['hit'] + stats['miss']
+        rate = (stats['hit'] * 100 / total) if total else 0
+
+        return (f"hit {stats['hit']}, miss {stats['miss']}, "
+                f"uncacheable {stats['uncacheable']} ({rate:.1f}% hit rate)")
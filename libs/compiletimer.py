@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import tempfile
+
+import libs
+
+# The shell wrapper given to make as SHELL=. It runs the recipe with the real
+# shell and appends the record of the recipe to the timeline. It runs once
+# per recipe, so it only uses the modules loaded quickly(python -S).
+SHELL_WRAPPER = '''#!{python} -S
+import json, os, resource, subprocess, sys, time
+
+start = time.time()
+ret = subprocess.call([{shell!r}] + sys.argv[1:])
+end = time.time()
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+cmd = sys.argv[-1] if len(sys.argv) > 1 else ""
+args = cmd.split()
+target = None
+for i, arg in enumerate(args[:-1]):
+    if arg == "-o":
+        target = args[i + 1]
+
+record = {{"target": target, "start": start, "end": end,
+          "elapsed": end - start, "maxrss": usage.ru_maxrss, "ret": ret,
+          "cwd": os.getcwd(), "cmd": cmd[:{max_cmd}]}}
+fd = os.open({timeline!r}, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+os.write(fd, (json.dumps(record) + "\\n").encode())
+os.close(fd)
+sys.exit(ret)
+'''
+
+
+class CompileTimer:
+    """Compile Timer class
+    This class holds the compile timing settings from the config and provides
+    the shell wrapper for make(SHELL=). The wrapper records the start and end
+    time, the command and the max RSS of each recipe to the timeline, the
+    JSON line file of the build. Only the recipes with the output(-o), i.e.
+    the compile and the link, are the targets in the report.
+    """
+
+    def __init__(self, config=None, root=None):
+        self.enable = False
+        self.top = 20
+        self.max_cmd = 1024
+        self.root = root
+
+        if config:
+            self.enable = config.get('enable', False)
+            self.top = config.get('top', 20)
+            self.max_cmd = config.get('max-cmd', 1024)
+            self.root = config.get('dir', root)
+
+        if self.root:
+            self.root = os.path.expanduser(self.root)
+
+        if not self.enable:
+            libs.log_info("CompileTimer: disabled")
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        libs.log_info(f"CompileTimer: enabled: dir={self.root} top={self.top}")
+
+    def new_log(self, name, shell="/bin/sh"):
+        """Create an empty timeline and the shell wrapper for the build and
+        return the timeline path"""
+        fd, path = tempfile.mkstemp(prefix=f"{name}-", suffix=".jsonl",
+                                    dir=self.root)
+        os.close(fd)
+
+        wrapper = self.wrapper_path(path)
+        with open(wrapper, "w") as f:
+            f.write(SHELL_WRAPPER.format(python=sys.executable,
+                                         shell=shell, timeline=path,
+                                         max_cmd=self.max_cmd))
+        os.chmod(wrapper, 0o755)
+
+        return path
+
+    @staticmethod
+    def wrapper_path(timeline):
+        return os.path.splitext(timeline)[0] + ".sh"
+
+    @staticmethod
+    def report_path(timeline):
+        return os.path.splitext(timeline)[0] + ".txt"
+
+    def make_params(self, timeline):
+        """Return the make parameters to run the recipes with the wrapper"""
+        return [f"SHELL={self.wrapper_path(timeline)}"]
+
+    @staticmethod
+    def read_timeline(timeline):
+        """Read the timeline and return the list of the records of the
+        targets sorted by the elapsed time"""
+        records = []
+
+        if not timeline or not os.path.exists(timeline):
+            return records
+
+        with open(timeline, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial line of the killed build
+                    continue
+                if record.get('target'):
+                    records.append(record)
+
+        records.sort(key=lambda r: r['elapsed'], reverse=True)
+        return records
+
+    @staticmethod
+    def format_stats(records):
+        if not records:
+            return "no target"
+
+        total = sum(r['elapsed'] for r in records)
+        wall = max(r['end'] for r in records) - min(r['start'] for r in records)
+        slowest = records[0]
+        return (f"{len(records)} targets, {total:.1f} s in {wall:.1f} s, "
+                f"slowest {slowest['target']} ({slowest['elapsed']:.1f} s)")
+
+    def report(self, records, top=None):
+        """Return the text of the top N targets by the elapsed time"""
+        top = top or self.top
+
+        lines = [f"{'Elapsed':>9} {'MaxRSS':>9}  Target"]
+        for r in records[:top]:
+            lines.append(f"{r['elapsed']:8.2f}s {r['maxrss'] // 1024:7d}MB  "
+                         f"{r['target']}")
+        lines.append(self.format_stats(records))
+
+        return "\n".join(lines) + "\n"
+
+    def save_report(self, timeline):
+        """Write the report next to the timeline. Returns the target records
+        and the report"""
+        records = self.read_timeline(timeline)
+        report = self.report(records)
+        with open(self.report_path(timeline), "w") as f:
+            f.write(report)
+
+        return records, report
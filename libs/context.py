@@ -1,7 +1,12 @@
 import os
 import json
+import threading
 
-from libs import EmailTool, GithubTool, Patchwork, RepoTool
+from libs import BuildTreeManager, CacheStore, CCache, CompileTimer
+from libs import EmailTool, GithubTool
+from libs import MirrorManager, Patchwork
+from libs import parse_diff, series_files, series_base_files
+from libs import LineIndex, RepoTool
 from libs import log_info, log_debug, log_error
 
 
@@ -71,6 +76,35 @@ class Context():
         self.src_dir = self.src_repo.path()
         self.patch_root = patch_root
 
+        # Init cache root. All persistent caches are stored under this folder
+        cache_config = self.config.get('cache', {})
+        self.cache_root = os.path.expanduser(cache_config.get('root',
+                                                  '~/.cache/bzcafe'))
+        log_info(f"Initialize Cache root: {self.cache_root}")
+
+        # Init compiler cache
+        self.ccache = CCache(cache_config.get('ccache'), self.cache_root)
+
+        # Init per target compile timing of the builds
+        self.compile_timer = CompileTimer(self.config.get('compile-timing'),
+                                          os.path.join(self.cache_root,
+                                                       "timing"))
+
+        # Init out-of-tree build directories
+        self.build_trees = BuildTreeManager(os.path.join(self.cache_root,
+                                                         "build"))
+
+        # Init the worktree pool of the source
+        self.src_repo.set_worktree_root(os.path.join(self.cache_root,
+                                                     "worktrees",
+                                                     os.path.basename(src_dir)))
+
+        # Init the local mirrors of the upstream repos
+        self.mirrors = MirrorManager(os.path.join(self.cache_root, "mirror"))
+
+        # Init the store for the cached results such as the base diagnostics
+        self.cache_store = CacheStore(os.path.join(self.cache_root, "store"))
+
         # Custome confguration
         for kw in kwargs:
             log_info(f"Storing {kw}:{kwargs[kw]}")
@@ -79,9 +113,66 @@ class Context():
         # These are the frequently used variables by CI
         self.series = None
         self.patch_1 = None
+        self._base_commit = None
+
+        # Parsed diffs of the patches. The tests running at the same time
+        # share them.
+        self._patch_diffs = {}
+        self._diff_lock = threading.Lock()
+        self._line_index = None
 
         log_info("Context Initialization Completed")
 
+    def base_commit(self):
+        """Return the commit id of the base branch where the PR is pushed"""
+        if not self._base_commit:
+            branch = self.config.get('branch', 'workflow')
+            self._base_commit = self.src_repo.git_rev_parse(f"origin/{branch}")
+
+        return self._base_commit
+
+    def patch_diff(self, patch_id):
+        """Return the parsed diff(PatchDiff) of the patch. The diff is read
+        from the patchwork and parsed only once for the patch."""
+        with self._diff_lock:
+            if patch_id not in self._patch_diffs:
+                patch = self.pw.get_patch(patch_id)
+                self._patch_diffs[patch_id] = parse_diff(patch['diff'])
+
+            return self._patch_diffs[patch_id]
+
+    def series_diffs(self, series=None):
+        """Return the list of the parsed diffs of the patches in the series"""
+        if series is None:
+            series = self.series
+
+        return [self.patch_diff(patch['id']) for patch in series['patches']]
+
+    def series_file_list(self, series=None, ignore_new_file=False):
+        """Return the list of files changed by the series"""
+        return series_files(self.series_diffs(series), ignore_new_file)
+
+    def series_base_file_list(self, series=None):
+        """Return the list of files in the base tree changed by the series"""
+        return series_base_files(self.series_diffs(series))
+
+    def changed_line_index(self):
+        """Return the LineIndex of the lines changed by the series or None if
+        it fails. The margin is read from the "changed-lines" config."""
+        with self._diff_lock:
+            if self._line_index:
+                return self._line_index
+
+            diff = self.src_repo.git_diff(self.base_commit(), context=0)
+            if diff is None:
+                log_error("Failed to read the diff of the series")
+                return None
+
+            margin = self.config.get('changed-lines', {}).get('margin', 3)
+            self._line_index = LineIndex.from_diff(parse_diff(diff), margin)
+
+            return self._line_index
+
     def update_series(self, series):
         self.series = series
         self.patch_1 = series['patches'][0]
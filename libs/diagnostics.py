@@ -0,0 +1,202 @@
+import re
+import sys
+import threading
+
+import libs
+
+# Lines of the stderr kept when the diagnostics are parsed while the command
+# is running
+STDERR_TAIL = 200
+
+# "path:line:col: severity: message" (gcc, clang, sparse)
+GCC_RE = re.compile(r'^(\S+?):(\d+):(?:(\d+):)? '
+                    r'(warning|error|fatal error|note|info): (.*)$')
+
+# "path:line func() severity: message" (smatch)
+SMATCH_RE = re.compile(r'^(\S+?):(\d+) (\S+\(\)) (warn|error|info): (.*)$')
+
+# "In file included from path:line," and "                 from path:line:"
+INCLUDED_RE = re.compile(r'^(?:In file included|\s+) from (\S+?):(\d+)[:,]$')
+
+# "path: note: in included file (through path):" (sparse)
+SPARSE_INCLUDED_RE = re.compile(r'^(\S+?):(?:\d+:\d+:)? note: in included file')
+
+
+class Diagnostic:
+    """Diagnostic record from the compiler or the checker"""
+
+    __slots__ = ('file', 'line', 'column', 'severity', 'checker', 'message',
+                 'includes', 'context')
+
+    def __init__(self, file, line, column, severity, checker, message,
+                 includes=()):
+        self.file = file
+        self.line = line
+        self.column = column
+        self.severity = severity
+        self.checker = checker
+        self.message = message
+        # Chain of the files including this file
+        self.includes = includes
+        # Lines following the diagnostic such as the source snippet
+        self.context = None
+
+    def key(self):
+        """Return the normalized diagnostic without the line and column
+        numbers, since the patch moves the lines"""
+        return f"{self.file}: {self.severity}: {self.message}"
+
+    def text(self):
+        """Return the diagnostic in the compiler format"""
+        location = f"{self.file}:{self.line}"
+        if self.column:
+            location += f":{self.column}"
+        text = f"{location}: {self.severity}: {self.message}"
+        if self.context:
+            text += "\n" + "\n".join(self.context)
+        return text
+
+
+class DiagnosticStore:
+    """Diagnostic Store class
+    This class keeps the diagnostic records. The same strings(i.e. the file
+    path and the checker) are shared by the records, and the output lines
+    which are not diagnostics are not kept.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(list(self.records))
+
+    def filter(self, func):
+        """Return the list of the records for which func returns True"""
+        return [r for r in self.records if func(r)]
+
+    def in_files(self, file_list):
+        """Return the records in the files or in the files included by the
+        files"""
+        files = set(file_list)
+        return self.filter(lambda r: r.file in files or
+                           any(f in files for f in r.includes))
+
+    def in_lines(self, index):
+        """Return the records in the lines of the index(libs.LineIndex)"""
+        return self.filter(lambda r: index.contains(r.file, r.line))
+
+    def counts(self):
+        """Return the dict of the severity to the number of records"""
+        counts = {}
+        for r in self.records:
+            counts[r.severity] = counts.get(r.severity, 0) + 1
+        return counts
+
+    @staticmethod
+    def format(records):
+        """Return the text of the records for the report"""
+        if not records:
+            return ""
+        return "\n".join(r.text() for r in records) + "\n"
+
+
+class DiagnosticParser:
+    """Diagnostic Parser class
+    This class parses the output of the compiler and the checkers line by line
+    while the command is running(cmd_run(stderr_cb=parser.feed)) and adds the
+    records to the store. src_path converts the path in the output to the
+    path relative to the source directory.
+    The indented lines after a diagnostic(i.e. the source snippet) are kept
+    up to max_context lines.
+    """
+
+    def __init__(self, checker, store=None, src_path=None, max_context=4):
+        self.checker = sys.intern(checker)
+        self.store = store if store is not None else DiagnosticStore()
+        self.src_path = src_path
+        self.max_context = max_context
+
+        self._includes = []
+        self._sparse_include = None
+        self._last = None
+        self._paths = {}
+
+    def _path(self, path):
+        """Return the converted path. The path is shared by the records"""
+        if path not in self._paths:
+            converted = self.src_path(path) if self.src_path else path
+            self._paths[path] = sys.intern(converted)
+        return self._paths[path]
+
+    def feed(self, line):
+        """Parse the line of the output"""
+        match = INCLUDED_RE.match(line)
+        if match:
+            self._includes.append(self._path(match.group(1)))
+            self._last = None
+            return
+
+        match = SPARSE_INCLUDED_RE.match(line)
+        if match:
+            self._sparse_include = self._path(match.group(1))
+            self._last = None
+            return
+
+        match = GCC_RE.match(line)
+        if match:
+            (path, line_no, column, severity, message) = match.groups()
+            self._add(path, line_no, column, severity, message)
+            return
+
+        match = SMATCH_RE.match(line)
+        if match:
+            (path, line_no, func, severity, message) = match.groups()
+            self._add(path, line_no, None, severity, f"{func} {message}")
+            return
+
+        # The indented lines following the diagnostic belong to it
+        if not line[:1].isspace() or not line.strip():
+            self._last = None
+            return
+
+        if self._last and len(self._last.context or ()) < self.max_context:
+            if self._last.context is None:
+                self._last.context = []
+            self._last.context.append(line)
+
+    def _add(self, path, line_no, column, severity, message):
+        path = self._path(path)
+
+        # Sparse reports the included file until the next .c file
+        if path.endswith(".c"):
+            self._sparse_include = None
+        includes = tuple(self._includes)
+        if not includes and self._sparse_include:
+            includes = (self._sparse_include,)
+
+        record = Diagnostic(path, int(line_no),
+                            int(column) if column else None,
+                            sys.intern(severity), self.checker, message,
+                            includes)
+        self.store.add(record)
+        self._last = record
+
+        # gcc prints the include chain before each diagnostic
+        self._includes = []
+
+    def parse(self, output):
+        """Parse the whole output and return the store"""
+        for line in output.splitlines():
+            self.feed(line)
+
+        libs.log_debug(f"DiagnosticParser: {self.checker}: "
+                       f"{len(self.store)} records")
+        return self.store
@@ -0,0 +1,289 @@
+import re
+
+import libs
+
+# File status in the diff
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+RENAMED = "renamed"
+COPIED = "copied"
+
+DEV_NULL = "/dev/null"
+
+HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class Hunk:
+    """Hunk in the file diff. The line numbers are 1-based."""
+
+    def __init__(self, old_start, old_count, new_start, new_count):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+
+        # Line numbers of the added lines in the new file and the removed
+        # lines in the old file
+        self.added_lines = []
+        self.removed_lines = []
+
+        # Line numbers in the new file where the lines are removed
+        self.removal_points = []
+
+    def new_range(self):
+        """Return the (first, last) lines of the hunk in the new file or
+        None if the hunk has no line in the new file"""
+        if not self.new_count:
+            return None
+        return (self.new_start, self.new_start + self.new_count - 1)
+
+
+class FileDiff:
+    """Diff of a file"""
+
+    def __init__(self, old_path=None, new_path=None):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.status = MODIFIED
+        self.binary = False
+        self.hunks = []
+        self.insertions = 0
+        self.deletions = 0
+
+    @property
+    def path(self):
+        """Path of the file after the patch or the removed file"""
+        if self.status == REMOVED:
+            return self.old_path
+        return self.new_path
+
+    def _update_status(self):
+        if self.old_path is None and self.new_path is None:
+            return
+        if self.status != MODIFIED:
+            return
+        if self.old_path is None:
+            self.status = ADDED
+        elif self.new_path is None:
+            self.status = REMOVED
+        elif self.old_path != self.new_path:
+            self.status = RENAMED
+
+
+class PatchDiff:
+    """Parsed diff of a patch"""
+
+    def __init__(self, files=None):
+        self.files = files if files else []
+
+    @property
+    def insertions(self):
+        return sum(f.insertions for f in self.files)
+
+    @property
+    def deletions(self):
+        return sum(f.deletions for f in self.files)
+
+    def stats(self):
+        return {"files": len(self.files),
+                "insertions": self.insertions,
+                "deletions": self.deletions}
+
+    def get_file(self, path):
+        """Return the FileDiff of the path(after the patch) or None"""
+        for f in self.files:
+            if f.path == path:
+                return f
+        return None
+
+    def changed_files(self, ignore_new_file=False):
+        """Return the paths of the files in the tree after the patch"""
+        return [f.new_path for f in self.files
+                if f.status != REMOVED and
+                not (ignore_new_file and f.status == ADDED)]
+
+    def new_files(self):
+        """Return the paths of the files added by the patch"""
+        return [f.new_path for f in self.files if f.status == ADDED]
+
+    def base_files(self):
+        """Return the paths of the files in the tree before the patch"""
+        return [f.old_path for f in self.files if f.status != ADDED]
+
+
+def _strip_path(path):
+    """Return the path without the timestamp and the a/ or b/ prefix or None
+    for /dev/null"""
+    path = path.split('\t')[0].strip()
+    if len(path) > 1 and path[0] == '"' and path[-1] == '"':
+        path = path[1:-1]
+    if path == DEV_NULL:
+        return None
+    if path[:2] in ("a/", "b/"):
+        return path[2:]
+    return path
+
+
+def _git_header_paths(line):
+    """Return the (old, new) paths from the "diff --git a/X b/Y" line. The
+    paths are ambiguous if they have " b/", and the header lines after this
+    line fix them."""
+    names = line[len("diff --git "):]
+    idx = names.find(" b/")
+    if idx < 0:
+        return (None, None)
+    return (_strip_path(names[:idx]), _strip_path(names[idx + 1:]))
+
+
+def parse_diff(text):
+    """Parse the unified diff and return the PatchDiff. The diff is read
+    once from the beginning to the end."""
+    files = []
+    cur = None
+    hunk = None
+    old_left = new_left = 0
+    old_line = new_line = 0
+
+    if not text:
+        libs.log_error("WARNING: No diff to parse")
+        return PatchDiff()
+
+    for line in text.splitlines():
+        # Lines in the hunk
+        if hunk and (old_left > 0 or new_left > 0):
+            tag = line[:1]
+            if tag == '+':
+                hunk.added_lines.append(new_line)
+                cur.insertions += 1
+                new_line += 1
+                new_left -= 1
+                continue
+            if tag == '-':
+                hunk.removed_lines.append(old_line)
+                hunk.removal_points.append(new_line)
+                cur.deletions += 1
+                old_line += 1
+                old_left -= 1
+                continue
+            if tag in (' ', ''):
+                old_line += 1
+                new_line += 1
+                old_left -= 1
+                new_left -= 1
+                continue
+            if tag == '\\':
+                # "\ No newline at end of file"
+                continue
+            # Malformed hunk. Fall through to the header parser
+            hunk = None
+
+        if line.startswith("diff --git "):
+            cur = FileDiff(*_git_header_paths(line))
+            files.append(cur)
+            hunk = None
+            continue
+
+        if line.startswith("@@ ") and cur:
+            match = HUNK_RE.match(line)
+            if not match:
+                continue
+            old_start = int(match.group(1))
+            old_count = int(match.group(2)) if match.group(2) else 1
+            new_start = int(match.group(3))
+            new_count = int(match.group(4)) if match.group(4) else 1
+            hunk = Hunk(old_start, old_count, new_start, new_count)
+            cur.hunks.append(hunk)
+            old_left, new_left = old_count, new_count
+            old_line, new_line = old_start, new_start
+            continue
+
+        if line.startswith("--- "):
+            # Diff without the git header starts with the "---" line
+            if cur is None or cur.hunks:
+                cur = FileDiff()
+                files.append(cur)
+            cur.old_path = _strip_path(line[4:])
+            hunk = None
+            continue
+
+        if cur is None:
+            continue
+
+        if line.startswith("+++ "):
+            cur.new_path = _strip_path(line[4:])
+        elif line.startswith("new file mode"):
+            cur.old_path = None
+            cur.status = ADDED
+        elif line.startswith("deleted file mode"):
+            cur.new_path = None
+            cur.status = REMOVED
+        elif line.startswith("rename from "):
+            cur.old_path = line[len("rename from "):]
+            cur.status = RENAMED
+        elif line.startswith("rename to "):
+            cur.new_path = line[len("rename to "):]
+            cur.status = RENAMED
+        elif line.startswith("copy from "):
+            cur.old_path = line[len("copy from "):]
+            cur.status = COPIED
+        elif line.startswith("copy to "):
+            cur.new_path = line[len("copy to "):]
+            cur.status = COPIED
+        elif line.startswith("Binary files ") or line == "GIT binary patch":
+            cur.binary = True
+
+    for f in files:
+        f._update_status()
+
+    libs.log_debug(f"Files in the diff: {[f.path for f in files]}")
+
+    return PatchDiff(files)
+
+
+def series_files(diffs, ignore_new_file=False):
+    """Return the paths of the files in the tree after the patches in the
+    series are applied. The files removed by the series are not included and
+    the files added by the series are not included if ignore_new_file is
+    True."""
+    file_list = []
+    new_files = set()
+
+    for diff in diffs:
+        for f in diff.files:
+            if f.status in (REMOVED, RENAMED) and f.old_path in file_list:
+                file_list.remove(f.old_path)
+            if f.status == REMOVED:
+                new_files.discard(f.old_path)
+                continue
+
+            if f.status in (ADDED, COPIED) or f.old_path in new_files:
+                new_files.add(f.new_path)
+            if f.new_path not in file_list:
+                file_list.append(f.new_path)
+
+    if ignore_new_file:
+        file_list = [f for f in file_list if f not in new_files]
+
+    return file_list
+
+
+def series_base_files(diffs):
+    """Return the paths of the files in the tree before the series, which
+    are changed by the series"""
+    file_list = []
+    new_files = set()
+
+    for diff in diffs:
+        for f in diff.files:
+            if f.status in (ADDED, COPIED):
+                new_files.add(f.new_path)
+                continue
+            if f.old_path in new_files:
+                if f.status == RENAMED:
+                    new_files.add(f.new_path)
+                continue
+            if f.old_path not in file_list:
+                file_list.append(f.old_path)
+
+    return file_list
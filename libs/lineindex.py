@@ -0,0 +1,71 @@
+from bisect import bisect_right
+
+
+class LineIndex:
+    """Line Index class
+    This class keeps the changed line ranges of the files as the sorted and
+    merged intervals, so the lookup of the file:line is O(log n). Each range
+    is extended by the margin lines, so the diagnostic reported on the line
+    next to the changed line is also found.
+    """
+
+    def __init__(self, margin=3):
+        self.margin = margin
+        self._ranges = {}
+        self._starts = {}
+
+    @classmethod
+    def from_diff(cls, patch_diff, margin=3):
+        """Create the index from the PatchDiff. The line numbers are the
+        lines in the file after the patch"""
+        index = cls(margin)
+
+        for f in patch_diff.files:
+            if f.new_path is None:
+                continue
+            for hunk in f.hunks:
+                for line in hunk.added_lines:
+                    index.add(f.new_path, line, line)
+                # The lines next to the removed lines are changed too
+                for line in hunk.removal_points:
+                    index.add(f.new_path, line, line)
+
+        index.build()
+        return index
+
+    def add(self, path, first, last):
+        """Add the changed lines [first, last] of the file"""
+        first = max(1, first - self.margin)
+        last = last + self.margin
+        self._ranges.setdefault(path, []).append((first, last))
+
+    def build(self):
+        """Sort and merge the ranges. It needs to be called after add()"""
+        for path, ranges in self._ranges.items():
+            ranges.sort()
+            merged = [ranges[0]]
+            for (first, last) in ranges[1:]:
+                if first <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+                else:
+                    merged.append((first, last))
+            self._ranges[path] = merged
+            self._starts[path] = [r[0] for r in merged]
+
+    def files(self):
+        return list(self._ranges.keys())
+
+    def has_file(self, path):
+        return path in self._ranges
+
+    def contains(self, path, line):
+        """Return True if the line of the file is in the changed range"""
+        starts = self._starts.get(path)
+        if not starts:
+            return False
+
+        idx = bisect_right(starts, line) - 1
+        if idx < 0:
+            return False
+
+        return line <= self._ranges[path][idx][1]
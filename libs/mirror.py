@@ -0,0 +1,163 @@
+import os
+import fcntl
+import shutil
+import hashlib
+from urllib.parse import urlsplit
+
+import libs
+
+
+class MirrorManager:
+    """Mirror Manager class
+    This class manages the local bare mirrors of the upstream repos under the
+    root directory. The mirror is updated with the incremental fetch, and the
+    clone and the fetch of the repo use the mirror as the reference
+    (alternates), so only the objects not in the mirror are transferred.
+    """
+
+    def __init__(self, root):
+        self._root = os.path.abspath(root)
+
+        libs.log_info(f"MirrorManager: root: {self._root}")
+
+    def root(self):
+        return self._root
+
+    @staticmethod
+    def normalize_url(url):
+        """Return the url without the trailing "/" and ".git" and with the
+        lower case host, so the urls of the same repo use the same mirror"""
+        parts = urlsplit(url.strip())
+        path = parts.path.rstrip("/")
+        if path.endswith(".git"):
+            path = path[:-len(".git")].rstrip("/")
+
+        if not parts.scheme:
+            return path
+
+        return f"{parts.scheme.lower()}://{parts.netloc.lower()}{path}"
+
+    def mirror_path(self, url):
+        """Return the path of the mirror for the url"""
+        url = self.normalize_url(url)
+        name = os.path.basename(url)
+        url_hash = hashlib.sha1(url.encode()).hexdigest()[:8]
+        return os.path.join(self._root, f"{name}-{url_hash}.git")
+
+    def exists(self, url):
+        """Return True if the mirror of the url is populated"""
+        return os.path.exists(os.path.join(self.mirror_path(url), "HEAD"))
+
+    def _git(self, args, cwd=None):
+        return libs.cmd_run(["git"] + args, cwd=cwd)
+
+    def update(self, url):
+        """Create or update the mirror of the url. Returns the path of the
+        mirror or None if it fails."""
+        path = self.mirror_path(url)
+        os.makedirs(self._root, exist_ok=True)
+
+        # The mirror can be updated by other jobs at the same time
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            if os.path.exists(path):
+                libs.log_info(f"MirrorManager: update {path}")
+                (ret, stdout, stderr) = self._git(["fetch", "--prune",
+                                                   "origin"], cwd=path)
+            else:
+                # Clone to the temporary path first, so the interrupted
+                # clone doesn't leave the broken mirror
+                libs.log_info(f"MirrorManager: create {path}")
+                tmp_path = path + ".tmp"
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                (ret, stdout, stderr) = self._git(["clone", "--mirror", url,
+                                                   tmp_path])
+                if ret:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                else:
+                    os.rename(tmp_path, path)
+
+        if ret:
+            libs.log_error(f"MirrorManager: Failed to update the mirror: "
+                           f"{stderr}")
+            return None
+
+        return path
+
+    def clone(self, url, dest_dir, depth=None, branch=None,
+              fallback_depth=None):
+        """Clone the url to the dest_dir with the mirror as the reference.
+        If fallback_depth is given and the mirror is not populated, the
+        mirror is not created and the shallow clone with fallback_depth is
+        used instead, since creating the mirror takes longer than it. Same if
+        the mirror fails. Returns 0 if success."""
+        path = None
+        if fallback_depth and not self.exists(url):
+            libs.log_info(f"MirrorManager: No mirror for {url}. "
+                          f"Clone with depth={fallback_depth}")
+        else:
+            path = self.update(url)
+
+        if not path and fallback_depth:
+            depth = fallback_depth
+
+        ret = self._clone(url, dest_dir, path, depth, branch)
+        if ret and path and fallback_depth:
+            libs.log_error("MirrorManager: Failed to clone with the mirror. "
+                           f"Clone with depth={fallback_depth}")
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            ret = self._clone(url, dest_dir, None, fallback_depth, branch)
+
+        return ret
+
+    def _clone(self, url, dest_dir, path, depth, branch):
+        cmd = ["clone"]
+        if path:
+            cmd += ["--reference", path]
+        if depth:
+            cmd += [f"--depth={depth}"]
+        if branch:
+            cmd += ["--branch", branch]
+        cmd += [url, dest_dir]
+
+        (ret, stdout, stderr) = self._git(cmd)
+        if ret:
+            libs.log_error(f"MirrorManager: Failed to clone {url}: {stderr}")
+
+        return ret
+
+    def add_alternates(self, repo_dir, url):
+        """Add the mirror of the url to the alternates of the repo, so the
+        fetch in the repo uses the objects in the mirror. Returns 0 if
+        success."""
+        path = self.update(url)
+        if not path:
+            return 1
+
+        (ret, stdout, stderr) = self._git(["rev-parse", "--git-common-dir"],
+                                          cwd=repo_dir)
+        if ret:
+            libs.log_error(f"MirrorManager: Not a git repo: {repo_dir}")
+            return ret
+
+        git_dir = os.path.join(repo_dir, stdout.strip())
+        info_dir = os.path.join(git_dir, "objects", "info")
+        alternates = os.path.join(info_dir, "alternates")
+        objects_dir = os.path.join(path, "objects")
+
+        entries = []
+        if os.path.exists(alternates):
+            with open(alternates, "r") as f:
+                entries = f.read().splitlines()
+
+        if objects_dir in entries:
+            libs.log_debug(f"MirrorManager: alternates already set: {repo_dir}")
+            return 0
+
+        os.makedirs(info_dir, exist_ok=True)
+        with open(alternates, "a") as f:
+            f.write(objects_dir + "\n")
+        libs.log_info(f"MirrorManager: {repo_dir} uses {path}")
+
+        return 0
@@ -1,4 +1,7 @@
 import os
+import shutil
+import threading
+from contextlib import contextmanager
 from typing import List
 
 import libs
@@ -9,6 +12,14 @@ class RepoToolNotRepo(Exception):
 
 
 class RepoTool:
+    """Repo Tool class
+    This class runs the git commands in the repo. It also manages the pool of
+    the named worktrees under the worktree root(set_worktree_root()). The
+    worktree is created when it is leased first time, and it is reset to the
+    requested commit on every lease, so the tests can work on the isolated
+    trees at the same time. The worktrees not leased in the run are removed
+    by worktree_gc().
+    """
 
     def __init__(self, name, path, remote=None):
         self._name = name
@@ -19,10 +30,16 @@ class RepoTool:
         if remote:
             self._remote = remote
 
-        # Last executed stdout and stderr
+        # Last executed stdout and stderr. The tests running at the same time
+        # share the repo, so the helpers returning the output don't read them.
         self.stdout = None
         self.stderr = None
 
+        # Worktree pool
+        self._worktree_root = None
+        self._worktree_locks = {}
+        self._pool_lock = threading.Lock()
+
         self._verify_repo()
         libs.log_info(f'Git Repo({self._name}) verified: {self._path}')
 
@@ -30,9 +47,15 @@ class RepoTool:
         return self._path
 
     def git(self, args: List[str]):
-        (ret, self.stdout, self.stderr) = libs.cmd_run(["git"] + args,
-                                                       cwd=self._path)
-        return ret
+        return self._git(args)[0]
+
+    def _git(self, args: List[str]):
+        """Run the git command and return (ret, stdout, stderr). The last
+        output is updated too."""
+        (ret, stdout, stderr) = libs.cmd_run(["git"] + args, cwd=self._path)
+        self.stdout = stdout
+        self.stderr = stderr
+        return (ret, stdout, stderr)
 
     def _verify_repo(self):
         cmd = ["branch", "--show-current"]
@@ -43,6 +66,32 @@ class RepoTool:
         #     raise RepoToolNotRepo
         return ret
 
+    def git_rev_parse(self, ref):
+        """Return the commit id of the ref or None if it fails"""
+        (ret, stdout, stderr) = self._git(["rev-parse", "--verify", ref])
+        if ret:
+            return None
+
+        return stdout.strip()
+
+    def git_diff_files(self, base, head="HEAD"):
+        """Return the list of files changed between base and head or None if
+        it fails"""
+        (ret, stdout, stderr) = self._git(["diff", "--name-only", base, head])
+        if ret:
+            return None
+
+        return [f for f in stdout.splitlines() if f]
+
+    def git_diff(self, base, head="HEAD", context=3):
+        """Return the diff between base and head or None if it fails"""
+        (ret, stdout, stderr) = self._git(["diff", f"-U{context}", base,
+                                           head])
+        if ret:
+            return None
+
+        return stdout
+
     def git_checkout(self, branch, create_branch=False):
         cmd = ["checkout"]
 
@@ -90,3 +139,124 @@ class RepoTool:
         # Recursively remove all untracked files, not limited to gitignore
         return self.git(["clean", "-d", "--force", "-x"])
 
+    def set_worktree_root(self, root):
+        self._worktree_root = os.path.abspath(root)
+
+    def worktree_path(self, name):
+        """Return the path of the worktree"""
+        if not self._worktree_root:
+            return None
+
+        return os.path.join(self._worktree_root, name)
+
+    def _git_in(self, path, args):
+        """Run the git command in the path without updating the last output,
+        so it can run while the other thread uses the repo.
+        """
+        return libs.cmd_run(["git"] + args, cwd=path)
+
+    def _common_dir(self, path):
+        """Return the real path of the common git dir of the repo in the path
+        or None if it is not a valid repo"""
+        if not os.path.exists(os.path.join(path, ".git")):
+            return None
+
+        (ret, stdout, stderr) = self._git_in(path, ["rev-parse",
+                                                    "--git-common-dir"])
+        if ret:
+            return None
+
+        return os.path.realpath(os.path.join(path, stdout.strip()))
+
+    def _worktree_owned(self, path):
+        """Return True if the path is the worktree of this repo. The worktree
+        in the cache root is left over if the repo is cloned again."""
+        common_dir = self._common_dir(path)
+        if not common_dir:
+            return False
+
+        if common_dir != self._common_dir(self._path):
+            libs.log_info(f"Worktree {path} belongs to other repo")
+            return False
+
+        return True
+
+    def _worktree_reset(self, name, commit):
+        path = self.worktree_path(name)
+
+        # Resolve the ref in the repo. The ref like HEAD is different in the
+        # worktree.
+        (ret, stdout, stderr) = self._git_in(self._path,
+                                             ["rev-parse", "--verify", commit])
+        if ret:
+            libs.log_error(f"Failed to resolve {commit}: {stderr}")
+            return None
+        commit = stdout.strip()
+
+        if self._worktree_owned(path):
+            # Reuse the worktree. Keep the ignored files(i.e. configure) since
+            # the build outputs are not in the worktree.
+            self._git_in(path, ["am", "--abort"])
+            for args in (["reset", "--hard", commit],
+                         ["clean", "-d", "--force"]):
+                (ret, stdout, stderr) = self._git_in(path, args)
+                if ret:
+                    libs.log_error(f"Failed to reset worktree {name}: {stderr}")
+                    break
+            else:
+                libs.log_info(f"Worktree({name}) is reset to {commit}")
+                return path
+
+            libs.log_info(f"Worktree({name}): Create it again")
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        with self._pool_lock:
+            self._git_in(self._path, ["worktree", "prune"])
+            (ret, stdout, stderr) = self._git_in(self._path,
+                                                 ["worktree", "add", "--detach",
+                                                  path, commit])
+        if ret:
+            libs.log_error(f"Failed to add worktree {name}: {stderr}")
+            return None
+
+        libs.log_info(f"Worktree({name}) is created: {path}")
+        return path
+
+    @contextmanager
+    def worktree(self, name, commit):
+        """Lease the worktree checked out to the commit. The RepoTool of the
+        worktree is returned, or None if it fails. Only one user can lease
+        the worktree with the same name at a time.
+        """
+        with self._pool_lock:
+            if name not in self._worktree_locks:
+                self._worktree_locks[name] = threading.Lock()
+            lock = self._worktree_locks[name]
+
+        with lock:
+            path = None
+            if self._worktree_root:
+                path = self._worktree_reset(name, commit)
+            else:
+                libs.log_error("Worktree root is not set")
+
+            if not path:
+                yield None
+            else:
+                yield RepoTool(f"{self._name}-{name}", path,
+                               remote=self._remote)
+
+    def worktree_gc(self):
+        """Remove the worktrees which are not leased in this run"""
+        if not self._worktree_root or not os.path.exists(self._worktree_root):
+            return
+
+        with self._pool_lock:
+            for name in os.listdir(self._worktree_root):
+                if name in self._worktree_locks:
+                    continue
+                libs.log_info(f"Remove unused worktree: {name}")
+                shutil.rmtree(os.path.join(self._worktree_root, name))
+
+            self._git_in(self._path, ["worktree", "prune"])
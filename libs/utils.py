@@ -1,8 +1,11 @@
 import logging
 import os
+import signal
 import subprocess
+import threading
 import time
 import re
+from collections import deque
 from typing import List, Dict, Tuple
 
 # Global logging object
@@ -52,7 +55,18 @@ def pr_get_sid(pr_title):
     return sid
 
 def cmd_run(cmd: List[str], shell: bool = False, add_env: Dict[str, str] = None,
-            cwd: str = None, pass_fds=()) -> Tuple[str, str, str]:
+            cwd: str = None, pass_fds=(), stderr_cb=None,
+            stderr_tail: int = None, stdout_cb=None,
+            stdout_tail: int = None) -> Tuple[str, str, str]:
+    """Run the command and return (ret, stdout, stderr).
+    If stderr_cb is given, the stderr is read while the command is running
+    and each line(without the newline) is passed to stderr_cb. The returned
+    stderr has only the last stderr_tail lines if stderr_tail is given.
+    If stdout_cb is given, each line of the stdout is passed to stdout_cb and
+    the command and its children are killed when stdout_cb returns True. The
+    returned stdout has only the last stdout_tail lines if stdout_tail is
+    given.
+    """
     log_info(f"------------- CMD_RUN -------------")
     log_info(f"CMD: {cmd}")
 
@@ -65,20 +79,52 @@ def cmd_run(cmd: List[str], shell: bool = False, add_env: Dict[str, str] = None,
 
     start_time = time.time()
 
+    # The command runs in its own process group, so it can be killed with
+    # the children
     proc = subprocess.Popen(cmd, shell=shell, env=env, cwd=cwd,
                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                             bufsize=1, universal_newlines=True,
-                            pass_fds=pass_fds)
+                            pass_fds=pass_fds,
+                            start_new_session=stdout_cb is not None)
     log_debug(f"PROC args: {proc.args}")
 
+    # Read the stderr at the same time in the thread
+    reader = None
+    if stderr_cb:
+        stderr_lines = deque(maxlen=stderr_tail)
+
+        def _read_stderr():
+            for line in proc.stderr:
+                stderr_cb(line.rstrip('\n'))
+                stderr_lines.append(line)
+
+        reader = threading.Thread(target=_read_stderr, daemon=True)
+        reader.start()
+
     # Print the stdout in realtime
+    stdout_lines = deque(maxlen=stdout_tail)
+    killed = False
     for line in proc.stdout:
         log_debug("> " + line.rstrip('\n'))
-        stdout += line
-
-    # STDOUT returned by proc.communicate() is empty because it was all consumed
-    # by the above read.
-    _stdout, stderr = proc.communicate()
+        stdout_lines.append(line)
+
+        if stdout_cb and not killed and stdout_cb(line.rstrip('\n')):
+            log_error(f"Kill the process: {proc.pid}")
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            killed = True
+    stdout = "".join(stdout_lines)
+
+    if reader:
+        reader.join()
+        proc.wait()
+        stderr = "".join(stderr_lines)
+    else:
+        # STDOUT returned by proc.communicate() is empty because it was all
+        # consumed by the above read.
+        _stdout, stderr = proc.communicate()
     proc.stdout.close()
     proc.stderr.close()
 
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import argparse
+
+from libs import init_logger, log_error, log_info, MirrorManager
+
+def get_mirror_root(config_file):
+    """Read the mirror root from the config file"""
+    cache_root = '~/.cache/bzcafe'
+
+    if config_file and os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        cache_root = config.get('cache', {}).get('root', cache_root)
+
+    return os.path.join(os.path.expanduser(cache_root), "mirror")
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Manage the local mirrors")
+    ap.add_argument('-c', '--config', default='./config.json',
+                    help='Configuration file to use. default=./config.json')
+
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    update = sub.add_parser('update', help='Create or update the mirror')
+    update.add_argument('url', help='URL of the upstream repo')
+
+    clone = sub.add_parser('clone', help='Clone with the mirror as reference')
+    clone.add_argument('--depth', type=int, default=None,
+                       help='Create a shallow clone with the depth')
+    clone.add_argument('--branch', default=None,
+                       help='Branch to checkout')
+    clone.add_argument('--fallback-depth', type=int, default=None,
+                       help='Create a shallow clone with the depth if the '
+                            'mirror is not populated or fails')
+    clone.add_argument('url', help='URL of the upstream repo')
+    clone.add_argument('dest', help='Destination directory')
+
+    alternates = sub.add_parser('alternates',
+                                help='Use the mirror objects in the repo')
+    alternates.add_argument('repo', help='Path of the repo')
+    alternates.add_argument('url', help='URL of the upstream repo')
+
+    return ap.parse_args()
+
+def main():
+
+    init_logger("Mirror", verbose=True)
+
+    args = parse_args()
+
+    mirrors = MirrorManager(get_mirror_root(args.config))
+
+    if args.command == 'update':
+        if not mirrors.update(args.url):
+            sys.exit(1)
+    elif args.command == 'clone':
+        if mirrors.clone(args.url, args.dest, depth=args.depth,
+                         branch=args.branch,
+                         fallback_depth=args.fallback_depth):
+            sys.exit(1)
+    elif args.command == 'alternates':
+        if mirrors.add_alternates(args.repo, args.url):
+            sys.exit(1)
+    else:
+        log_error(f"Unknown command: {args.command}")
+        sys.exit(1)
+
+    log_info("Done")
+
+if __name__ == "__main__":
+    main()
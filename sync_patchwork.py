@@ -12,97 +12,6 @@ from github import Github
 from libs import init_logger, log_debug, log_error, log_info, pr_get_sid
 from libs import Patchwork, GithubTool, RepoTool, EmailTool, Context
 
-def patch_get_new_file_list(patch):
-    """
-    Parse patch to get the file that is newly added
-    """
-
-    file_list = []
-
-    # If patch has no contents, return empty file
-    if patch == None:
-        log_error("WARNING: No file found in patch")
-        return file_list
-
-    # split patch(in string) to list of string by newline
-    lines = patch.split('\n')
-    iter_lines = iter(lines)
-    for line in iter_lines:
-        try:
-            if re.search(r'^\-\-\- ', line):
-                if line.find('dev/null') >= 0:
-                    # Detect new file. Read next line to get the filename
-                    line2 = next(iter_lines)
-                    file_list.append(line2[line2.find('/')+1:])
-        except StopIteration:
-            # End of iteration or no next line. Nothing to do. Just pass
-            pass
-
-    log_debug(f"New file in the patch: {file_list}")
-
-    return file_list
-
-def patch_get_file_list(patch):
-    """
-    Parse patch to get the file list
-    """
-
-    file_list = []
-
-    # If patch has no contents, return empty file
-    if patch == None:
-        log_error("WARNING: No file found in patch")
-        return file_list
-
-    # split patch(in string) to list of string by newline
-    lines = patch.split('\n')
-    for line in lines:
-        # Use --- (before) instead of +++ (after).
-        # If new file is added, --- is /dev/null and can be ignored
-        # If file is removed, file in --- still exists in the tree
-        # The corner case is if the patch adds new files. Even in this case
-        # even if new files are ignored, Makefile should be changed as well
-        # so it still can be checked.
-        if re.search(r'^\-\-\- ', line):
-            # For new file, it should be dev/null. Ignore the file.
-            if line.find('dev/null') >= 0:
-                log_debug("New file is added. Ignore in the file list")
-                continue
-
-            # Trim the '--- /'
-            file_list.append(line[line.find('/')+1:])
-
-    log_debug(f"files found in the patch: {file_list}")
-
-    return file_list
-
-def series_get_file_list(ci_data, series, ignore_new_file=False):
-    """
-    Get the list of files from the patches in the series.
-    """
-
-    file_list = []
-    new_file_list = []
-
-    for patch in series['patches']:
-        full_patch = ci_data.pw.get_patch(patch['id'])
-        file_list += patch_get_file_list(full_patch['diff'])
-        if ignore_new_file:
-            new_file_list += patch_get_new_file_list(full_patch['diff'])
-
-    if ignore_new_file == False or len(new_file_list) == 0:
-        return file_list
-
-    log_debug("Check if new file is in the file list")
-    new_list = []
-    for filename in file_list:
-        if filename in new_file_list:
-            log_debug(f"file:{filename} is in new_file_list. Don't count.")
-            continue
-        new_list.append(filename)
-
-    return new_list
-
 def filter_repo_space(ci_data, space_details, series, src_dir):
     """
     Check if the series belong to this repository
@@ -132,8 +41,9 @@ def filter_repo_space(ci_data, space_details, series, src_dir):
             log_debug(f"Found INCLUDE string: {str}")
             return True
 
-    # Get file list from the patches in the series
-    file_list = series_get_file_list(ci_data, series, ignore_new_file=True)
+    # Get file list from the patches in the series. The new files are not in
+    # the source tree.
+    file_list = ci_data.series_base_file_list(series)
     if len(file_list) == 0:
         # Something is not right.
         log_error("ERROR: No files found in the series/patch")